@@ -5,14 +5,16 @@ os.environ["LOKY_MAX_CPU_COUNT"] = "4"  # Exemplo: usar 4 núcleos
 
 import streamlit as st
 import pandas as pd
-from utils.geocoding import get_coordinates
-from utils.routing import optimize_route, plan_route, plan_optimized_route
+import numpy as np
+from utils.geocoding import get_coordinates, geocode_addresses
+from utils.routing import optimize_route, plan_route, plan_optimized_route, PROGRESS_UPDATE_INTERVAL
 from utils.database import (
-    setup_database, insert_address, insert_person, get_all_person_address_data,
+    setup_database, resolve_address, insert_person, get_all_person_address_data,
     get_or_create_company, get_all_companies, insert_vehicle, get_all_vehicles,
     check_vehicle_exists, delete_vehicle, get_companies_with_persons,
     get_persons_by_company, get_company_address, create_route, add_route_stop,
-    get_all_routes, get_route_details, save_route_api_response, get_route_api_response
+    get_all_routes, get_route_details, save_route_api_response, get_route_api_response,
+    transaction
 )
 import time
 import re
@@ -29,7 +31,7 @@ from utils.clustering import optimize_clusters_by_proximity
 import logging
 
 def main():
-    # Setup database when app starts
+    # Setup database once per process (no-op on subsequent reruns)
     setup_database()
     
     st.title("Geocodificação e Gerenciamento de Rotas")
@@ -207,7 +209,7 @@ def main():
             st.dataframe(rotas_info)
             # Exibir mapa geral com rotas. Use uma paleta de cores mais ampla para evitar sobreposição.
             st.info("Mapa geral das rotas calculadas:")
-            display_multiple_routes_on_map(created_routes, st.session_state.start_coord, st.session_state.end_coord)
+            display_multiple_routes_on_map(created_routes, st.session_state.start_coord, st.session_state.end_coord, key="routes_overview")
         else:
             st.info("Nenhuma rota calculada ainda. Execute a roteirização na aba 'Roteirização'.")
 
@@ -280,6 +282,19 @@ def parse_entrada(entrada):
     
     return None
 
+def geocode_entry(coordinates, error=None):
+    """
+    Turn one geocode_addresses result into the row fields stored for it.
+    
+    A failed request (network, timeout, quota) is recorded as "Erro: ...",
+    apart from "Endereço não encontrado", so it can be retried later.
+    """
+    if error is not None:
+        return {"latitude": None, "longitude": None, "status": f"Erro: {str(error)}"}
+    if coordinates:
+        return {"latitude": coordinates['lat'], "longitude": coordinates['lon'], "status": "Sucesso"}
+    return {"latitude": None, "longitude": None, "status": "Endereço não encontrado"}
+
 def processar_entradas(linhas, company_name=None, arrival_time=None, departure_time=None):
     # Parse input lines
     entradas_parseadas = []
@@ -320,75 +335,70 @@ def processar_entradas(linhas, company_name=None, arrival_time=None, departure_t
     # Dictionary to store geocoding results by address
     resultados_geocoding = {}
     
-    # Process unique addresses
-    for i, (addr_key, endereco) in enumerate(enderecos_unicos.items()):
-        status_placeholder.text(f"Geocodificando endereço {i+1}/{len(enderecos_unicos)}: {endereco}")
-        try:
-            coordinates = get_coordinates(endereco)
-            if coordinates:
-                resultados_geocoding[addr_key] = {
-                    "latitude": coordinates['lat'],
-                    "longitude": coordinates['lon'],
-                    "status": "Sucesso"
-                }
-            else:
-                resultados_geocoding[addr_key] = {
-                    "latitude": None,
-                    "longitude": None,
-                    "status": "Endereço não encontrado"
-                }
-        except Exception as e:
-            resultados_geocoding[addr_key] = {
-                "latitude": None,
-                "longitude": None,
-                "status": f"Erro: {str(e)}"
-            }
-        
-        # Update progress bar
-        progress_bar.progress((i + 1) / len(enderecos_unicos))
-    
-    # Store data in the database
+    # Process unique addresses. geocode_addresses runs the HTTP round trips
+    # concurrently on worker threads; the UI is only touched here, as results
+    # arrive in input order. Each UI update is a websocket message and cached
+    # addresses resolve instantly, so refresh at most once every
+    # PROGRESS_UPDATE_INTERVAL seconds. The generator goes first in zip so it
+    # runs to completion and shuts its thread pool down
+    last_update = 0.0
+    geocoded = geocode_addresses(enderecos_unicos.values())
+    for i, ((coordinates, error), addr_key) in enumerate(zip(geocoded, enderecos_unicos)):
+        resultados_geocoding[addr_key] = geocode_entry(coordinates, error)
+        now = time.monotonic()
+        if now - last_update >= PROGRESS_UPDATE_INTERVAL:
+            progress_bar.progress((i + 1) / len(enderecos_unicos))
+            status_placeholder.text(f"Geocodificando endereço {i+1}/{len(enderecos_unicos)}: {enderecos_unicos[addr_key]}")
+            last_update = now
+    
+    progress_bar.progress(1.0)
+    
+    # Store data in the database (single transaction for the whole batch)
     resultados = []
     
-    for entrada in entradas_parseadas:
-        addr_key = f"{entrada['street']}|{entrada['number']}|{entrada['city']}"
-        geocode_result = resultados_geocoding.get(addr_key, {})
-        
-        try:
-            # Insert or get address
-            address_id = insert_address(
-                entrada['street'],
-                entrada['number'],
-                entrada['city'],
-                geocode_result.get('latitude'),
-                geocode_result.get('longitude'),
-                geocode_result.get('status')
-            )
+    with transaction() as conn:
+        for entrada in entradas_parseadas:
+            addr_key = f"{entrada['street']}|{entrada['number']}|{entrada['city']}"
+            geocode_result = resultados_geocoding.get(addr_key, {})
+        
+            try:
+                # Insert or get address (pending table when geocoding failed)
+                address_id, pending_address_id = resolve_address(
+                    entrada['street'],
+                    entrada['number'],
+                    entrada['city'],
+                    geocode_result.get('latitude'),
+                    geocode_result.get('longitude'),
+                    geocode_result.get('status'),
+                    conn=conn
+                )
             
-            # Insert person
-            person_id = insert_person(
-                entrada['name'], 
-                address_id,
-                company_id,
-                arrival_time,
-                departure_time
-            )
+                # Insert person
+                person_id = insert_person(
+                    entrada['name'], 
+                    address_id,
+                    company_id,
+                    arrival_time,
+                    departure_time,
+                    pending_address_id=pending_address_id,
+                    conn=conn
+                )
             
-            resultados.append({
-                "Nome": entrada['name'],
-                "Rua": entrada['street'],
-                "Número": entrada['number'],
-                "Cidade": entrada['city'],
-                "Empresa": company_name if company_name else "",
-                "Chegada": arrival_time if arrival_time else "",
-                "Saída": departure_time if departure_time else "",
-                "Latitude": geocode_result.get('latitude'),
-                "Longitude": geocode_result.get('longitude'),
-                "Status": geocode_result.get('status')
-            })
+                resultados.append({
+                    "Nome": entrada['name'],
+                    "Rua": entrada['street'],
+                    "Número": entrada['number'],
+                    "Cidade": entrada['city'],
+                    "Empresa": company_name if company_name else "",
+                    "Chegada": arrival_time if arrival_time else "",
+                    "Saída": departure_time if departure_time else "",
+                    "Latitude": geocode_result.get('latitude'),
+                    "Longitude": geocode_result.get('longitude'),
+                    "Status": geocode_result.get('status')
+                })
             
-        except Exception as e:
-            st.error(f"Erro ao salvar no banco de dados: {str(e)}")
+            except Exception as e:
+                st.error(f"Erro ao salvar no banco de dados: {str(e)}")
     
     status_placeholder.text("Processamento concluído! Dados salvos no banco de dados.")
     
@@ -496,82 +506,77 @@ def processar_dados_arquivo(df, col_nome, col_rua, col_numero, col_cidade,
     # Geocode unique addresses
     resultados_geocoding = {}
     
-    # Process unique addresses
-    for i, (addr_key, endereco) in enumerate(enderecos_unicos.items()):
-        status_placeholder.text(f"Geocodificando endereço {i+1}/{len(enderecos_unicos)}: {endereco}")
-        try:
-            coordinates = get_coordinates(endereco)
-            if coordinates:
-                resultados_geocoding[addr_key] = {
-                    "latitude": coordinates['lat'],
-                    "longitude": coordinates['lon'],
-                    "status": "Sucesso"
-                }
-            else:
-                resultados_geocoding[addr_key] = {
-                    "latitude": None,
-                    "longitude": None,
-                    "status": "Endereço não encontrado"
-                }
-        except Exception as e:
-            resultados_geocoding[addr_key] = {
-                "latitude": None,
-                "longitude": None,
-                "status": f"Erro: {str(e)}"
-            }
-        
-        # Update progress bar
-        progress_bar.progress((i + 1) / len(enderecos_unicos))
-    
-    # Store data in the database
+    # Process unique addresses. geocode_addresses runs the HTTP round trips
+    # concurrently on worker threads; the UI is only touched here, as results
+    # arrive in input order. Each UI update is a websocket message and cached
+    # addresses resolve instantly, so refresh at most once every
+    # PROGRESS_UPDATE_INTERVAL seconds. The generator goes first in zip so it
+    # runs to completion and shuts its thread pool down
+    last_update = 0.0
+    geocoded = geocode_addresses(enderecos_unicos.values())
+    for i, ((coordinates, error), addr_key) in enumerate(zip(geocoded, enderecos_unicos)):
+        resultados_geocoding[addr_key] = geocode_entry(coordinates, error)
+        now = time.monotonic()
+        if now - last_update >= PROGRESS_UPDATE_INTERVAL:
+            progress_bar.progress((i + 1) / len(enderecos_unicos))
+            status_placeholder.text(f"Geocodificando endereço {i+1}/{len(enderecos_unicos)}: {enderecos_unicos[addr_key]}")
+            last_update = now
+    
+    progress_bar.progress(1.0)
+    
+    # Store data in the database (single transaction for the whole batch)
     resultados = []
     
-    for entrada in entradas_validas:
-        addr_key = f"{entrada['street']}|{entrada['number']}|{entrada['city']}"
-        geocode_result = resultados_geocoding.get(addr_key, {})
-        
-        try:
-            # Get company ID
-            current_company_id = None
-            if entrada['company']:
-                current_company_id = get_or_create_company(entrada['company'])
-            elif company_id:
-                current_company_id = company_id
+    with transaction() as conn:
+        for entrada in entradas_validas:
+            addr_key = f"{entrada['street']}|{entrada['number']}|{entrada['city']}"
+            geocode_result = resultados_geocoding.get(addr_key, {})
+        
+            try:
+                # Get company ID
+                current_company_id = None
+                if entrada['company']:
+                    current_company_id = get_or_create_company(entrada['company'], conn=conn)
+                elif company_id:
+                    current_company_id = company_id
                 
-            # Insert or get address
-            address_id = insert_address(
-                entrada['street'],
-                entrada['number'],
-                entrada['city'],
-                geocode_result.get('latitude'),
-                geocode_result.get('longitude'),
-                geocode_result.get('status')
-            )
+                # Insert or get address (pending table when geocoding failed)
+                address_id, pending_address_id = resolve_address(
+                    entrada['street'],
+                    entrada['number'],
+                    entrada['city'],
+                    geocode_result.get('latitude'),
+                    geocode_result.get('longitude'),
+                    geocode_result.get('status'),
+                    conn=conn
+                )
             
-            # Insert person
-            person_id = insert_person(
-                entrada['name'], 
-                address_id,
-                current_company_id,
-                entrada['arrival'],
-                entrada['departure']
-            )
+                # Insert person
+                person_id = insert_person(
+                    entrada['name'], 
+                    address_id,
+                    current_company_id,
+                    entrada['arrival'],
+                    entrada['departure'],
+                    pending_address_id=pending_address_id,
+                    conn=conn
+                )
             
-            resultados.append({
-                "Nome": entrada['name'],
-                "Rua": entrada['street'],
-                "Número": entrada['number'],
-                "Cidade": entrada['city'],
-                "Empresa": entrada['company'] if entrada['company'] else "",
-                "Chegada": entrada['arrival'] if entrada['arrival'] else "",
-                "Saída": entrada['departure'] if entrada['departure'] else "",
-                "Latitude": geocode_result.get('latitude'),
-                "Longitude": geocode_result.get('longitude'),
-                "Status": geocode_result.get('status')
-            })
+                resultados.append({
+                    "Nome": entrada['name'],
+                    "Rua": entrada['street'],
+                    "Número": entrada['number'],
+                    "Cidade": entrada['city'],
+                    "Empresa": entrada['company'] if entrada['company'] else "",
+                    "Chegada": entrada['arrival'] if entrada['arrival'] else "",
+                    "Saída": entrada['departure'] if entrada['departure'] else "",
+                    "Latitude": geocode_result.get('latitude'),
+                    "Longitude": geocode_result.get('longitude'),
+                    "Status": geocode_result.get('status')
+                })
             
-        except Exception as e:
-            st.error(f"Erro ao salvar no banco de dados: {str(e)}")
+            except Exception as e:
+                st.error(f"Erro ao salvar no banco de dados: {str(e)}")
     
     status_placeholder.text("Processamento concluído! Dados salvos no banco de dados.")
     
@@ -671,18 +676,20 @@ def processar_cadastro_veiculos(linhas):
     sucesso = []
     falha = []
     
-    for veiculo in veiculos_parseados:
-        try:
-            insert_vehicle(
-                veiculo["model"],
-                veiculo["vehicle_number"],
-                veiculo["license_plate"],
-                veiculo["driver"],
-                veiculo["seats"]
-            )
-            sucesso.append(veiculo)
-        except Exception as e:
-            falha.append((veiculo, str(e)))
+    with transaction() as conn:
+        for veiculo in veiculos_parseados:
+            try:
+                insert_vehicle(
+                    veiculo["model"],
+                    veiculo["vehicle_number"],
+                    veiculo["license_plate"],
+                    veiculo["driver"],
+                    veiculo["seats"],
+                    conn=conn
+                )
+                sucesso.append(veiculo)
+            except Exception as e:
+                falha.append((veiculo, str(e)))
     
     if sucesso:
         st.success(f"{len(sucesso)} veículo(s) adicionado(s) com sucesso!")
@@ -752,18 +759,20 @@ def processar_arquivo_veiculos(file, col_model, col_number, col_plate, col_drive
         
         # Add vehicles to database
         sucesso = []
-        for veiculo in veiculos_novos:
-            try:
-                insert_vehicle(
-                    veiculo["model"],
-                    veiculo["vehicle_number"],
-                    veiculo["license_plate"],
-                    veiculo["driver"],
-                    veiculo["seats"]
-                )
-                sucesso.append(veiculo)
-            except Exception as e:
-                st.error(f"Erro ao adicionar veículo {veiculo['model']} ({veiculo['license_plate']}): {str(e)}")
+        with transaction() as conn:
+            for veiculo in veiculos_novos:
+                try:
+                    insert_vehicle(
+                        veiculo["model"],
+                        veiculo["vehicle_number"],
+                        veiculo["license_plate"],
+                        veiculo["driver"],
+                        veiculo["seats"],
+                        conn=conn
+                    )
+                    sucesso.append(veiculo)
+                except Exception as e:
+                    st.error(f"Erro ao adicionar veículo {veiculo['model']} ({veiculo['license_plate']}): {str(e)}")
         
         if sucesso:
             st.success(f"{len(sucesso)} veículo(s) adicionado(s) com sucesso!")
@@ -917,8 +926,12 @@ def create_new_route():
                 
                 with st.spinner("Planejando rotas..."):
                     # Geocodificar os pontos de partida e chegada
-                    start_coord = get_coordinates(start_point_str)
-                    end_coord = get_coordinates(end_point_str)
+                    try:
+                        start_coord = get_coordinates(start_point_str)
+                        end_coord = get_coordinates(end_point_str)
+                    except Exception as e:
+                        st.error(f"Falha ao consultar a geocodificação dos pontos de partida e chegada: {str(e)}")
+                        return
                     
                     # Store coordinates in session state
                     st.session_state.start_coord = start_coord
@@ -1058,13 +1071,18 @@ def plan_routes_by_time_constraint(start_coord, end_coord, passengers, max_durat
     routes = []
     
     # Vamos usar uma abordagem gulosa para criar rotas
-    # Começamos com todos os passageiros não atribuídos
-    unassigned_passengers = passengers.copy()
+    # Começamos com todos os passageiros não atribuídos. As coordenadas ficam
+    # em arrays (uma entrada por passageiro, na ordem recebida) e uma máscara
+    # marca quem ainda falta: cada busca do mais próximo é um argmin vetorizado,
+    # sem percorrer nem remover itens de uma lista de dicionários
+    lats = np.fromiter((p['lat'] for p in passengers), dtype=np.float64, count=len(passengers))
+    lons = np.fromiter((p['lon'] for p in passengers), dtype=np.float64, count=len(passengers))
+    unassigned = np.ones(len(passengers), dtype=bool)
     
     # Enquanto houver passageiros não atribuídos, criar mais rotas
     vehicle_type_index = 0  # Para alternar entre os tipos de veículos disponíveis
     
-    while unassigned_passengers:
+    while unassigned.any():
         # Seleciona o próximo tipo de veículo na lista (rotação cíclica)
         vehicle_type = vehicle_types[vehicle_type_index % len(vehicle_types)]
         vehicle_type_index += 1
@@ -1078,30 +1096,30 @@ def plan_routes_by_time_constraint(start_coord, end_coord, passengers, max_durat
         # Tenta adicionar o ponto inicial mais próximo à rota atual
         if not current_route['passengers']:
             # Se a rota estiver vazia, comece com o passageiro mais próximo do ponto de partida
-            nearest = find_nearest_passenger(start_coord, unassigned_passengers)
-            current_route['passengers'].append(nearest)
-            unassigned_passengers.remove(nearest)
+            nearest = find_nearest_passenger(start_coord, lats, lons, unassigned)
+            current_route['passengers'].append(passengers[nearest])
+            unassigned[nearest] = False
         
         # Continua adicionando passageiros à rota atual enquanto respeitar o limite de tempo
         keep_adding = True
-        while keep_adding and unassigned_passengers:
+        while keep_adding and unassigned.any():
             # Último passageiro adicionado à rota
             last_passenger = current_route['passengers'][-1]
             
             # Encontra o próximo passageiro mais próximo
-            nearest = find_nearest_passenger(last_passenger, unassigned_passengers)
+            nearest = find_nearest_passenger(last_passenger, lats, lons, unassigned)
             
             # Simula adição desse passageiro à rota
-            temp_passengers = current_route['passengers'] + [nearest]
+            temp_passengers = current_route['passengers'] + [passengers[nearest]]
             
             # Estima o tempo da rota com este novo passageiro, considerando tipo do veículo
             estimated_time = estimate_route_time(start_coord, end_coord, temp_passengers, vehicle_type)
             
             # Se ainda estiver dentro do limite, adiciona o passageiro
             if estimated_time <= max_duration_minutes:
-                current_route['passengers'].append(nearest)
+                current_route['passengers'].append(passengers[nearest])
                 current_route['estimated_time'] = estimated_time
-                unassigned_passengers.remove(nearest)
+                unassigned[nearest] = False
             else:
                 # Se exceder o limite, para de adicionar à rota atual
                 keep_adding = False
@@ -1113,8 +1131,10 @@ def plan_routes_by_time_constraint(start_coord, end_coord, passengers, max_durat
         # Se chegou aqui e ainda há passageiros não atribuídos mas não foi possível adicioná-los,
         # significa que estamos com um problema: o passageiro sozinho já excede o limite de tempo
         # Neste caso, forçamos a adição em uma nova rota
-        elif unassigned_passengers:
-            first_passenger = unassigned_passengers.pop(0)
+        elif unassigned.any():
+            first_index = int(unassigned.argmax())
+            unassigned[first_index] = False
+            first_passenger = passengers[first_index]
             solo_time = estimate_route_time(start_coord, end_coord, [first_passenger], vehicle_type)
             routes.append({
                 'passengers': [first_passenger],
@@ -1125,25 +1145,23 @@ def plan_routes_by_time_constraint(start_coord, end_coord, passengers, max_durat
     
     return routes
 
-def find_nearest_passenger(reference_point, passengers):
-    """
-    Encontra o passageiro mais próximo de um ponto de referência.
+def find_nearest_passenger(reference_point, lats, lons, unassigned):
     """
-    min_distance = float('inf')
-    nearest = None
-    
-    # Coordenadas do ponto de referência
-    ref_lat = reference_point['lat']
-    ref_lon = reference_point['lon']
-    
-    for passenger in passengers:
-        # Cálculo simplificado de distância (distância euclidiana)
-        distance = ((passenger['lat'] - ref_lat) ** 2 + (passenger['lon'] - ref_lon) ** 2) ** 0.5
-        if distance < min_distance:
-            min_distance = distance
-            nearest = passenger
+    Encontra o passageiro não atribuído mais próximo de um ponto de referência.
     
-    return nearest
+    Args:
+        reference_point: Ponto de referência com 'lat' e 'lon'
+        lats, lons: Arrays com as coordenadas de todos os passageiros
+        unassigned: Máscara booleana dos passageiros ainda não atribuídos
+        
+    Returns:
+        Índice do passageiro mais próximo (o primeiro, em caso de empate)
+    """
+    # Cálculo simplificado de distância (distância euclidiana, sem a raiz:
+    # a ordem é a mesma), com os já atribuídos fora da disputa
+    distances = (lats - reference_point['lat']) ** 2 + (lons - reference_point['lon']) ** 2
+    distances[~unassigned] = np.inf
+    return int(distances.argmin())
 
 def estimate_route_time(start_coord, end_coord, passengers, vehicle_type="car"):
     """
@@ -1582,12 +1600,12 @@ def calculate_vehicle_utilization(routes_with_vehicles):
     overall_utilization = total_passengers / total_seats if total_seats > 0 else 0
     
     # Registrar informações (para debug/análise)
-    logging.info(f"Utilização geral dos veículos: {overall_utilization:.1%}")
-    logging.info(f"Total de passageiros: {total_passengers}, Total de assentos: {total_seats}")
+    logging.info("Utilização geral dos veículos: %.1f%%", overall_utilization * 100)
+    logging.info("Total de passageiros: %s, Total de assentos: %s", total_passengers, total_seats)
     
     # Registrar utilização por veículo para debug
     for info in utilization_data:
-        logging.debug(f"Veículo: {info['vehicle']} - Utilização: {info['utilization']}")
+        logging.debug("Veículo: %s - Utilização: %s", info['vehicle'], info['utilization'])
     
     return overall_utilization
 
@@ -1659,37 +1677,40 @@ def create_routes_in_system(routes_with_vehicles, company_id, start_coord, end_c
                 # Removida a verificação e alerta sobre limite de tempo excedido
                 # O cálculo está correto, mas não precisamos mostrar alerta
                 
-                # Criar a rota no banco de dados com o tempo estimado correto
-                route_id = create_route(
-                    name=route_name,
-                    company_id=company_id,
-                    vehicle_id=vehicle['id'],
-                    is_arrival=is_arrival,
-                    start_address=start_point_str,
-                    end_address=end_point_str,
-                    start_lat=start_coord['lat'],
-                    start_lon=start_coord['lon'],
-                    end_lat=end_coord['lat'],
-                    end_lon=end_coord['lon'],
-                    created_at=datetime.now().strftime('%Y-%m-%d %H:%M:%S')
-                )
+                # Criar a rota e suas paradas em uma única transação
+                added_stops = []
+                with transaction() as conn:
+                    route_id = create_route(
+                        name=route_name,
+                        company_id=company_id,
+                        vehicle_id=vehicle['id'],
+                        is_arrival=is_arrival,
+                        start_address=start_point_str,
+                        end_address=end_point_str,
+                        start_lat=start_coord['lat'],
+                        start_lon=start_coord['lon'],
+                        end_lat=end_coord['lat'],
+                        end_lon=end_coord['lon'],
+                        created_at=datetime.now().strftime('%Y-%m-%d %H:%M:%S'),
+                        conn=conn
+                    )
+                    
+                    # Adicionar as paradas à rota
+                    for j, person_data in enumerate(passengers):
+                        add_route_stop(
+                            route_id=route_id,
+                            stop_order=j + 1,
+                            person_id=person_data['person_id'],
+                            lat=person_data['lat'],
+                            lon=person_data['lon'],
+                            conn=conn
+                        )
+                        added_stops.append(person_data['person_id'])
                 
                 # Salvar a resposta da API
                 if save_route_api_response(route_id, route_result):
                     st.success(f"Resposta da API para rota {i+1} salva com sucesso!")
                 
-                # Adicionar as paradas à rota
-                added_stops = []
-                for j, person_data in enumerate(passengers):
-                    add_route_stop(
-                        route_id=route_id,
-                        stop_order=j + 1,
-                        person_id=person_data['person_id'],
-                        lat=person_data['lat'],
-                        lon=person_data['lon']
-                    )
-                    added_stops.append(person_data['person_id'])
-                
                 # Adicionar a rota criada à lista, com o tempo estimado correto
                 created_routes.append({
                     "route_id": route_id,
@@ -2341,23 +2362,24 @@ def redistribute_passengers(clustering_result, force_include_all=False):
         reverse=True
     )
     
-    # 3. Redistribua os passageiros
-    remaining_passengers = all_passengers.copy()
+    # 3. Redistribua os passageiros, avançando um índice sobre a lista em vez
+    # de recortar a lista de restantes a cada veículo
+    next_passenger = 0
     
     for vehicle_id, vehicle in sorted_vehicles:
         # Número de assentos disponíveis neste veículo
         available_seats = vehicle['seats']
         
         # Atribuir passageiros até o limite de assentos
-        assigned_passengers = remaining_passengers[:available_seats]
+        assigned_passengers = all_passengers[next_passenger:next_passenger + available_seats]
         vehicle_assignments[vehicle_id]['passengers'] = assigned_passengers
+        next_passenger += len(assigned_passengers)
         
-        # Remover os passageiros atribuídos da lista de restantes
-        remaining_passengers = remaining_passengers[available_seats:]
-        
-        if not remaining_passengers:
+        if next_passenger >= len(all_passengers):
             break
     
+    remaining_passengers = all_passengers[next_passenger:]
+    
     # 4. Se ainda restaram passageiros e estamos forçando inclusão, tentar acomodá-los
     if remaining_passengers and force_include_all:
         st.warning(f"Ainda há {len(remaining_passengers)} passageiros sem veículo após redistribuição.")
@@ -46,7 +46,7 @@ class RateLimiter:
                     # Calculate how long to wait based on oldest request
                     wait_time = 60 - (now - self.request_times[0]).total_seconds()
                     if wait_time > 0:
-                        logging.debug(f"Rate limit approaching, waiting {wait_time:.2f} seconds")
+                        logging.debug("Rate limit approaching, waiting %.2f seconds", wait_time)
                         time.sleep(wait_time)
                         now = datetime.now()  # Update now after waiting
             
@@ -62,7 +62,7 @@ class RateLimiter:
                     
                     if elapsed < min_interval:
                         wait_time = min_interval - elapsed
-                        logging.debug(f"Throttling API requests, waiting {wait_time:.2f} seconds")
+                        logging.debug("Throttling API requests, waiting %.2f seconds", wait_time)
                         time.sleep(wait_time)
                         now = datetime.now()  # Update now after waiting
             
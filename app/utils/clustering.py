@@ -2,9 +2,11 @@ import numpy as np
 from sklearn.cluster import KMeans, DBSCAN
 from typing import List, Dict, Any, Tuple
 import logging
-from geopy.distance import great_circle
 from sklearn.metrics import pairwise_distances
 
+# Raio médio da Terra, para converter distâncias em km para radianos
+EARTH_RADIUS_KM = 6371.0
+
 def cluster_by_location(coordinates: List[Dict[str, Any]], num_clusters: int) -> List[int]:
     """
     Agrupa pontos em clusters com base em suas coordenadas geográficas
@@ -48,23 +50,18 @@ def cluster_by_dbscan(coordinates: List[Dict[str, Any]], eps_km: float = 1.0, mi
     if not coordinates:
         return []
     
-    # Extrair coordenadas
-    points = np.array([[point['lat'], 'lon']] for point in coordinates)
-    
-    # Calcular matriz de distância usando great_circle (distância em km)
-    n = len(points)
-    distance_matrix = np.zeros((n, n))
-    
-    for i in range(n):
-        for j in range(i+1, n):
-            coord1 = (points[i][0], points[i][1])
-            coord2 = (points[j][0], points[j][1])
-            distance_km = great_circle(coord1, coord2).kilometers
-            distance_matrix[i, j] = distance_matrix[j, i] = distance_km
+    # Extrair coordenadas em radianos, como a métrica haversine espera
+    points = np.radians(np.array([[point['lat'], point['lon']] for point in coordinates]))
     
-    # Aplicar DBSCAN com a matriz de distância personalizada
-    dbscan = DBSCAN(eps=eps_km, min_samples=min_samples, metric='precomputed')
-    cluster_indices = dbscan.fit_predict(distance_matrix)
+    # Aplicar DBSCAN com distância de grande círculo sobre uma BallTree, sem
+    # montar a matriz N x N de distâncias (eps convertido de km para radianos)
+    dbscan = DBSCAN(
+        eps=eps_km / EARTH_RADIUS_KM,
+        min_samples=min_samples,
+        metric='haversine',
+        algorithm='ball_tree'
+    )
+    cluster_indices = dbscan.fit_predict(points)
     
     return cluster_indices.tolist()
 
@@ -126,7 +123,7 @@ def cluster_passengers_for_vehicles(passengers: List[Dict[str, Any]],
                     })
                 else:
                     # Se ficaram passageiros sem veículos, adicionar a um veículo existente
-                    logging.warning(f"{len(cluster) - j} passageiros não puderam ser alocados a novos veículos")
+                    logging.warning("%d passageiros não puderam ser alocados a novos veículos", len(cluster) - j)
                     break
     
     return result_clusters
@@ -1,8 +1,12 @@
 import sqlite3
 import os
 import json
+import threading
+import queue
+from functools import wraps
+from contextlib import contextmanager
 from datetime import datetime
-from typing import Dict, Any
+from typing import Dict, Any, Final
 import logging
 
 # Ensure database directory exists
@@ -10,17 +14,304 @@ DB_DIR = os.path.join(os.path.dirname(os.path.dirname(__file__)), "data")
 os.makedirs(DB_DIR, exist_ok=True)
 DB_PATH = os.path.join(DB_DIR, "geocoding.db")
 
+# Bump whenever setup_database() changes the schema
+_SCHEMA_VERSION = 5
+_setup_lock = threading.Lock()
+_initialized = False
+
+_ADDRESSES_DDL: Final[str] = '''
+CREATE TABLE IF NOT EXISTS {table} (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    street TEXT,
+    number TEXT,
+    city TEXT,
+    latitude REAL NOT NULL CHECK (latitude BETWEEN -90 AND 90),
+    longitude REAL NOT NULL CHECK (longitude BETWEEN -180 AND 180),
+    status TEXT,
+    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+    UNIQUE(street, number, city)
+)
+'''
+
+# Prepared statements, kept as module constants so every call hands sqlite3
+# the same string and hits its per-connection statement cache
+SQL_SELECT_COMPANY_ID: Final[str] = 'SELECT id FROM companies WHERE name=?'
+
+SQL_INSERT_COMPANY: Final[str] = 'INSERT INTO companies (name) VALUES (?)'
+
+SQL_SELECT_ADDRESS_ID: Final[str] = '''
+SELECT id FROM addresses
+WHERE street=? AND number=? AND city=?
+'''
+
+SQL_INSERT_ADDRESS: Final[str] = '''
+INSERT INTO addresses (street, number, city, latitude, longitude, status)
+VALUES (?, ?, ?, ?, ?, ?)
+'''
+
+SQL_SELECT_PENDING_ADDRESS_ID: Final[str] = '''
+SELECT id FROM addresses_pending_geocode
+WHERE street=? AND number=? AND city=?
+'''
+
+SQL_INSERT_PENDING_ADDRESS: Final[str] = '''
+INSERT INTO addresses_pending_geocode (street, number, city, status)
+VALUES (?, ?, ?, ?)
+'''
+
+SQL_PROMOTE_PENDING_ADDRESS: Final[str] = '''
+UPDATE persons SET address_id = ?, pending_address_id = NULL
+WHERE pending_address_id = ?
+'''
+
+SQL_DELETE_PENDING_ADDRESS: Final[str] = "DELETE FROM addresses_pending_geocode WHERE id = ?"
+
+SQL_INSERT_PERSON: Final[str] = '''
+INSERT INTO persons (name, address_id, pending_address_id, company_id, arrival_time, departure_time)
+VALUES (?, ?, ?, ?, ?, ?)
+'''
+
+SQL_GET_ALL_PERSON_ADDRESS_DATA: Final[str] = '''
+SELECT p.name,
+       COALESCE(a.street, g.street) as street,
+       COALESCE(a.number, g.number) as number,
+       COALESCE(a.city, g.city) as city,
+       a.latitude, a.longitude,
+       COALESCE(a.status, g.status) as status,
+       c.name as company_name, p.arrival_time, p.departure_time
+FROM persons p
+LEFT JOIN addresses a ON p.address_id = a.id
+LEFT JOIN addresses_pending_geocode g ON p.pending_address_id = g.id
+LEFT JOIN companies c ON p.company_id = c.id
+WHERE a.id IS NOT NULL OR g.id IS NOT NULL
+ORDER BY p.name COLLATE NOCASE
+'''
+
+SQL_GET_ALL_COMPANIES: Final[str] = 'SELECT name FROM companies ORDER BY name'
+
+SQL_INSERT_VEHICLE: Final[str] = '''
+INSERT INTO vehicles (model, vehicle_number, license_plate, driver, seats)
+VALUES (?, ?, ?, ?, ?)
+'''
+
+SQL_GET_ALL_VEHICLES: Final[str] = '''
+SELECT id, model, vehicle_number, license_plate, driver, seats
+FROM vehicles
+ORDER BY model, vehicle_number
+'''
+
+SQL_VEHICLE_EXISTS_BY_NUMBER: Final[str] = "SELECT id FROM vehicles WHERE vehicle_number = ?"
+
+SQL_VEHICLE_EXISTS_BY_PLATE: Final[str] = "SELECT id FROM vehicles WHERE license_plate = ?"
+
+SQL_VEHICLE_EXISTS_BY_NUMBER_OR_PLATE: Final[str] = (
+    "SELECT id FROM vehicles WHERE vehicle_number = ? OR license_plate = ?"
+)
+
+SQL_DELETE_VEHICLE: Final[str] = "DELETE FROM vehicles WHERE id = ?"
+
+SQL_GET_COMPANIES_WITH_PERSONS: Final[str] = '''
+SELECT DISTINCT c.id, c.name
+FROM companies c
+JOIN persons p ON p.company_id = c.id
+ORDER BY c.name
+'''
+
+SQL_GET_PERSONS_BY_COMPANY_ARRIVAL: Final[str] = '''
+SELECT p.id, p.name, a.street, a.number, a.city, a.latitude, a.longitude,
+       p.arrival_time as scheduled_time
+FROM persons p
+JOIN addresses a ON p.address_id = a.id
+WHERE p.company_id = ?
+AND p.arrival_time IS NOT NULL
+ORDER BY p.name COLLATE NOCASE
+'''
+
+SQL_GET_PERSONS_BY_COMPANY_DEPARTURE: Final[str] = '''
+SELECT p.id, p.name, a.street, a.number, a.city, a.latitude, a.longitude,
+       p.departure_time as scheduled_time
+FROM persons p
+JOIN addresses a ON p.address_id = a.id
+WHERE p.company_id = ?
+AND p.departure_time IS NOT NULL
+ORDER BY p.name COLLATE NOCASE
+'''
+
+SQL_GET_COMPANY_ADDRESS: Final[str] = '''
+SELECT a.id, a.street, a.number, a.city, a.latitude, a.longitude, COUNT(*) as count
+FROM addresses a
+JOIN persons p ON p.address_id = a.id
+WHERE p.company_id = ?
+GROUP BY a.street, a.number, a.city
+ORDER BY count DESC
+LIMIT 1
+'''
+
+SQL_INSERT_ROUTE: Final[str] = '''
+INSERT INTO routes (
+    name, company_id, vehicle_id, is_arrival,
+    start_address, end_address,
+    start_lat, start_lon, end_lat, end_lon, created_at
+) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+'''
+
+SQL_INSERT_ROUTE_STOP: Final[str] = '''
+INSERT INTO route_stops (route_id, stop_order, person_id, lat, lon)
+VALUES (?, ?, ?, ?, ?)
+'''
+
+SQL_GET_ALL_ROUTES: Final[str] = '''
+SELECT r.id, r.name, r.company_id, c.name as company_name,
+       r.vehicle_id, r.is_arrival, r.created_at
+FROM routes r
+LEFT JOIN companies c ON r.company_id = c.id
+ORDER BY r.created_at DESC
+'''
+
+SQL_GET_ROUTE: Final[str] = '''
+SELECT r.id, r.name, r.company_id, c.name as company_name,
+       r.vehicle_id, v.model as vehicle_model, v.license_plate as vehicle_plate,
+       r.is_arrival, r.start_address, r.end_address,
+       r.start_lat, r.start_lon, r.end_lat, r.end_lon, r.created_at
+FROM routes r
+LEFT JOIN companies c ON r.company_id = c.id
+LEFT JOIN vehicles v ON r.vehicle_id = v.id
+WHERE r.id = ?
+'''
+
+SQL_GET_ROUTE_STOPS: Final[str] = '''
+SELECT rs.id, rs.stop_order, rs.person_id, rs.lat, rs.lon,
+       p.name as person_name, a.street, a.number, a.city
+FROM route_stops rs
+LEFT JOIN persons p ON rs.person_id = p.id
+LEFT JOIN addresses a ON p.address_id = a.id
+WHERE rs.route_id = ?
+ORDER BY rs.stop_order
+'''
+
+SQL_INSERT_ROUTE_API_RESPONSE: Final[str] = (
+    "INSERT INTO route_api_responses (route_id, response_json, created_at) VALUES (?, zeroblob(?), ?)"
+)
+
+SQL_GET_LATEST_ROUTE_API_RESPONSE_ID: Final[str] = (
+    "SELECT id FROM route_api_responses WHERE route_id = ? ORDER BY created_at DESC LIMIT 1"
+)
+
 def get_connection():
     """Create a connection to the SQLite database."""
-    conn = sqlite3.connect(DB_PATH)
+    conn = sqlite3.connect(DB_PATH, cached_statements=256)
     conn.execute("PRAGMA foreign_keys = ON")
     return conn
 
+def _new_read_connection():
+    """Create a pooled read-only connection (shared across Streamlit threads, one user at a time)."""
+    conn = sqlite3.connect(DB_PATH, cached_statements=256, check_same_thread=False)
+    conn.row_factory = sqlite3.Row
+    conn.execute("PRAGMA query_only = 1")
+    return conn
+
+# Idle read-only connections, reused so their page and statement caches stay warm
+_read_pool = queue.LifoQueue()
+
+def with_read_conn(func):
+    """
+    Run a read-only helper with a pooled connection passed as its first argument.
+    
+    The connection is returned to the pool afterwards without commit() or close().
+    """
+    @wraps(func)
+    def wrapper(*args, **kwargs):
+        try:
+            conn = _read_pool.get_nowait()
+        except queue.Empty:
+            conn = _new_read_connection()
+        try:
+            return func(conn, *args, **kwargs)
+        finally:
+            _read_pool.put(conn)
+    return wrapper
+
 def setup_database():
-    """Set up the database with required tables if they don't exist."""
-    conn = get_connection()
+    """Set up the database with required tables if they don't exist.
+
+    Runs at most once per process; databases already stamped with
+    _SCHEMA_VERSION via PRAGMA user_version are left untouched.
+    """
+    global _initialized
+    if _initialized:
+        return
+
+    with _setup_lock:
+        if _initialized:
+            return
+        conn = get_connection()
+        try:
+            if conn.execute("PRAGMA user_version").fetchone()[0] != _SCHEMA_VERSION:
+                # The addresses migration drops a referenced table, which needs
+                # FK enforcement off; the pragma is a no-op inside a transaction,
+                # so it is toggled around the whole setup
+                conn.execute("PRAGMA foreign_keys = OFF")
+                try:
+                    _create_schema(conn)
+                except Exception:
+                    conn.rollback()
+                    raise
+                finally:
+                    conn.execute("PRAGMA foreign_keys = ON")
+        finally:
+            conn.close()
+        _initialized = True
+
+def _migrate_addresses_not_null(conn):
+    """
+    Rebuild addresses with NOT NULL/CHECKed coordinates.
+    
+    Rows without coordinates move to addresses_pending_geocode and the persons
+    pointing at them are relinked through pending_address_id.
+    
+    Runs inside _create_schema's transaction, with foreign_keys already
+    turned off by setup_database (addresses is dropped while referenced).
+    """
+    cursor = conn.cursor()
+    cursor.execute('''
+    INSERT OR IGNORE INTO addresses_pending_geocode (street, number, city, status, created_at)
+    SELECT street, number, city, status, created_at
+    FROM addresses
+    WHERE latitude IS NULL OR longitude IS NULL
+    ''')
+    cursor.execute('''
+    UPDATE persons
+    SET pending_address_id = (
+            SELECT g.id
+            FROM addresses a
+            JOIN addresses_pending_geocode g
+              ON g.street IS a.street AND g.number IS a.number AND g.city IS a.city
+            WHERE a.id = persons.address_id
+        ),
+        address_id = NULL
+    WHERE address_id IN (
+        SELECT id FROM addresses WHERE latitude IS NULL OR longitude IS NULL
+    )
+    ''')
+    cursor.execute("DROP TABLE IF EXISTS addresses_v2")
+    cursor.execute(_ADDRESSES_DDL.format(table="addresses_v2"))
+    cursor.execute('''
+    INSERT INTO addresses_v2 (id, street, number, city, latitude, longitude, status, created_at)
+    SELECT id, street, number, city, CAST(latitude AS REAL), CAST(longitude AS REAL), status, created_at
+    FROM addresses
+    WHERE latitude IS NOT NULL AND longitude IS NOT NULL
+    ''')
+    cursor.execute("DROP TABLE addresses")
+    cursor.execute("ALTER TABLE addresses_v2 RENAME TO addresses")
+
+def _create_schema(conn):
+    """Create or migrate all tables and stamp the schema version."""
     cursor = conn.cursor()
     
+    # sqlite3 autocommits DDL, one fsync per statement: run the whole setup
+    # in a single explicit transaction instead
+    cursor.execute("BEGIN")
+    
     # Create companies table
     cursor.execute('''
     CREATE TABLE IF NOT EXISTS companies (
@@ -30,15 +321,17 @@ def setup_database():
     )
     ''')
     
-    # Create addresses table
+    # Create addresses table (geocoded only; see _ADDRESSES_DDL)
+    cursor.execute(_ADDRESSES_DDL.format(table="addresses"))
+    
+    # Addresses that could not be geocoded yet are kept apart so the hot
+    # table only holds rows with valid coordinates
     cursor.execute('''
-    CREATE TABLE IF NOT EXISTS addresses (
+    CREATE TABLE IF NOT EXISTS addresses_pending_geocode (
         id INTEGER PRIMARY KEY AUTOINCREMENT,
         street TEXT,
         number TEXT,
         city TEXT,
-        latitude REAL,
-        longitude REAL,
         status TEXT,
         created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
         UNIQUE(street, number, city)
@@ -51,15 +344,29 @@ def setup_database():
         id INTEGER PRIMARY KEY AUTOINCREMENT,
         name TEXT NOT NULL,
         address_id INTEGER,
+        pending_address_id INTEGER,
         company_id INTEGER,
         arrival_time TEXT,
         departure_time TEXT,
         created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
         FOREIGN KEY (address_id) REFERENCES addresses(id),
+        FOREIGN KEY (pending_address_id) REFERENCES addresses_pending_geocode(id),
         FOREIGN KEY (company_id) REFERENCES companies(id)
     )
     ''')
     
+    cursor.execute("PRAGMA table_info(persons)")
+    if not any(col[1] == 'pending_address_id' for col in cursor.fetchall()):
+        cursor.execute(
+            "ALTER TABLE persons ADD COLUMN pending_address_id INTEGER "
+            "REFERENCES addresses_pending_geocode(id)"
+        )
+    
+    # Older databases allowed NULL coordinates in addresses; split them out
+    cursor.execute("PRAGMA table_info(addresses)")
+    if any(col[1] == 'latitude' and not col[3] for col in cursor.fetchall()):
+        _migrate_addresses_not_null(conn)
+    
     # Create vehicles table
     cursor.execute('''
     CREATE TABLE IF NOT EXISTS vehicles (
@@ -127,264 +434,313 @@ def setup_database():
     )
     ''')
     
+    # Indexes backing the name-ordered person listings
+    cursor.execute('''
+    CREATE INDEX IF NOT EXISTS idx_persons_name_nocase
+    ON persons(name COLLATE NOCASE)
+    ''')
+    cursor.execute('''
+    CREATE INDEX IF NOT EXISTS idx_persons_company_name
+    ON persons(company_id, name COLLATE NOCASE)
+    ''')
+    
+    cursor.execute(f"PRAGMA user_version = {_SCHEMA_VERSION}")
     conn.commit()
-    conn.close()
 
-def get_or_create_company(name):
-    """Insert a company if it doesn't exist, or get its ID if it does."""
+@contextmanager
+def transaction():
+    """
+    Open a connection wrapped in a single transaction.
+    
+    Commits once when the block exits normally and rolls back if it raises,
+    so a batch of inserts pays for one commit instead of one per row.
+    
+    Yields:
+        sqlite3.Connection to pass as conn= to the insert/create helpers
+    """
+    conn = get_connection()
+    try:
+        yield conn
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+    finally:
+        conn.close()
+
+@contextmanager
+def _write_conn(conn=None):
+    """Yield the caller's connection as is, or a new transaction() when conn is None."""
+    if conn is not None:
+        yield conn
+        return
+    
+    with transaction() as conn:
+        yield conn
+
+def _get_or_create_company(conn, name):
+    """Get or insert a company using an open connection, without committing."""
     if not name:
         return None
         
-    conn = get_connection()
     cursor = conn.cursor()
     
     # Check if company already exists
-    cursor.execute('SELECT id FROM companies WHERE name=?', (name,))
+    cursor.execute(SQL_SELECT_COMPANY_ID, (name,))
     result = cursor.fetchone()
     
     if result:
-        company_id = result[0]
-    else:
-        # Insert new company
-        cursor.execute('INSERT INTO companies (name) VALUES (?)', (name,))
-        company_id = cursor.lastrowid
+        return result[0]
     
-    conn.commit()
-    conn.close()
+    # Insert new company
+    cursor.execute(SQL_INSERT_COMPANY, (name,))
+    return cursor.lastrowid
+
+def get_or_create_company(name, conn=None):
+    """
+    Insert a company if it doesn't exist, or get its ID if it does.
     
-    return company_id
+    With conn (from transaction()), runs on it without committing.
+    """
+    if not name:
+        return None
+        
+    with _write_conn(conn) as conn:
+        return _get_or_create_company(conn, name)
+
+def _insert_address(conn, street, number, city, latitude, longitude, status):
+    """
+    Get or insert a geocoded address using an open connection, without committing.
+    
+    Coordinates are cast to float once here. Persons waiting on this address in
+    addresses_pending_geocode are relinked to the new row.
+    
+    Raises:
+        ValueError: If latitude or longitude is missing; ungeocoded addresses
+            belong in addresses_pending_geocode (see _resolve_address)
+    """
+    if latitude is None or longitude is None:
+        raise ValueError(f"Missing coordinates for address {street}, {number}, {city}")
     
-def insert_address(street, number, city, latitude, longitude, status):
-    """Insert or get address and return its ID."""
-    conn = get_connection()
     cursor = conn.cursor()
     
     # Check if address already exists
-    cursor.execute('''
-    SELECT id FROM addresses 
-    WHERE street=? AND number=? AND city=?
-    ''', (street, number, city))
+    cursor.execute(SQL_SELECT_ADDRESS_ID, (street, number, city))
     
     result = cursor.fetchone()
     
     if result:
-        address_id = result[0]
-    else:
-        # Insert new address
-        cursor.execute('''
-        INSERT INTO addresses (street, number, city, latitude, longitude, status)
-        VALUES (?, ?, ?, ?, ?, ?)
-        ''', (street, number, city, latitude, longitude, status))
-        address_id = cursor.lastrowid
+        return result[0]
     
-    conn.commit()
-    conn.close()
+    # Insert new address
+    cursor.execute(SQL_INSERT_ADDRESS, (street, number, city, float(latitude), float(longitude), status))
+    address_id = cursor.lastrowid
+    
+    # Promote a previously failed geocode for the same address
+    cursor.execute(SQL_SELECT_PENDING_ADDRESS_ID, (street, number, city))
+    pending = cursor.fetchone()
+    if pending:
+        cursor.execute(SQL_PROMOTE_PENDING_ADDRESS, (address_id, pending[0]))
+        cursor.execute(SQL_DELETE_PENDING_ADDRESS, (pending[0],))
     
     return address_id
+    
+def _insert_pending_address(conn, street, number, city, status):
+    """Get or insert an address that could not be geocoded, without committing."""
+    cursor = conn.cursor()
+    
+    cursor.execute(SQL_SELECT_PENDING_ADDRESS_ID, (street, number, city))
+    result = cursor.fetchone()
+    
+    if result:
+        return result[0]
+    
+    cursor.execute(SQL_INSERT_PENDING_ADDRESS, (street, number, city, status))
+    return cursor.lastrowid
 
-def insert_person(name, address_id, company_id=None, arrival_time=None, departure_time=None):
-    """Insert a person with reference to their address and schedule."""
-    conn = get_connection()
+def _resolve_address(conn, street, number, city, latitude, longitude, status):
+    """
+    Store an address in the right table for its geocoding result.
+    
+    Returns:
+        Tuple (address_id, pending_address_id); exactly one of them is set
+    """
+    if latitude is None or longitude is None:
+        return None, _insert_pending_address(conn, street, number, city, status)
+    return _insert_address(conn, street, number, city, latitude, longitude, status), None
+
+def resolve_address(street, number, city, latitude, longitude, status, conn=None):
+    """
+    Insert or get an address in addresses, or in addresses_pending_geocode
+    when it has no coordinates.
+    
+    With conn (from transaction()), runs on it without committing.
+    
+    Returns:
+        Tuple (address_id, pending_address_id); exactly one of them is set
+    """
+    with _write_conn(conn) as conn:
+        return _resolve_address(conn, street, number, city, latitude, longitude, status)
+
+def insert_address(street, number, city, latitude, longitude, status, conn=None):
+    """
+    Insert or get a geocoded address and return its ID.
+    
+    With conn (from transaction()), runs on it without committing.
+    
+    Raises:
+        ValueError: If latitude or longitude is missing; addresses without
+            coordinates are no longer stored in the addresses table
+    """
+    with _write_conn(conn) as conn:
+        return _insert_address(conn, street, number, city, latitude, longitude, status)
+
+def _insert_person(conn, name, address_id, company_id=None, arrival_time=None, departure_time=None,
+                  pending_address_id=None):
+    """Insert a person using an open connection, without committing."""
     cursor = conn.cursor()
     
-    cursor.execute('''
-    INSERT INTO persons (name, address_id, company_id, arrival_time, departure_time)
-    VALUES (?, ?, ?, ?, ?)
-    ''', (name, address_id, company_id, arrival_time, departure_time))
+    cursor.execute(SQL_INSERT_PERSON, (name, address_id, pending_address_id, company_id, arrival_time, departure_time))
     
-    person_id = cursor.lastrowid
-    conn.commit()
-    conn.close()
+    return cursor.lastrowid
+
+def insert_person(name, address_id, company_id=None, arrival_time=None, departure_time=None,
+                  pending_address_id=None, conn=None):
+    """
+    Insert a person with reference to their address (or pending address) and schedule.
     
-    return person_id
+    With conn (from transaction()), runs on it without committing.
+    """
+    with _write_conn(conn) as conn:
+        return _insert_person(conn, name, address_id, company_id, arrival_time, departure_time,
+                              pending_address_id)
 
-def get_all_person_address_data():
+@with_read_conn
+def get_all_person_address_data(conn):
     """Get all persons with their addresses, company, and schedule information."""
-    conn = get_connection()
-    conn.row_factory = sqlite3.Row
     cursor = conn.cursor()
     
-    cursor.execute('''
-    SELECT p.name, a.street, a.number, a.city, a.latitude, a.longitude, a.status,
-           c.name as company_name, p.arrival_time, p.departure_time
-    FROM persons p
-    JOIN addresses a ON p.address_id = a.id
-    LEFT JOIN companies c ON p.company_id = c.id
-    ORDER BY p.name
-    ''')
+    cursor.execute(SQL_GET_ALL_PERSON_ADDRESS_DATA)
     
     results = [dict(row) for row in cursor.fetchall()]
-    conn.close()
-    
     return results
 
-def get_all_companies():
+@with_read_conn
+def get_all_companies(conn):
     """Get all companies from database."""
-    conn = get_connection()
-    conn.row_factory = sqlite3.Row
     cursor = conn.cursor()
     
-    cursor.execute('SELECT name FROM companies ORDER BY name')
+    cursor.execute(SQL_GET_ALL_COMPANIES)
     results = [row['name'] for row in cursor.fetchall()]
     
-    conn.close()
     return results
 
-def insert_vehicle(model, vehicle_number, license_plate, driver, seats):
-    """Insert a vehicle into the database."""
-    conn = get_connection()
+def _insert_vehicle(conn, model, vehicle_number, license_plate, driver, seats):
+    """Insert a vehicle using an open connection, without committing."""
     cursor = conn.cursor()
     
-    try:
-        cursor.execute('''
-        INSERT INTO vehicles (model, vehicle_number, license_plate, driver, seats)
-        VALUES (?, ?, ?, ?, ?)
-        ''', (model, vehicle_number, license_plate, driver, seats))
-        
-        vehicle_id = cursor.lastrowid
-        conn.commit()
-        
-        return vehicle_id
-    except Exception as e:
-        conn.rollback()
-        raise e
-    finally:
-        conn.close()
+    cursor.execute(SQL_INSERT_VEHICLE, (model, vehicle_number, license_plate, driver, seats))
+    
+    return cursor.lastrowid
 
-def get_all_vehicles():
+def insert_vehicle(model, vehicle_number, license_plate, driver, seats, conn=None):
+    """
+    Insert a vehicle into the database.
+    
+    With conn (from transaction()), runs on it without committing.
+    """
+    with _write_conn(conn) as conn:
+        return _insert_vehicle(conn, model, vehicle_number, license_plate, driver, seats)
+
+@with_read_conn
+def get_all_vehicles(conn):
     """Get all vehicles from the database."""
-    conn = get_connection()
-    conn.row_factory = sqlite3.Row
     cursor = conn.cursor()
     
-    cursor.execute('''
-    SELECT id, model, vehicle_number, license_plate, driver, seats
-    FROM vehicles
-    ORDER BY model, vehicle_number
-    ''')
+    cursor.execute(SQL_GET_ALL_VEHICLES)
     
     results = [dict(row) for row in cursor.fetchall()]
-    conn.close()
-    
     return results
 
-def check_vehicle_exists(vehicle_number=None, license_plate=None):
+@with_read_conn
+def check_vehicle_exists(conn, vehicle_number=None, license_plate=None):
     """Check if a vehicle with the given number or license plate exists."""
     if not vehicle_number and not license_plate:
         return False
         
-    conn = get_connection()
     cursor = conn.cursor()
     
-    query = "SELECT id FROM vehicles WHERE "
-    params = []
-    
-    if vehicle_number:
-        query += "vehicle_number = ?"
-        params.append(vehicle_number)
-        
-    if license_plate:
-        if vehicle_number:
-            query += " OR "
-        query += "license_plate = ?"
-        params.append(license_plate)
+    if vehicle_number and license_plate:
+        cursor.execute(SQL_VEHICLE_EXISTS_BY_NUMBER_OR_PLATE, (vehicle_number, license_plate))
+    elif vehicle_number:
+        cursor.execute(SQL_VEHICLE_EXISTS_BY_NUMBER, (vehicle_number,))
+    else:
+        cursor.execute(SQL_VEHICLE_EXISTS_BY_PLATE, (license_plate,))
     
-    cursor.execute(query, params)
     result = cursor.fetchone()
     
-    conn.close()
-    
     return result is not None
 
 def delete_vehicle(vehicle_id):
     """Delete a vehicle from the database."""
-    conn = get_connection()
-    cursor = conn.cursor()
-    
-    try:
-        cursor.execute("DELETE FROM vehicles WHERE id = ?", (vehicle_id,))
-        conn.commit()
+    with transaction() as conn:
+        cursor = conn.execute(SQL_DELETE_VEHICLE, (vehicle_id,))
         return cursor.rowcount > 0
-    except Exception as e:
-        conn.rollback()
-        raise e
-    finally:
-        conn.close()
 
-def get_companies_with_persons():
+@with_read_conn
+def get_companies_with_persons(conn):
     """Get all companies that have persons assigned to them."""
-    conn = get_connection()
-    conn.row_factory = sqlite3.Row
     cursor = conn.cursor()
     
-    cursor.execute('''
-    SELECT DISTINCT c.id, c.name
-    FROM companies c
-    JOIN persons p ON p.company_id = c.id
-    ORDER BY c.name
-    ''')
+    cursor.execute(SQL_GET_COMPANIES_WITH_PERSONS)
     
     results = [dict(row) for row in cursor.fetchall()]
-    conn.close()
-    
     return results
 
-def get_persons_by_company(company_id, arrival=True):
+@with_read_conn
+def get_persons_by_company(conn, company_id, arrival=True):
     """
     Get all persons for a specific company with their addresses.
     If arrival=True, get persons who need transportation TO the company (morning).
     If arrival=False, get persons who need transportation FROM the company (evening).
     """
-    conn = get_connection()
-    conn.row_factory = sqlite3.Row
     cursor = conn.cursor()
     
-    # For arrival routes, we filter by the arrival time field
-    # For departure routes, we filter by the departure time field
-    time_field = 'p.arrival_time' if arrival else 'p.departure_time'
-    
-    cursor.execute(f'''
-    SELECT p.id, p.name, a.street, a.number, a.city, a.latitude, a.longitude, 
-           {time_field} as scheduled_time
-    FROM persons p
-    JOIN addresses a ON p.address_id = a.id
-    WHERE p.company_id = ? 
-    AND {time_field} IS NOT NULL
-    AND a.latitude IS NOT NULL 
-    AND a.longitude IS NOT NULL
-    ORDER BY p.name
-    ''', (company_id,))
+    # Arrival routes filter on arrival_time, departure routes on departure_time
+    query = SQL_GET_PERSONS_BY_COMPANY_ARRIVAL if arrival else SQL_GET_PERSONS_BY_COMPANY_DEPARTURE
+    cursor.execute(query, (company_id,))
     
     results = [dict(row) for row in cursor.fetchall()]
-    conn.close()
-    
     return results
 
-def get_company_address(company_id):
+@with_read_conn
+def get_company_address(conn, company_id):
     """Get the most common address for employees of a company (assumed to be the company location)."""
-    conn = get_connection()
-    conn.row_factory = sqlite3.Row
     cursor = conn.cursor()
     
-    cursor.execute('''
-    SELECT a.id, a.street, a.number, a.city, a.latitude, a.longitude, COUNT(*) as count
-    FROM addresses a
-    JOIN persons p ON p.address_id = a.id
-    WHERE p.company_id = ?
-    GROUP BY a.street, a.number, a.city
-    ORDER BY count DESC
-    LIMIT 1
-    ''', (company_id,))
+    cursor.execute(SQL_GET_COMPANY_ADDRESS, (company_id,))
     
     result = cursor.fetchone()
-    conn.close()
-    
     if result:
         return dict(result)
     return None
 
+def _create_route(conn, name, company_id, vehicle_id, is_arrival, start_address, end_address,
+                  start_lat, start_lon, end_lat, end_lon, created_at=None):
+    """Insert a route using an open connection, without committing."""
+    cursor = conn.cursor()
+    
+    if created_at is None:
+        created_at = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+    
+    cursor.execute(SQL_INSERT_ROUTE, (name, company_id, vehicle_id, is_arrival, 
+          start_address, end_address, 
+          start_lat, start_lon, end_lat, end_lon, created_at))
+    
+    return cursor.lastrowid
+
 def create_route(name, company_id, vehicle_id, is_arrival, start_address, end_address, 
-                start_lat, start_lon, end_lat, end_lon, created_at=None):
+                start_lat, start_lon, end_lat, end_lon, created_at=None, conn=None):
     """
     Create a new route in the database
     
@@ -400,33 +756,25 @@ def create_route(name, company_id, vehicle_id, is_arrival, start_address, end_ad
         end_lat: Latitude of the ending point
         end_lon: Longitude of the ending point
         created_at: Timestamp when the route was created (defaults to current time)
+        conn: Open connection from transaction() to run on without committing
         
     Returns:
         ID of the newly created route
     """
-    conn = get_connection()
+    with _write_conn(conn) as conn:
+        return _create_route(conn, name, company_id, vehicle_id, is_arrival,
+                             start_address, end_address,
+                             start_lat, start_lon, end_lat, end_lon, created_at)
+
+def _add_route_stop(conn, route_id, stop_order, person_id, lat, lon):
+    """Insert a route stop using an open connection, without committing."""
     cursor = conn.cursor()
     
-    if created_at is None:
-        created_at = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
-    
-    cursor.execute('''
-    INSERT INTO routes (
-        name, company_id, vehicle_id, is_arrival, 
-        start_address, end_address, 
-        start_lat, start_lon, end_lat, end_lon, created_at
-    ) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
-    ''', (name, company_id, vehicle_id, is_arrival, 
-          start_address, end_address, 
-          start_lat, start_lon, end_lat, end_lon, created_at))
+    cursor.execute(SQL_INSERT_ROUTE_STOP, (route_id, stop_order, person_id, lat, lon))
     
-    route_id = cursor.lastrowid
-    conn.commit()
-    conn.close()
-    
-    return route_id
+    return cursor.lastrowid
 
-def add_route_stop(route_id, stop_order, person_id, lat, lon):
+def add_route_stop(route_id, stop_order, person_id, lat, lon, conn=None):
     """
     Add a stop to a route
     
@@ -436,49 +784,31 @@ def add_route_stop(route_id, stop_order, person_id, lat, lon):
         person_id: ID of the person at this stop
         lat: Latitude of the stop
         lon: Longitude of the stop
+        conn: Open connection from transaction() to run on without committing
         
     Returns:
         ID of the newly created stop
     """
-    conn = get_connection()
-    cursor = conn.cursor()
-    
-    cursor.execute('''
-    INSERT INTO route_stops (route_id, stop_order, person_id, lat, lon)
-    VALUES (?, ?, ?, ?, ?)
-    ''', (route_id, stop_order, person_id, lat, lon))
-    
-    stop_id = cursor.lastrowid
-    conn.commit()
-    conn.close()
-    
-    return stop_id
+    with _write_conn(conn) as conn:
+        return _add_route_stop(conn, route_id, stop_order, person_id, lat, lon)
 
-def get_all_routes():
+@with_read_conn
+def get_all_routes(conn):
     """
     Get all routes from the database
     
     Returns:
         List of route dictionaries
     """
-    conn = get_connection()
-    conn.row_factory = sqlite3.Row
     cursor = conn.cursor()
     
-    cursor.execute('''
-    SELECT r.id, r.name, r.company_id, c.name as company_name,
-           r.vehicle_id, r.is_arrival, r.created_at
-    FROM routes r
-    LEFT JOIN companies c ON r.company_id = c.id
-    ORDER BY r.created_at DESC
-    ''')
+    cursor.execute(SQL_GET_ALL_ROUTES)
     
     routes = [dict(row) for row in cursor.fetchall()]
-    conn.close()
-    
     return routes
 
-def get_route_details(route_id):
+@with_read_conn
+def get_route_details(conn, route_id):
     """
     Get detailed information about a route, including all stops
     
@@ -488,43 +818,21 @@ def get_route_details(route_id):
     Returns:
         Dictionary with route details and list of stops
     """
-    conn = get_connection()
-    conn.row_factory = sqlite3.Row
     cursor = conn.cursor()
     
     # Get route info - ensure column names match the table schema
-    cursor.execute('''
-    SELECT r.id, r.name, r.company_id, c.name as company_name,
-           r.vehicle_id, v.model as vehicle_model, v.license_plate as vehicle_plate, 
-           r.is_arrival, r.start_address, r.end_address,
-           r.start_lat, r.start_lon, r.end_lat, r.end_lon, r.created_at
-    FROM routes r
-    LEFT JOIN companies c ON r.company_id = c.id
-    LEFT JOIN vehicles v ON r.vehicle_id = v.id
-    WHERE r.id = ?
-    ''', (route_id,))
+    cursor.execute(SQL_GET_ROUTE, (route_id,))
     
     route_result = cursor.fetchone()
     if not route_result:
-        conn.close()
         return None
         
     route = dict(route_result)
     
     # Get stops
-    cursor.execute('''
-    SELECT rs.id, rs.stop_order, rs.person_id, rs.lat, rs.lon,
-           p.name as person_name, a.street, a.number, a.city
-    FROM route_stops rs
-    LEFT JOIN persons p ON rs.person_id = p.id
-    LEFT JOIN addresses a ON p.address_id = a.id
-    WHERE rs.route_id = ?
-    ORDER BY rs.stop_order
-    ''', (route_id,))
+    cursor.execute(SQL_GET_ROUTE_STOPS, (route_id,))
     
     stops = [dict(row) for row in cursor.fetchall()]
-    conn.close()
-    
     return {
         'route': route,
         'stops': stops
@@ -534,6 +842,9 @@ def save_route_api_response(route_id: int, api_response: dict) -> bool:
     """
     Saves the raw Geoapify API response for a route to the database.
     
+    The row is inserted with a zeroblob placeholder and the serialized bytes
+    are written straight into it through incremental BLOB I/O.
+    
     Args:
         route_id: ID of the route in the database
         api_response: Dictionary containing the API response
@@ -545,24 +856,36 @@ def save_route_api_response(route_id: int, api_response: dict) -> bool:
     cursor = conn.cursor()
     
     try:
-        # Serialize the API response to JSON
-        response_json = json.dumps(api_response)
+        # Serialize the API response to compact JSON (no whitespace, raw UTF-8)
+        buf = json.dumps(api_response, separators=(',', ':'), ensure_ascii=False).encode('utf-8')
         
-        # Save the response to the database
+        # Reserve the space and stream the bytes into it
         cursor.execute(
-            "INSERT INTO route_api_responses (route_id, response_json, created_at) VALUES (?, ?, ?)",
-            (route_id, response_json, datetime.now().strftime('%Y-%m-%d %H:%M:%S'))
+            SQL_INSERT_ROUTE_API_RESPONSE,
+            (route_id, len(buf), datetime.now().strftime('%Y-%m-%d %H:%M:%S'))
         )
+        with conn.blobopen("route_api_responses", "response_json", cursor.lastrowid) as blob:
+            blob.write(buf)
         
         conn.commit()
         return True
     except Exception as e:
-        logging.error(f"Error saving API response: {e}")
+        conn.rollback()
+        logging.error("Error saving API response: %s", e)
         return False
     finally:
         conn.close()
 
-def get_route_api_response(route_id: int) -> Dict[str, Any]:
+def _latest_route_api_response_rowid(conn, route_id: int):
+    """Return the rowid of the most recent API response for a route, or None."""
+    result = conn.execute(
+        SQL_GET_LATEST_ROUTE_API_RESPONSE_ID,
+        (route_id,)
+    ).fetchone()
+    return result[0] if result else None
+
+@with_read_conn
+def get_route_api_response(conn, route_id: int) -> Dict[str, Any]:
     """
     Retrieves the saved API response for a route.
     
@@ -572,21 +895,17 @@ def get_route_api_response(route_id: int) -> Dict[str, Any]:
     Returns:
         Dictionary containing the deserialized API response or None
     """
-    conn = get_connection()  # Use standard connection method
-    cursor = conn.cursor()
-    
     try:
-        cursor.execute(
-            "SELECT response_json FROM route_api_responses WHERE route_id = ? ORDER BY created_at DESC LIMIT 1",
-            (route_id,)
-        )
-        result = cursor.fetchone()
+        rowid = _latest_route_api_response_rowid(conn, route_id)
+        if rowid is None:
+            return None
         
-        if result and result[0]:
-            return json.loads(result[0])
+        with conn.blobopen("route_api_responses", "response_json", rowid, readonly=True) as blob:
+            data = blob.read()
+        
+        if data:
+            return json.loads(data)
         return None
     except Exception as e:
-        logging.error(f"Error retrieving API response: {e}")
+        logging.error("Error retrieving API response: %s", e)
         return None
-    finally:
-        conn.close()
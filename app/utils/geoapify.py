@@ -0,0 +1,131 @@
+"""
+Camada HTTP compartilhada das chamadas à Geoapify: sessão com novas
+tentativas, timeout e limites de concorrência e de taxa para todo o processo
+"""
+import os
+import time
+import logging
+from threading import BoundedSemaphore, Lock
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+# Máximo de requisições simultâneas à Geoapify (ajustável conforme o plano contratado)
+MAX_CONCURRENT_REQUESTS = int(os.environ.get("GEOAPIFY_CONCURRENCY", "8"))
+
+# Máximo de requisições por segundo à Geoapify (0 = sem limite de taxa, só de concorrência)
+MAX_REQUESTS_PER_SECOND = float(os.environ.get("GEOAPIFY_RATE_LIMIT", "0"))
+
+# Com até este número de requisições restantes na janela (X-RateLimit-Remaining),
+# as próximas aguardam o reset informado pela API, até RATE_LIMIT_MAX_PAUSE segundos
+RATE_LIMIT_LOW_WATERMARK = 2
+RATE_LIMIT_MAX_PAUSE = 60.0
+
+# Timeout (conexão, leitura) em segundos das chamadas à Geoapify
+REQUEST_TIMEOUT = (5, 30)
+
+# Sessão HTTP compartilhada: reaproveita conexões keep-alive com a Geoapify
+# (sem um novo handshake TLS por chamada) e repete 429/5xx com backoff
+_SESSION = requests.Session()
+_SESSION.mount("https://", HTTPAdapter(
+    pool_connections=MAX_CONCURRENT_REQUESTS,
+    pool_maxsize=2 * MAX_CONCURRENT_REQUESTS,
+    max_retries=Retry(
+        total=5,
+        backoff_factor=0.5,
+        status_forcelist=(429, 502, 503, 504),
+        allowed_methods=("GET", "POST"),
+        respect_retry_after_header=True
+    )
+))
+
+# Limita as requisições em voo em todo o processo, não só dentro de um pool:
+# fan-outs aninhados (várias rotas x geocodificação) não estouram a cota da API
+_GEOAPIFY_SEM = BoundedSemaphore(MAX_CONCURRENT_REQUESTS)
+
+class _TokenBucket:
+    """
+    Balde de fichas compartilhado entre threads: permite rajadas de até
+    `rate` requisições (no mínimo uma) e, depois delas, uma nova a cada
+    1/rate segundos.
+    """
+    
+    def __init__(self, rate: float):
+        self.rate = rate
+        # Com rate < 1 a capacidade ainda precisa comportar uma ficha inteira,
+        # senão acquire() nunca a alcança
+        self.capacity = max(1.0, rate)
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+        self.lock = Lock()
+    
+    def acquire(self):
+        """Bloqueia a thread atual até haver uma ficha disponível."""
+        while True:
+            with self.lock:
+                now = time.monotonic()
+                self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                wait = (1 - self.tokens) / self.rate
+            time.sleep(wait)
+
+_GEOAPIFY_RATE = _TokenBucket(MAX_REQUESTS_PER_SECOND) if MAX_REQUESTS_PER_SECOND > 0 else None
+
+# Instante (time.monotonic) até o qual novas requisições aguardam, definido
+# pelos cabeçalhos de limite de taxa da última resposta com a cota quase no fim
+_geoapify_pause_until = 0.0
+_GEOAPIFY_PAUSE_LOCK = Lock()
+
+def _rate_limit_pause(headers) -> float:
+    """
+    Segundos a aguardar antes da próxima requisição segundo os cabeçalhos de
+    limite de taxa de uma resposta; 0 enquanto a cota estiver folgada ou se
+    a API não os enviar.
+    """
+    try:
+        remaining = int(headers.get("X-RateLimit-Remaining", ""))
+    except ValueError:
+        return 0.0
+    if remaining > RATE_LIMIT_LOW_WATERMARK:
+        return 0.0
+    
+    for name in ("Retry-After", "X-RateLimit-Reset"):
+        try:
+            value = float(headers[name])
+        except (KeyError, ValueError):
+            continue
+        # O reset pode vir como instante (epoch) em vez de segundos
+        if value > 1e9:
+            value -= time.time()
+        return min(max(value, 0.0), RATE_LIMIT_MAX_PAUSE)
+    return 1.0
+
+def geoapify_request(method: str, url: str, **kwargs) -> requests.Response:
+    """
+    Faz uma requisição à Geoapify pela sessão compartilhada, respeitando o
+    limite global de requisições simultâneas e, se configurado, de
+    requisições por segundo. Respostas 429 são repetidas pela própria sessão
+    com backoff exponencial (e Retry-After, se enviado); quando os cabeçalhos
+    indicam a cota quase no fim, as requisições seguintes aguardam o reset.
+    """
+    global _geoapify_pause_until
+    kwargs.setdefault("timeout", REQUEST_TIMEOUT)
+    
+    wait = _geoapify_pause_until - time.monotonic()
+    if wait > 0:
+        time.sleep(wait)
+    
+    with _GEOAPIFY_SEM:
+        if _GEOAPIFY_RATE is not None:
+            _GEOAPIFY_RATE.acquire()
+        response = _SESSION.request(method, url, **kwargs)
+    
+    pause = _rate_limit_pause(response.headers)
+    if pause > 0:
+        logging.info("Cota da Geoapify quase no fim, aguardando %.1fs antes das próximas requisições", pause)
+        with _GEOAPIFY_PAUSE_LOCK:
+            _geoapify_pause_until = max(_geoapify_pause_until, time.monotonic() + pause)
+    return response
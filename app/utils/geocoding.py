@@ -1,6 +1,8 @@
-import requests
 import os
+from concurrent.futures import ThreadPoolExecutor
+from threading import Lock
 from dotenv import load_dotenv
+from .geoapify import MAX_CONCURRENT_REQUESTS, geoapify_request
 
 # Carrega variáveis de ambiente
 load_dotenv()
@@ -8,94 +10,182 @@ load_dotenv()
 # Pega a API key do ambiente
 API_KEY = os.getenv("GEOAPIFY_API_KEY")
 
-def get_coordinates(address, city=None):
+GEOCODE_URL = "https://api.geoapify.com/v1/geocode/search"
+COUNTRY_FILTER = "countrycode:br"
+
+# Endereços se repetem muito entre importações (escolas, garagens, embarques
+# recorrentes): (lat, lon), ou None se não encontrado, por endereço normalizado
+# (sem diferença de maiúsculas e espaços). Falhas de consulta não entram
+_COORDS_CACHE = {}
+_COORDS_CACHE_MAX_ENTRIES = 4096
+_COORDS_CACHE_LOCK = Lock()
+
+def parse_address(address, city=None):
     """
-    Obtém coordenadas de latitude e longitude para um endereço usando Geoapify API.
+    Separa um endereço no formato "RUA, NÚMERO, CIDADE" em seus componentes.
     
     Args:
-        address (str): O endereço a ser geocodificado no formato "RUA, NÚMERO, CIDADE"
-        city (str, opcional): Nome da cidade para limitar a busca (se não estiver no endereço)
+        address (str): O endereço completo
+        city (str, opcional): Cidade usada quando o endereço não traz uma
         
     Returns:
-        dict: Dicionário contendo latitude e longitude, ou None se não encontrado
+        tuple: (street, housenumber, city), com None nos campos ausentes
     """
-    if not API_KEY:
-        raise ValueError("API key da Geoapify não configurada. Configure a variável de ambiente GEOAPIFY_API_KEY.")
-    
-    # Processar o endereço no formato "RUA, NÚMERO, CIDADE"
     parts = [part.strip() for part in address.split(',')]
+    housenumber = None
     
     if len(parts) >= 3:  # Temos todos os componentes
-        street = parts[0].strip()
-        housenumber = parts[1].strip()
-        address_city = parts[2].strip()
-        
-        # Se a cidade também foi fornecida como parâmetro, priorizamos o que está no endereço
+        street, housenumber = parts[0], parts[1]
+        # A cidade passada como parâmetro tem prioridade sobre a do endereço
         if not city:
-            city = address_city
+            city = parts[2]
     elif len(parts) == 2:  # Possivelmente falta a cidade
-        street = parts[0].strip()
-        housenumber = parts[1].strip()
+        street, housenumber = parts[0], parts[1]
         # Usamos a cidade fornecida como parâmetro
     else:  # Formato inválido, tentamos usar como texto livre
         street = address
     
-    # URL para geocodificação estruturada
-    base_url = "https://api.geoapify.com/v1/geocode/search"
+    return street, housenumber or None, city or None
+
+def _first_result(response):
+    """
+    Extrai lat/lon do primeiro resultado de uma resposta da Geoapify.
     
-    params = {
-        "apiKey": API_KEY,
-        "format": "json"
+    Uma resposta de erro levanta requests.HTTPError em vez de virar None:
+    None fica reservado para o endereço que a API não encontrou.
+    """
+    response.raise_for_status()
+    
+    results = response.json().get("results", [])
+    if not results:
+        return None
+    
+    first_result = results[0]
+    return {
+        "lat": first_result.get("lat"),
+        "lon": first_result.get("lon")
     }
+
+def _query_geoapify(street, housenumber=None, city=None, country="Brazil"):
+    """
+    Consulta a Geoapify com campos de endereço já normalizados.
+    
+    As requisições passam por geoapify_request, com timeout, novas tentativas
+    e os limites de concorrência e de taxa compartilhados com o roteamento.
     
-    # Adicionar parâmetros de forma estruturada
-    if street:
-        params["street"] = street
+    A busca estruturada só é usada quando rua, número e cidade estão
+    presentes; endereços parciais vão direto para a busca por texto livre,
+    evitando uma requisição que quase sempre volta vazia.
     
-    if 'housenumber' in locals() and housenumber:
-        params["housenumber"] = housenumber
+    Args:
+        street (str): Nome da rua (ou texto livre)
+        housenumber (str, opcional): Número do imóvel
+        city (str, opcional): Cidade
+        country (str): País usado na busca estruturada
+        
+    Returns:
+        dict: Dicionário contendo latitude e longitude, ou None se não encontrado
+        
+    Raises:
+        requests.RequestException: Se a consulta falhar (rede, timeout, cota)
+    """
+    if not API_KEY:
+        raise ValueError("API key da Geoapify não configurada. Configure a variável de ambiente GEOAPIFY_API_KEY.")
     
+    text = street
+    if housenumber:
+        text = f"{text} {housenumber}"
     if city:
-        params["city"] = city
+        text = f"{text}, {city}"
     
-    # Adicionar país (opcional, mas melhora a precisão)
-    params["country"] = "Brazil"
+    text_params = {
+        "text": text,
+        "format": "json",
+        "filter": COUNTRY_FILTER,
+        "apiKey": API_KEY
+    }
     
-    response = requests.get(base_url, params=params)
+    # Endereço incompleto: busca por texto livre direto
+    if not (street and housenumber and city):
+        return _first_result(geoapify_request("GET", GEOCODE_URL, params=text_params))
     
-    if response.status_code == 200:
-        data = response.json()
-        results = data.get("results", [])
-        
-        if results:
-            # Pega o primeiro resultado
-            first_result = results[0]
-            return {
-                "lat": first_result.get("lat"),
-                "lon": first_result.get("lon")
-            }
+    params = {
+        "apiKey": API_KEY,
+        "format": "json",
+        "street": street,
+        "housenumber": housenumber,
+        "city": city,
+        # País e filtro reduzem os candidatos já no servidor
+        "country": country,
+        "filter": COUNTRY_FILTER
+    }
+    
+    result = _first_result(geoapify_request("GET", GEOCODE_URL, params=params))
+    if result:
+        return result
     
     # Se a busca estruturada falhar, tente com texto completo como fallback
-    if street and 'housenumber' in locals() and housenumber and city:
-        fallback_text = f"{street} {housenumber}, {city}"
-        params = {
-            "text": fallback_text,
-            "format": "json",
-            "apiKey": API_KEY
-        }
+    return _first_result(geoapify_request("GET", GEOCODE_URL, params=text_params))
+
+def get_coordinates(address, city=None):
+    """
+    Obtém coordenadas de latitude e longitude para um endereço usando Geoapify API.
+    
+    Endereços repetidos (sem diferença de maiúsculas e espaços) são servidos
+    de um cache em memória, sem nova consulta à API.
+    
+    Args:
+        address (str): O endereço a ser geocodificado no formato "RUA, NÚMERO, CIDADE"
+        city (str, opcional): Nome da cidade para limitar a busca (se não estiver no endereço)
+        
+    Returns:
+        dict: Dicionário contendo latitude e longitude, ou None se não encontrado
         
-        response = requests.get(base_url, params=params)
+    Raises:
+        requests.RequestException: Se a consulta falhar (rede, timeout, cota)
+    """
+    parts = parse_address(address, city)
+    # Só a chave do cache é normalizada; a API recebe o endereço como veio
+    key = tuple(" ".join(part.split()).lower() if part else part for part in parts)
+    
+    with _COORDS_CACHE_LOCK:
+        cached = key in _COORDS_CACHE
+        coords = _COORDS_CACHE.get(key)
+    
+    if not cached:
+        result = _query_geoapify(*parts)
+        coords = None if result is None else (result["lat"], result["lon"])
+        with _COORDS_CACHE_LOCK:
+            # Cheio: descarta a entrada mais antiga
+            if len(_COORDS_CACHE) >= _COORDS_CACHE_MAX_ENTRIES:
+                del _COORDS_CACHE[next(iter(_COORDS_CACHE))]
+            _COORDS_CACHE[key] = coords
+    
+    if coords is None:
+        return None
+    # Dicionário novo a cada chamada: quem recebe pode alterá-lo sem mexer no cache
+    return {"lat": coords[0], "lon": coords[1]}
+
+def _coordinates_or_error(address, city=None):
+    """get_coordinates que devolve a falha em vez de levantá-la: (coordenadas, erro)."""
+    try:
+        return get_coordinates(address, city), None
+    except Exception as e:
+        return None, e
+
+def geocode_addresses(addresses, city=None):
+    """
+    Geocodifica vários endereços em paralelo, até MAX_CONCURRENT_REQUESTS
+    consultas por vez (limites de taxa a cargo de geoapify_request).
+    
+    Args:
+        addresses (iterable): Endereços no formato "RUA, NÚMERO, CIDADE"
+        city (str, opcional): Cidade usada quando o endereço não traz uma
         
-        if response.status_code == 200:
-            data = response.json()
-            results = data.get("results", [])
-            
-            if results:
-                # Pega o primeiro resultado
-                first_result = results[0]
-                return {
-                    "lat": first_result.get("lat"),
-                    "lon": first_result.get("lon")
-                }
-    
-    return None
\ No newline at end of file
+    Yields:
+        tuple: (coordenadas, erro) para cada endereço, na ordem de entrada,
+        assim que ficam prontos; coordenadas é None se não encontrado ou se a
+        consulta falhou, e erro é a exceção da consulta que falhou
+    """
+    with ThreadPoolExecutor(max_workers=MAX_CONCURRENT_REQUESTS) as executor:
+        yield from executor.map(lambda address: _coordinates_or_error(address, city), addresses)
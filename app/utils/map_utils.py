@@ -1,18 +1,38 @@
 import folium
-from streamlit_folium import folium_static
+import numpy as np
+from streamlit_folium import folium_static, st_folium
 import streamlit as st
-from folium.plugins import MarkerCluster
+import streamlit.components.v1 as components
+from folium.plugins import Fullscreen, LocateControl, MarkerCluster, MeasureControl
 from branca.element import Figure, MacroElement
 from jinja2 import Template
 import random
+from collections import defaultdict
 import hashlib
+import zlib
 import polyline
 import logging
 import requests
 import os
 import json
 import time
+from functools import lru_cache
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from .routing_cache import shared_routing_cache
+from .geoapify import MAX_CONCURRENT_REQUESTS, geoapify_request
+from .routing import VEHICLE_TO_MODE
 
+logger = logging.getLogger(__name__)
+
+# Palavras-chave do modelo para cada tipo de veículo, na ordem de prioridade
+VEHICLE_TYPE_KEYWORDS = (
+    ("bus", ("ônibus", "onibus", "bus")),
+    ("van", ("van", "sprint", "ducato", "boxer", "kombi")),
+    ("truck", ("caminhão", "caminhao", "truck")),
+    ("motorcycle", ("moto", "bike", "motorcycle")),
+)
+
+@lru_cache(maxsize=256)
 def get_vehicle_type(vehicle_model):
     """
     Determina o tipo de veículo com base no modelo.
@@ -26,16 +46,11 @@ def get_vehicle_type(vehicle_model):
     vehicle_model = vehicle_model.lower() if vehicle_model else ""
     
     # Detectar tipo de veículo com base em palavras-chave no modelo
-    if any(keyword in vehicle_model for keyword in ["ônibus", "onibus", "bus"]):
-        return "bus"
-    elif any(keyword in vehicle_model for keyword in ["van", "sprint", "ducato", "boxer", "kombi"]):
-        return "van"
-    elif any(keyword in vehicle_model for keyword in ["caminhão", "caminhao", "truck"]):
-        return "truck"
-    elif any(keyword in vehicle_model for keyword in ["moto", "bike", "motorcycle"]):
-        return "motorcycle"
-    else:
-        return "car"  # Tipo padrão
+    for vehicle_type, keywords in VEHICLE_TYPE_KEYWORDS:
+        if any(keyword in vehicle_model for keyword in keywords):
+            return vehicle_type
+    
+    return "car"  # Tipo padrão
 
 # Paleta de cores distintas para melhor diferenciação das rotas
 DISTINCT_COLORS = [
@@ -45,6 +60,13 @@ DISTINCT_COLORS = [
     '#8B0707', '#329262', '#5574A6', '#FF6347', '#4B0082'
 ]
 
+# Cores nomeadas do Folium para o mapa de múltiplas rotas (também válidas nos ícones)
+_ROUTE_COLORS = (
+    'blue', 'red', 'green', 'purple', 'orange', 'darkred',
+    'darkblue', 'darkgreen', 'cadetblue', 'pink', 'lightblue',
+    'lightgreen', 'gray', 'black', 'lightred', 'beige'
+)
+
 # Estilos de linha para melhor diferenciação visual
 LINE_STYLES = [
     {'weight': 4, 'opacity': 0.8, 'dashArray': None},     # Linha sólida
@@ -53,6 +75,7 @@ LINE_STYLES = [
     {'weight': 4, 'opacity': 0.8, 'dashArray': '15, 10, 1, 10'} # Traço-ponto
 ]
 
+@lru_cache(maxsize=1024)
 def get_color_for_route(index, route_id=None):
     """
     Obtém uma cor distinta para uma rota baseada no índice ou ID
@@ -67,54 +90,163 @@ def get_color_for_route(index, route_id=None):
     # Se temos um route_id, usá-lo para gerar uma cor consistente
     if route_id:
         # Converter route_id para um índice estável na paleta de cores
-        hash_val = int(hashlib.md5(str(route_id).encode()).hexdigest(), 16)
-        color_idx = hash_val % len(DISTINCT_COLORS)
+        # crc32 basta aqui: só precisamos de um índice estável, não de um hash criptográfico
+        color_idx = zlib.crc32(str(route_id).encode()) % len(DISTINCT_COLORS)
         return DISTINCT_COLORS[color_idx]
     
     # Caso contrário, usar o índice na lista de cores
     return DISTINCT_COLORS[index % len(DISTINCT_COLORS)]
 
+# Templates HTML reutilizados em todos os mapas (preenchidos com str.format)
+_WAYPOINT_POPUP = (
+    '<div style="font-family: Arial; width: 200px;">'
+    '<h4>Parada {idx}</h4>'
+    '<b>Passageiro:</b> {name}<br>'
+    '<b>ID:</b> {pid}'
+    '</div>'
+)
+_WAYPOINT_GROUP_POPUP = (
+    '<div style="font-family: Arial; width: 200px;">'
+    '<h4>Paradas {stops}</h4>'
+    '{passengers}'
+    '</div>'
+)
+_WAYPOINT_GROUP_ROW = '<b>Passageiro:</b> {name} (ID {pid})<br>'
+_STRAIGHT_LINE_WARNING_HTML = (
+    '<div style="position: fixed; bottom: 10px; left: 10px; z-index: 1000; '
+    'background-color: #ffcccc; padding: 10px; border-radius: 5px; '
+    'border: 2px solid red; font-weight: bold; max-width: 300px;">'
+    '⚠️ AVISO: Esta rota é uma aproximação em linha reta '
+    'e NÃO representa o trajeto real em ruas!'
+    '</div>'
+)
+
+_LEGEND_HEADER = (
+    '<div style="position: fixed; bottom: 50px; left: 50px; z-index: 1000; background-color: white; '
+    'padding: 10px; border: 2px solid grey; border-radius: 5px;">'
+    '<h4>Legenda - Rotas</h4>'
+)
+_LEGEND_ROW = (
+    '<div>'
+    '<span style="background-color:{color}; width:20px; height:10px; display:inline-block; margin-right:5px;"></span>'
+    '<span>Rota {idx}: {vehicle} ({count} passageiros)</span>'
+    '</div>'
+)
+
+@lru_cache(maxsize=64)
+def _legend_html(entries):
+    """
+    HTML da legenda do mapa de múltiplas rotas.
+    
+    Args:
+        entries: Tupla de (cor, descrição do veículo, nº de passageiros) por rota
+    """
+    parts = [_LEGEND_HEADER]
+    parts.extend(
+        _LEGEND_ROW.format(color=color, idx=i, vehicle=vehicle, count=count)
+        for i, (color, vehicle, count) in enumerate(entries, start=1)
+    )
+    parts.append('</div>')
+    return ''.join(parts)
+
 def get_line_style(index):
     """Obtém um estilo de linha baseado no índice"""
     return LINE_STYLES[index % len(LINE_STYLES)]
 
-def get_route_geometry(start_point, end_point, waypoints, vehicle_type="car"):
+class _RouteUnavailable(Exception):
+    """Falha ao obter a rota; levantada para que o st.cache_data não memorize o None."""
+
+def _route_cache_key(all_points, travel_mode):
     """
-    Obtém geometria real de rota da API Geoapify, garantindo que o trajeto siga ruas reais
+    Gera a chave de cache de uma rota a partir dos pontos (em ordem) e do modo.
     
-    Args:
-        start_point: Ponto de partida {lat, lon}
-        end_point: Ponto de chegada {lat, lon}
-        waypoints: Lista de waypoints intermediários [{lat, lon}, ...]
-        vehicle_type: Tipo de veículo (car, bus, etc.)
+    As coordenadas são arredondadas para 5 casas decimais (~1 m), de modo que
+    pequenas variações de ponto flutuante reaproveitem a mesma entrada.
+    """
+    key_data = {
+        "points": [(round(point['lat'], 5), round(point['lon'], 5)) for point in all_points],
+        "mode": travel_mode
+    }
+    return hashlib.blake2b(json.dumps(key_data, sort_keys=True).encode(), digest_size=8).hexdigest()
+
+def _request_route(cache_key, url, params):
+    """
+    Busca a rota no cache em disco ou, se ausente, na API Geoapify.
+    
+    Não usa nenhuma chamada st.*, podendo rodar em threads auxiliares.
+    Falhas levantam _RouteUnavailable.
+    """
+    data = shared_routing_cache().get(f"route:{cache_key}")
+    if data is not None:
+        return data
+    
+    # Retry/backoff, limites de concorrência e de taxa ficam a cargo de
+    # geoapify_request, compartilhado com o roteamento e a geocodificação
+    try:
+        response = geoapify_request("GET", url, params=params, timeout=(3.05, 10))
+        response.raise_for_status()
+        # json.loads aceita bytes direto, sem a decodificação para str do response.json()
+        data = json.loads(response.content)
+    except requests.exceptions.HTTPError as e:
+        logger.error("Erro HTTP na API de routing: %s", e)
+        raise _RouteUnavailable()
+    except Exception as e:
+        logger.error("Erro inesperado na chamada à API: %s", e)
+        raise _RouteUnavailable()
+    
+    # Verificar se a resposta contém dados úteis
+    if 'features' in data and len(data['features']) > 0:
+        feature = data['features'][0]
         
-    Returns:
-        Dados da rota com coordenadas ou None se ocorrer um erro
+        # Verificar se há geometria na resposta
+        if 'geometry' in feature:
+            if logger.isEnabledFor(logging.INFO):
+                geom = feature['geometry']
+                logger.info(
+                    "Rota com ruas reais obtida com sucesso: %s pontos",
+                    len(geom.get('coordinates', [])) if geom.get('type') == 'LineString' else 'MultiLineString'
+                )
+            shared_routing_cache().set(f"route:{cache_key}", data)
+            return data  # Retornar o objeto completo para mais flexibilidade
+        else:
+            logger.error("Resposta da API não contém geometria")
+    else:
+        logger.error("Resposta da API sem features: %s", data.get('message', 'Sem mensagem'))
+    
+    raise _RouteUnavailable()
+
+@st.cache_data(show_spinner=False, ttl=24 * 3600, max_entries=512)
+def _fetch_route(cache_key, _url, _params):
     """
-    # Verificar se temos a API key
-    API_KEY = os.environ.get("GEOAPIFY_API_KEY", "")
-    if not API_KEY:
-        logging.warning("API key Geoapify não encontrada no ambiente. Trajeto seguirá linha reta.")
-        st.warning("API key não configurada. Configure a variável de ambiente GEOAPIFY_API_KEY para obter rotas reais.")
-        return None
+    Versão de _request_route memorizada em processo pelo st.cache_data.
+    
+    O hash considera apenas a cache_key (argumentos com "_" não entram); como
+    falhas levantam _RouteUnavailable, um None nunca fica em cache.
+    """
+    return _request_route(cache_key, _url, _params)
 
-    # Mapeia tipos de veículos para modos de viagem da API
-    vehicle_to_mode = {
-        "car": "drive",
-        "bus": "drive",
-        "van": "drive", 
-        "truck": "truck",
-        "motorcycle": "motorcycle"
-    }
-    travel_mode = vehicle_to_mode.get(vehicle_type.lower(), "drive")
+ROUTING_URL = "https://api.geoapify.com/v1/routing"
+# Precisão das polylines codificadas (polyline6: 6 casas decimais)
+POLYLINE_PRECISION = 6
+BATCH_URL = "https://api.geoapify.com/v1/batch"
+
+def _build_route_request(start_point, end_point, waypoints, vehicle_type, api_key):
+    """
+    Valida os pontos e monta a chave de cache e os parâmetros da API de routing.
+    
+    Returns:
+        Tupla (cache_key, params, número de paradas válidas) ou None se os pontos forem inválidos
+    """
+    # Modo de viagem da API para o tipo de veículo
+    travel_mode = VEHICLE_TO_MODE.get(vehicle_type.lower(), "drive")
     
     # Verificar pontos de entrada
     if not isinstance(start_point, dict) or not isinstance(end_point, dict):
-        logging.error("Pontos de início ou fim inválidos")
+        logger.error("Pontos de início ou fim inválidos")
         return None
         
     if 'lat' not in start_point or 'lon' not in start_point or 'lat' not in end_point or 'lon' not in end_point:
-        logging.error("Pontos de início ou fim sem coordenadas lat/lon")
+        logger.error("Pontos de início ou fim sem coordenadas lat/lon")
         return None
     
     # Processar waypoints - verificar e filtrar
@@ -126,69 +258,460 @@ def get_route_geometry(start_point, end_point, waypoints, vehicle_type="car"):
     
     # Construir a string de waypoints: início, intermediários e fim
     all_points = [start_point] + valid_waypoints + [end_point]
-    waypoint_str = "|".join([f"{point['lat']},{point['lon']}" for point in all_points])
+    # Precisão fixa (~0,1 m): URL de tamanho previsível e pontos equivalentes geram a mesma string
+    waypoint_str = "|".join(f"{point['lat']:.6f},{point['lon']:.6f}" for point in all_points)
     
-    # Construir URL e parâmetros para a API
-    url = "https://api.geoapify.com/v1/routing"
     params = {
         "waypoints": waypoint_str,
         "mode": travel_mode,
         "details": "instruction_details,route_details",
-        "apiKey": API_KEY
+        "apiKey": api_key
     }
     
-    try:
-        st.info(f"Solicitando rota real da API Geoapify com {len(valid_waypoints)} paradas intermediárias...")
+    return _route_cache_key(all_points, travel_mode), params, len(valid_waypoints)
+
+# Casas decimais das coordenadas embutidas no HTML do mapa (~0,1 m): floats
+# curtos deixam o json.dumps do Folium mais rápido e o HTML bem menor
+COORD_DECIMALS = 6
+
+def _epsilon_for_zoom(zoom_start):
+    """Tolerância do RDP em graus: ~5e-5 (~5 m) no zoom 13, dobrando a cada nível de zoom a menos."""
+    return 5e-5 * 2 ** (13 - zoom_start)
+
+def _lonlat_array(coords):
+    """
+    Converte posições GeoJSON em um array (N, 2) de [lon, lat].
+    
+    Posições com altitude ([lon, lat, ele]) são aceitas; a terceira coluna é descartada.
+    
+    Raises:
+        ValueError: Se coords não for uma sequência de posições (ex.: uma
+            MultiLineString, uma posição solta ou valores não numéricos)
+    """
+    arr = np.asarray(coords, dtype=np.float64)
+    if arr.size == 0:
+        return np.empty((0, 2))
+    if arr.ndim != 2 or arr.shape[1] < 2:
+        raise ValueError(f"sequência de coordenadas inválida (shape {arr.shape})")
+    return arr[:, :2]
+
+def _swap_lonlat(coords):
+    """Converte uma sequência de pares [lon, lat] (GeoJSON) em um array (N, 2) de [lat, lon]."""
+    return _lonlat_array(coords)[:, ::-1]
+
+def _simplify(coords_latlon, epsilon_deg=5e-5):
+    """
+    Simplifica uma polilinha com Ramer-Douglas-Peucker antes de enviá-la ao Folium.
+    
+    Args:
+        coords_latlon: Sequência ou array (N, 2) de pares (lat, lon); como a
+            distância usada é euclidiana, pares (lon, lat) também funcionam
+        epsilon_deg: Distância máxima (em graus) que um ponto removido pode ficar da linha
         
-        # Fazer a chamada API com retry embutido
-        max_retries = 3
-        retry_delay = 2  # segundos
+    Returns:
+        Lista de pares [lat, lon] com os vértices mantidos (primeiro e último sempre
+        incluídos), arredondados para COORD_DECIMALS casas
+    """
+    pts = np.ascontiguousarray(coords_latlon, dtype=np.float64)
+    if len(pts) < 3:
+        return pts.round(COORD_DECIMALS).tolist()
+    
+    # Reruns do Streamlit redesenham as mesmas rotas: memoriza pelo conteúdo do array
+    return _simplify_buffer(pts.tobytes(), epsilon_deg)
+
+@lru_cache(maxsize=128)
+def _simplify_buffer(buffer, epsilon_deg):
+    """RDP sobre o buffer float64 de um array (N, 2); chamado via _simplify."""
+    pts = np.frombuffer(buffer, dtype=np.float64).reshape(-1, 2)
+    keep = np.zeros(len(pts), dtype=bool)
+    keep[0] = keep[-1] = True
+    
+    # RDP por níveis: a cada passada, todos os intervalos ainda abertos são
+    # avaliados de uma vez com operações vetorizadas, de modo que o número de
+    # iterações em Python acompanha a profundidade da recursão, não o número
+    # de vértices mantidos
+    open_pts = np.ones(len(pts), dtype=bool)
+    open_pts[0] = open_pts[-1] = False
+    while open_pts.any():
+        kept_idx = np.flatnonzero(keep)
+        cand = np.flatnonzero(open_pts)
+        right = np.searchsorted(kept_idx, cand)
+        first = pts[kept_idx[right - 1]]
+        seg = pts[kept_idx[right]] - first
+        rel = pts[cand] - first
         
-        for attempt in range(max_retries):
-            try:
-                response = requests.get(url, params=params, timeout=10)
-                response.raise_for_status()
-                
-                data = response.json()
-                
-                # Verificar se a resposta contém dados úteis
-                if 'features' in data and len(data['features']) > 0:
-                    feature = data['features'][0]
-                    
-                    # Verificar se há geometria na resposta
-                    if 'geometry' in feature:
-                        logging.info(f"Rota com ruas reais obtida com sucesso: {len(feature['geometry'].get('coordinates', [])) if feature['geometry'].get('type') == 'LineString' else 'MultiLineString'} pontos")
-                        return data  # Retornar o objeto completo para mais flexibilidade
-                    else:
-                        logging.error("Resposta da API não contém geometria")
-                else:
-                    logging.error(f"Resposta da API sem features: {data.get('message', 'Sem mensagem')}")
-                
-                break  # Se chegou aqui sem exceções, sai do loop
-                
-            except requests.exceptions.Timeout:
-                logging.warning(f"Timeout na tentativa {attempt+1}/{max_retries}")
-                
-                if attempt < max_retries - 1:
-                    time.sleep(retry_delay)
-                    retry_delay *= 2  # Exponential backoff
-                    
-            except requests.exceptions.HTTPError as e:
-                # Não faz retry para erros HTTP que não são de conexão
-                logging.error(f"Erro HTTP na API de routing: {e}")
-                break
-                
-            except Exception as e:
-                logging.error(f"Erro inesperado na chamada à API: {e}")
-                break
-                
-        return None  # Se chegou aqui, não conseguiu obter dados válidos
+        seg_len = np.hypot(seg[:, 0], seg[:, 1])
+        cross = np.abs(seg[:, 0] * rel[:, 1] - seg[:, 1] * rel[:, 0])
+        dists = np.where(
+            seg_len > 0,
+            cross / np.where(seg_len > 0, seg_len, 1.0),
+            np.hypot(rel[:, 0], rel[:, 1])
+        )
+        
+        # Candidatos de um mesmo intervalo são contíguos: reduz por grupo
+        new_group = np.empty(len(cand), dtype=bool)
+        new_group[0] = True
+        np.not_equal(right[1:], right[:-1], out=new_group[1:])
+        starts = np.flatnonzero(new_group)
+        group = np.cumsum(new_group) - 1
+        max_dist = np.maximum.reduceat(dists, starts)
+        
+        # Primeiro ponto de distância máxima em cada intervalo
+        is_max = dists == max_dist[group]
+        max_pos = np.flatnonzero(is_max)
+        _, first_max = np.unique(group[max_pos], return_index=True)
+        split_pts = cand[max_pos[first_max]]
+        
+        split = max_dist > epsilon_deg
+        keep[split_pts[split]] = True
+        open_pts[split_pts[split]] = False
+        # Intervalos dentro da tolerância são fechados por inteiro
+        open_pts[cand[~split[group]]] = False
+    
+    return pts[keep].round(COORD_DECIMALS).tolist()
+
+def get_route_geometry(start_point, end_point, waypoints, vehicle_type="car", quiet=False):
+    """
+    Obtém geometria real de rota da API Geoapify, garantindo que o trajeto siga ruas reais
+    
+    Args:
+        start_point: Ponto de partida {lat, lon}
+        end_point: Ponto de chegada {lat, lon}
+        waypoints: Lista de waypoints intermediários [{lat, lon}, ...]
+        vehicle_type: Tipo de veículo (car, bus, etc.)
+        quiet: Se True, não exibe mensagens do Streamlit (apenas log)
         
+    Returns:
+        Dados da rota com coordenadas ou None se ocorrer um erro
+    """
+    # Verificar se temos a API key
+    API_KEY = os.environ.get("GEOAPIFY_API_KEY", "")
+    if not API_KEY:
+        logger.warning("API key Geoapify não encontrada no ambiente. Trajeto seguirá linha reta.")
+        if not quiet:
+            st.warning("API key não configurada. Configure a variável de ambiente GEOAPIFY_API_KEY para obter rotas reais.")
+        return None
+
+    request = _build_route_request(start_point, end_point, waypoints, vehicle_type, API_KEY)
+    if request is None:
+        return None
+    cache_key, params, stop_count = request
+    
+    try:
+        if not quiet:
+            st.info(f"Solicitando rota real da API Geoapify com {stop_count} paradas intermediárias...")
+        return _fetch_route(cache_key, ROUTING_URL, params)
+    except _RouteUnavailable:
+        return None  # Não conseguiu obter dados válidos
     except Exception as e:
-        logging.error(f"Erro ao obter geometria da rota: {str(e)}")
+        logger.error("Erro ao obter geometria da rota: %s", e)
+        return None
+
+def get_route_geometries_batch(jobs, poll_interval=1.0, max_wait=30, quiet=False):
+    """
+    Obtém a geometria de várias rotas com uma única requisição à Batch API da Geoapify.
+    
+    Rotas já em cache não são reenviadas. Se o lote não terminar em max_wait
+    segundos (ou falhar), as rotas restantes são buscadas individualmente, em
+    paralelo.
+    
+    Args:
+        jobs: Lista de dicts com start_point, end_point, waypoints e vehicle_type
+        poll_interval: Intervalo em segundos entre consultas ao status do lote
+        max_wait: Tempo máximo em segundos aguardando o lote
+        quiet: Se True, não exibe mensagens do Streamlit (apenas log)
+        
+    Returns:
+        Lista com os dados de cada rota (ou None), na mesma ordem de jobs
+    """
+    API_KEY = os.environ.get("GEOAPIFY_API_KEY", "")
+    if not API_KEY:
+        return [get_route_geometry(**job, quiet=quiet) for job in jobs]
+    
+    results = [None] * len(jobs)
+    pending = {}  # cache_key -> (params, [índices dos jobs])
+    
+    for idx, job in enumerate(jobs):
+        request = _build_route_request(job['start_point'], job['end_point'], job['waypoints'],
+                                       job.get('vehicle_type', 'car'), API_KEY)
+        if request is None:
+            continue
+        cache_key, params, _ = request
+        
+        cached = shared_routing_cache().get(f"route:{cache_key}")
+        if cached is not None:
+            results[idx] = cached
+        elif cache_key in pending:
+            pending[cache_key][1].append(idx)
+        else:
+            pending[cache_key] = (params, [idx])
+    
+    # Um lote só compensa com mais de uma rota pendente
+    if len(pending) > 1:
+        inputs = [
+            {"id": cache_key, "params": {k: v for k, v in params.items() if k != "apiKey"}}
+            for cache_key, (params, _) in pending.items()
+        ]
+        try:
+            response = geoapify_request(
+                "POST",
+                BATCH_URL,
+                params={"apiKey": API_KEY},
+                json={"api": "/v1/routing", "inputs": inputs},
+                timeout=10
+            )
+            response.raise_for_status()
+            job_info = json.loads(response.content)
+            
+            deadline = time.time() + max_wait
+            batch = job_info
+            while batch.get("status") not in ("finished", "completed") and time.time() < deadline:
+                time.sleep(poll_interval)
+                poll = geoapify_request("GET", BATCH_URL, params={"id": job_info["id"], "apiKey": API_KEY}, timeout=10)
+                poll.raise_for_status()
+                batch = json.loads(poll.content)
+            
+            for item in batch.get("results", []):
+                data = item.get("result") or {}
+                if item.get("id") in pending and data.get("features"):
+                    shared_routing_cache().set(f"route:{item['id']}", data)
+                    for idx in pending.pop(item["id"])[1]:
+                        results[idx] = data
+        except Exception as e:
+            logger.error("Erro na Batch API de routing: %s", e)
+    
+    # Rotas que não vieram do lote: buscas individuais em paralelo.
+    # Só a fase de rede roda em threads; o mapa Folium é montado depois, na thread principal.
+    if pending:
+        with ThreadPoolExecutor(max_workers=min(MAX_CONCURRENT_REQUESTS, len(pending))) as executor:
+            futures = {
+                executor.submit(_request_route, cache_key, ROUTING_URL, params): indices
+                for cache_key, (params, indices) in pending.items()
+            }
+            for future in as_completed(futures):
+                try:
+                    data = future.result()
+                except _RouteUnavailable:
+                    data = None
+                except Exception as e:
+                    logger.error("Erro ao obter geometria da rota: %s", e)
+                    data = None
+                for idx in futures[future]:
+                    results[idx] = data
+    
+    return results
+
+def _geometry_segments(geom):
+    """
+    Normaliza uma geometria de rota em segmentos de pares [lat, lon].
+    
+    Aceita GeoJSON LineString/MultiLineString ([lon, lat]) ou uma polyline
+    codificada (precisão 6), que já é decodificada na ordem (lat, lon).
+    
+    Returns:
+        Lista de segmentos, vazia se a geometria não for suportada
+    """
+    if isinstance(geom, str):
+        return [polyline.decode(geom, POLYLINE_PRECISION)] if geom else []
+    if not geom:
+        return []
+    
+    gtype = geom.get('type')
+    coordinates = geom.get('coordinates')
+    if not isinstance(coordinates, list):
+        return []
+    if gtype == 'LineString':
+        return [_swap_lonlat(coordinates)]
+    if gtype == 'MultiLineString':
+        return [_swap_lonlat(segment) for segment in coordinates]
+    return []
+
+def _geojson_segments(obj):
+    """
+    Segmentos [lat, lon] de um objeto GeoJSON de rota, despachando pela tag 'type'.
+    
+    FeatureCollection usa a primeira feature com linha; Feature usa sua geometria;
+    geometrias são tratadas por _geometry_segments. Dicionários sem 'type' são
+    tratados como FeatureCollection (se têm 'features') ou Feature (se têm 'geometry').
+    """
+    if not isinstance(obj, dict):
+        return _geometry_segments(obj) if isinstance(obj, str) else []
+    
+    gtype = obj.get('type')
+    if gtype is None:
+        gtype = 'FeatureCollection' if 'features' in obj else 'Feature' if 'geometry' in obj else None
+    if gtype == 'FeatureCollection':
+        features = obj.get('features')
+        for feature in features if isinstance(features, list) else ():
+            segments = _geojson_segments(feature)
+            if segments:
+                return segments
+        return []
+    if gtype == 'Feature':
+        return _geojson_segments(obj.get('geometry'))
+    return _geometry_segments(obj)
+
+_LINE_GEOMETRY_TYPES = ('LineString', 'MultiLineString')
+_GEOJSON_ROUTE_TYPES = ('FeatureCollection', 'Feature') + _LINE_GEOMETRY_TYPES
+
+def _line_features(route_data):
+    """
+    Retorna as features de uma FeatureCollection cuja geometria é uma linha desenhável.
+    
+    A forma da resposta é validada aqui, de antemão, para que quem desenha
+    não precise de try/except como controle de fluxo.
+    """
+    if not isinstance(route_data, dict):
+        return []
+    features = route_data.get('features')
+    if not isinstance(features, list):
+        return []
+    return [
+        feature for feature in features
+        if isinstance(feature, dict)
+        and isinstance(feature.get('geometry'), dict)
+        and feature['geometry'].get('type') in _LINE_GEOMETRY_TYPES
+        and feature['geometry'].get('coordinates')
+    ]
+
+def _route_feature(geom, simplify_eps=5e-5, **properties):
+    """
+    Converte a geometria de uma rota em uma Feature GeoJSON simplificada com RDP.
+    
+    LineString/MultiLineString mantêm a ordem [lon, lat], que o Leaflet lê sem
+    troca de eixos; polylines codificadas são decodificadas e convertidas.
+    
+    Args:
+        geom: Geometria GeoJSON ou polyline codificada
+        simplify_eps: Tolerância do RDP em graus
+        **properties: Propriedades da feature (cor, espessura, tooltip...)
+        
+    Returns:
+        dict: Feature GeoJSON ou None se a geometria não for desenhável
+    """
+    try:
+        if isinstance(geom, dict) and geom.get('type') in _LINE_GEOMETRY_TYPES and geom.get('coordinates'):
+            gtype = geom['type']
+            if gtype == 'LineString':
+                coordinates = _simplify(_lonlat_array(geom['coordinates']), simplify_eps)
+            else:
+                coordinates = [_simplify(_lonlat_array(segment), simplify_eps) for segment in geom['coordinates']]
+        else:
+            segments = _geometry_segments(geom)
+            if not segments:
+                return None
+            gtype = 'MultiLineString'
+            coordinates = [_simplify(np.asarray(segment, dtype=np.float64)[:, ::-1], simplify_eps) for segment in segments]
+    except ValueError as e:
+        logger.warning("Geometria de rota ignorada: %s", e)
         return None
+    
+    return {
+        'type': 'Feature',
+        'geometry': {'type': gtype, 'coordinates': coordinates},
+        'properties': properties
+    }
+
+def _route_style(feature):
+    """Estilo das linhas de rota a partir das propriedades de cada feature."""
+    props = feature['properties']
+    return {'color': props['color'], 'weight': props['weight'], 'opacity': props['opacity']}
 
-def display_route_on_map(route_data, start_coord, end_coord, waypoints, color='blue'):
+def _draw_feature_geometry(m, geom, color, weight=4, opacity=0.7, tooltip=None, popup=None, simplify_eps=5e-5):
+    """
+    Desenha a geometria de uma rota no mapa como uma camada folium.GeoJson.
+    
+    Returns:
+        bool: True se alguma linha foi desenhada
+    """
+    feature = _route_feature(geom, simplify_eps, color=color, weight=weight, opacity=opacity)
+    if feature is None:
+        return False
+    
+    layer = folium.GeoJson(feature, style_function=_route_style, tooltip=tooltip)
+    if popup:
+        folium.Popup(popup).add_to(layer)
+    layer.add_to(m)
+    return True
+
+def _bucket_waypoints(waypoints, decimals=4):
+    """
+    Agrupa waypoints que caem na mesma célula da grade (4 casas decimais, ~11 m).
+    
+    Returns:
+        Lista de grupos [(índice, waypoint), ...] na ordem da primeira parada de cada célula
+    """
+    buckets = defaultdict(list)
+    for i, wp in enumerate(waypoints):
+        buckets[(round(wp['lat'], decimals), round(wp['lon'], decimals))].append((i, wp))
+    return list(buckets.values())
+
+@lru_cache(maxsize=256)
+def _stops_geojson(route_number, stops):
+    """
+    Paradas de uma rota como uma FeatureCollection GeoJSON de pontos, já serializada.
+    
+    Passageiros na mesma célula da grade (~11 m) viram um único ponto. O popup
+    e o tooltip de cada parada são renderizados aqui e memorizados por rota:
+    reruns com as mesmas paradas reaproveitam o texto pronto.
+    
+    Args:
+        route_number: Número da rota exibido nos textos (1, 2, ...)
+        stops: Tupla de (lat, lon, nome) por passageiro, na ordem da rota
+        
+    Returns:
+        str: FeatureCollection com as propriedades 'popup' e 'tooltip'
+    """
+    waypoints = [{'lat': lat, 'lon': lon, 'name': name} for lat, lon, name in stops]
+    features = []
+    for group in _bucket_waypoints(waypoints):
+        _, first = group[0]
+        names = ", ".join(wp['name'] for _, wp in group)
+        stop_numbers = ", ".join(str(idx + 1) for idx, _ in group)
+        label = "Parada" if len(group) == 1 else "Paradas"
+        features.append({
+            'type': 'Feature',
+            'geometry': {
+                'type': 'Point',
+                'coordinates': [round(first['lon'], COORD_DECIMALS), round(first['lat'], COORD_DECIMALS)]
+            },
+            'properties': {
+                'popup': f"<b>Rota {route_number} - {label} {stop_numbers}</b><br/>{names}",
+                'tooltip': f"Rota {route_number}: {names}"
+            }
+        })
+    return json.dumps({'type': 'FeatureCollection', 'features': features}, separators=(',', ':'))
+
+def _passenger_coords(passengers):
+    """Coordenadas [lat, lon] dos passageiros como um array (N, 2) de float64."""
+    coords = np.fromiter(
+        (c for p in passengers for c in (p['lat'], p['lon'])),
+        dtype=np.float64, count=2 * len(passengers)
+    )
+    return coords.reshape(-1, 2)
+
+def _embed_html(html, width, height):
+    """Exibe um documento HTML em um iframe (st.iframe nas versões novas do Streamlit)."""
+    if hasattr(st, "iframe"):
+        st.iframe(html, width=width, height=height)
+    else:
+        components.html(html, width=width, height=height)
+
+def _map_key(*parts):
+    """Chave estável do componente do mapa, derivada dos dados exibidos nele."""
+    payload = json.dumps(parts, sort_keys=True, default=str)
+    return "map_" + hashlib.blake2b(payload.encode(), digest_size=8).hexdigest()
+
+def _show_map(m, key):
+    """
+    Exibe o mapa com st_folium sob uma chave estável.
+    
+    Com a mesma chave e sem objetos retornados, o navegador mantém a instância
+    Leaflet entre reruns em vez de recarregar o HTML inteiro como o folium_static.
+    """
+    st_folium(m, key=key, width=700, height=500, returned_objects=[])
+
+def display_route_on_map(route_data, start_coord, end_coord, waypoints, color='blue', key="route"):
     """
     Exibe uma rota calculada em um mapa Folium, priorizando trajetos reais em ruas
     
@@ -198,12 +721,15 @@ def display_route_on_map(route_data, start_coord, end_coord, waypoints, color='b
         end_coord: Coordenadas do ponto de chegada  
         waypoints: Lista de waypoints da rota
         color: Cor da linha da rota
+        key: Prefixo da chave do componente (distinto para cada mapa na mesma página)
     """
     # Create a folium map centered on the route area
     center_lat = (start_coord['lat'] + end_coord['lat']) / 2
     center_lon = (start_coord['lon'] + end_coord['lon']) / 2
     
-    m = folium.Map(location=[center_lat, center_lon], zoom_start=13)
+    zoom_start = 13
+    m = folium.Map(location=[center_lat, center_lon], zoom_start=zoom_start)
+    simplify_eps = _epsilon_for_zoom(zoom_start)
     
     # Add start marker com ícone e tooltip melhorados
     folium.Marker(
@@ -221,128 +747,86 @@ def display_route_on_map(route_data, start_coord, end_coord, waypoints, color='b
         tooltip="Ponto de Chegada (Destino)"
     ).add_to(m)
     
-    # Use MarkerCluster for waypoints if there are many of them
-    if len(waypoints) > 10:
-        marker_cluster = MarkerCluster(name="Paradas").add_to(m)
-        target_group = marker_cluster
+    # Paradas praticamente no mesmo lugar viram um único marcador
+    stop_groups = _bucket_waypoints(waypoints)
+    
+    # Use MarkerCluster for waypoints if there are many of them; otherwise a
+    # FeatureGroup, so the markers enter the map as a single child
+    if len(stop_groups) > 10:
+        target_group = MarkerCluster(name="Paradas")
     else:
-        target_group = m
+        target_group = folium.FeatureGroup(name="Paradas")
     
-    # Add waypoint markers
-    for i, wp in enumerate(waypoints):
-        popup_content = f"""
-        <div style="font-family: Arial; width: 200px;">
-            <h4>Parada {i+1}</h4>
-            <b>Passageiro:</b> {wp.get('name', 'Não informado')}<br>
-            <b>ID:</b> {wp.get('person_id', 'N/A')}
-        </div>
-        """
+    # Add waypoint markers (mesmo ícone para todas as paradas da rota)
+    icon_kwargs = dict(color=color, icon='user', prefix='fa')
+    for group in stop_groups:
+        i, wp = group[0]
+        if len(group) == 1:
+            popup_content = _WAYPOINT_POPUP.format(
+                idx=i + 1,
+                name=wp.get('name', 'Não informado'),
+                pid=wp.get('person_id', 'N/A')
+            )
+            tooltip = f"Parada {i+1}: {wp.get('name', 'Passageiro')}"
+        else:
+            stops = ", ".join(str(idx + 1) for idx, _ in group)
+            passengers = "".join(
+                _WAYPOINT_GROUP_ROW.format(name=p.get('name', 'Não informado'), pid=p.get('person_id', 'N/A'))
+                for _, p in group
+            )
+            popup_content = _WAYPOINT_GROUP_POPUP.format(stops=stops, passengers=passengers)
+            tooltip = f"Paradas {stops}: {len(group)} passageiros"
         
         folium.Marker(
             location=[wp['lat'], wp['lon']],
             popup=folium.Popup(popup_content, max_width=300),
-            icon=folium.Icon(color=color, icon='user', prefix='fa'),
-            tooltip=f"Parada {i+1}: {wp.get('name', 'Passageiro')}"
+            icon=folium.Icon(**icon_kwargs),
+            tooltip=tooltip
         ).add_to(target_group)
+    target_group.add_to(m)
     
     # MUDANÇA IMPORTANTE: Primeiro buscar rota real da API para garantir trajeto em ruas
     # mesmo que já tenhamos alguns dados no route_data
     line_added = False
     
     # NOVO: Agora chamamos a API primeiro para priorizar rotas reais em ruas
-    try:
-        # Obter geometria real de rota com a função melhorada
-        vehicle_type = route_data.get('vehicle_type', 'car')
-        api_route_data = get_route_geometry(start_coord, end_coord, waypoints, vehicle_type)
+    vehicle_type = route_data.get('vehicle_type', 'car')
+    api_route_data = get_route_geometry(start_coord, end_coord, waypoints, vehicle_type)
+    api_features = _line_features(api_route_data)
+    
+    if api_features:
+        feature = api_features[0]
+        props = feature.get('properties') or {}
         
-        if api_route_data and 'features' in api_route_data and len(api_route_data['features']) > 0:
-            feature = api_route_data['features'][0]
-            
-            if 'geometry' in feature:
-                geom = feature['geometry']
-                if geom['type'] == 'LineString':
-                    # Get coordinates from LineString (they're in lon, lat order in GeoJSON)
-                    line_coords = [(coord[1], coord[0]) for coord in geom['coordinates']]
-                    
-                    # Obter métricas da rota
-                    distance = api_route_data.get('distance', 0)
-                    if 'properties' in feature:
-                        distance = feature['properties'].get('distance', distance) / 1000
-                        
-                    duration = api_route_data.get('time', 0)
-                    if 'properties' in feature:
-                        duration = feature['properties'].get('time', duration) / 60
-                    
-                    # Add the line to the map with the specified color
-                    route_line = folium.PolyLine(
-                        line_coords,
-                        color=color,
-                        weight=5,  # Linha mais grossa
-                        opacity=0.8,
-                        tooltip=f"Trajeto em ruas reais | Distância: {distance:.1f}km | Tempo: {duration:.0f}min",
-                        popup=f"Distância: {distance:.1f}km | Tempo estimado: {duration:.0f}min"
-                    ).add_to(m)
-                    line_added = True
-                    st.success("✅ Trajeto em ruas reais obtido com sucesso!")
-                
-                elif geom['type'] == 'MultiLineString':
-                    # Processar cada segmento do MultiLineString
-                    for line_segment in geom['coordinates']:
-                        line_coords = [(coord[1], coord[0]) for coord in line_segment]
-                        folium.PolyLine(
-                            line_coords,
-                            color=color,
-                            weight=5,
-                            opacity=0.8
-                        ).add_to(m)
-                    line_added = True
-                    st.success("✅ Trajeto em ruas reais obtido com sucesso!")
-    except Exception as e:
-        st.error(f"Erro ao buscar trajeto em ruas reais: {e}")
-        logging.exception("Erro ao buscar trajeto em ruas reais")
+        # Obter métricas da rota
+        distance = props.get('distance', api_route_data.get('distance', 0)) / 1000
+        duration = props.get('time', api_route_data.get('time', 0)) / 60
+        
+        line_added = _draw_feature_geometry(
+            m, feature['geometry'], color,
+            weight=5,  # Linha mais grossa
+            opacity=0.8,
+            tooltip=f"Trajeto em ruas reais | Distância: {distance:.1f}km | Tempo: {duration:.0f}min",
+            popup=f"Distância: {distance:.1f}km | Tempo estimado: {duration:.0f}min",
+            simplify_eps=simplify_eps
+        )
+        st.success("✅ Trajeto em ruas reais obtido com sucesso!")
     
     # Se não conseguiu obter rota real da API, tentar extrair do route_data existente
-    if not line_added and 'features' in route_data:
-        for feature in route_data['features']:
-            if 'geometry' in feature and feature['geometry'].get('type') in ['LineString', 'MultiLineString']:
-                try:
-                    if feature['geometry']['type'] == 'LineString':
-                        # Get coordinates from LineString (they're in lon, lat order in GeoJSON)
-                        line_coords = [(coord[1], coord[0]) for coord in feature['geometry']['coordinates']]
-                        
-                        # Obter métricas da rota
-                        distance = route_data.get('total_distance_km', 0)
-                        if distance == 0 and 'properties' in feature:
-                            distance = feature['properties'].get('distance', 0) / 1000
-                            
-                        duration = route_data.get('total_duration_minutes', 0)
-                        if duration == 0 and 'properties' in feature:
-                            duration = feature['properties'].get('time', 0) / 60
-                        
-                        # Add the line to the map with the specified color
-                        route_line = folium.PolyLine(
-                            line_coords,
-                            color=color,
-                            weight=4,
-                            opacity=0.7,
-                            tooltip=f"Distância: {distance:.1f}km | Tempo: {duration:.0f}min",
-                            popup=f"Distância: {distance:.1f}km | Tempo estimado: {duration:.0f}min"
-                        ).add_to(m)
-                        line_added = True
-                    
-                    elif feature['geometry']['type'] == 'MultiLineString':
-                        # Processar cada segmento do MultiLineString
-                        for line_segment in feature['geometry']['coordinates']:
-                            line_coords = [(coord[1], coord[0]) for coord in line_segment]
-                            folium.PolyLine(
-                                line_coords,
-                                color=color,
-                                weight=4,
-                                opacity=0.7
-                            ).add_to(m)
-                        line_added = True
-                except Exception as e:
-                    st.error(f"Erro ao processar geometria: {e}")
+    if not line_added:
+        for feature in _line_features(route_data):
+            props = feature.get('properties') or {}
+            
+            # Obter métricas da rota
+            distance = route_data.get('total_distance_km', 0) or props.get('distance', 0) / 1000
+            duration = route_data.get('total_duration_minutes', 0) or props.get('time', 0) / 60
+            
+            line_added = _draw_feature_geometry(
+                m, feature['geometry'], color,
+                tooltip=f"Distância: {distance:.1f}km | Tempo: {duration:.0f}min",
+                popup=f"Distância: {distance:.1f}km | Tempo estimado: {duration:.0f}min",
+                simplify_eps=simplify_eps
+            )
     
     # Outros métodos de fallback permanecem os mesmos
     # ...existing code...
@@ -367,15 +851,7 @@ def display_route_on_map(route_data, start_coord, end_coord, waypoints, color='b
             ).add_to(m)
             
             # Adiciona um aviso claro no mapa
-            warning_html = """
-            <div style="position: fixed; bottom: 10px; left: 10px; z-index: 1000;
-                 background-color: #ffcccc; padding: 10px; border-radius: 5px; 
-                 border: 2px solid red; font-weight: bold; max-width: 300px;">
-                 ⚠️ AVISO: Esta rota é uma aproximação em linha reta 
-                 e NÃO representa o trajeto real em ruas!
-            </div>
-            """
-            m.get_root().html.add_child(folium.Element(warning_html))
+            m.get_root().html.add_child(folium.Element(_STRAIGHT_LINE_WARNING_HTML))
             
             line_added = True
             st.warning("⚠️ ATENÇÃO: Exibindo trajeto simplificado em linha reta - não representa o caminho real em ruas!")
@@ -383,16 +859,19 @@ def display_route_on_map(route_data, start_coord, end_coord, waypoints, color='b
             st.error(f"Não foi possível renderizar nenhum trajeto: {e}")
 
     # Add fullscreen button
-    folium.plugins.Fullscreen().add_to(m)
+    Fullscreen().add_to(m)
     
     # Add locate control
-    folium.plugins.LocateControl().add_to(m)
+    LocateControl().add_to(m)
     
     # Add measure tool
-    folium.plugins.MeasureControl(position='topright', primary_length_unit='kilometers').add_to(m)
+    MeasureControl(position='topright', primary_length_unit='kilometers').add_to(m)
     
     # Display the map
-    folium_static(m)
+    _show_map(m, _map_key(
+        key, start_coord, end_coord,
+        [(wp.get('lat'), wp.get('lon')) for wp in waypoints], color
+    ))
 
 def display_route_map(route_data):
     """Display the route on a Folium map."""
@@ -421,7 +900,9 @@ def display_route_map(route_data):
                 center_lat = (start_coord['lat'] + end_coord['lat']) / 2
                 center_lon = (start_coord['lon'] + end_coord['lon']) / 2
                 
-                m = folium.Map(location=[center_lat, center_lon], zoom_start=12)
+                zoom_start = 12
+                m = folium.Map(location=[center_lat, center_lon], zoom_start=zoom_start)
+                simplify_eps = _epsilon_for_zoom(zoom_start)
                 
                 # Adicionar marcadores
                 folium.Marker(
@@ -437,12 +918,15 @@ def display_route_map(route_data):
                 ).add_to(m)
                 
                 # Adicionar paradas intermediárias
+                icon_kwargs = dict(color='blue', icon='user', prefix='fa')
+                stops_group = folium.FeatureGroup(name="Paradas")
                 for i, wp in enumerate(intermediate_waypoints):
                     folium.Marker(
                         location=[wp['lat'], wp['lon']],
                         popup=f"Parada {i+1}: {wp.get('name', 'Passageiro')}",
-                        icon=folium.Icon(color='blue', icon='user', prefix='fa')
-                    ).add_to(m)
+                        icon=folium.Icon(**icon_kwargs)
+                    ).add_to(stops_group)
+                stops_group.add_to(m)
                 
                 # Adicionar linha da rota
                 line_added = False
@@ -450,26 +934,10 @@ def display_route_map(route_data):
                 # 1. Tentar extrair geometria de LineString/MultiLineString
                 if 'geometry' in route_data:
                     try:
-                        geom = route_data['geometry']
-                        if geom['type'] == 'LineString':
-                            line_coords = [(coord[1], coord[0]) for coord in geom['coordinates']]
-                            folium.PolyLine(
-                                line_coords,
-                                color='blue',
-                                weight=4,
-                                opacity=0.8
-                            ).add_to(m)
-                            line_added = True
-                        elif geom['type'] == 'MultiLineString':
-                            for line_segment in geom['coordinates']:
-                                line_coords = [(coord[1], coord[0]) for coord in line_segment]
-                                folium.PolyLine(
-                                    line_coords,
-                                    color='blue',
-                                    weight=4,
-                                    opacity=0.8
-                                ).add_to(m)
-                            line_added = True
+                        line_added = _draw_feature_geometry(
+                            m, route_data['geometry'], 'blue',
+                            opacity=0.8, simplify_eps=simplify_eps
+                        )
                     except Exception as e:
                         st.warning(f"Erro ao processar geometria: {e}")
                 
@@ -481,30 +949,19 @@ def display_route_map(route_data):
                             start_coord,
                             end_coord,
                             intermediate_waypoints,
-                            "car"  # Valor padrão
+                            "car",  # Valor padrão
+                            quiet=True
                         )
                         
-                        if route_geom:
-                            if route_geom['type'] == 'LineString':
-                                line_coords = [(coord[1], coord[0]) for coord in route_geom['coordinates']]
-                                folium.PolyLine(
-                                    line_coords,
-                                    color='blue',
-                                    weight=4,
-                                    opacity=0.8,
-                                    tooltip="Rota em ruas reais (obtida da API)"
-                                ).add_to(m)
-                                line_added = True
-                            elif route_geom['type'] == 'MultiLineString':
-                                for line_segment in route_geom['coordinates']:
-                                    line_coords = [(coord[1], coord[0]) for coord in line_segment]
-                                    folium.PolyLine(
-                                        line_coords,
-                                        color='blue',
-                                        weight=4,
-                                        opacity=0.8
-                                    ).add_to(m)
-                                line_added = True
+                        # get_route_geometry devolve a FeatureCollection completa da API
+                        features = (route_geom or {}).get('features') or []
+                        if features:
+                            line_added = _draw_feature_geometry(
+                                m, features[0].get('geometry'), 'blue',
+                                opacity=0.8,
+                                tooltip="Rota em ruas reais (obtida da API)",
+                                simplify_eps=simplify_eps
+                            )
                     except Exception as e:
                         st.warning(f"Erro ao obter rota da API: {e}")
                 
@@ -526,20 +983,12 @@ def display_route_map(route_data):
                     ).add_to(m)
                     
                     # Adiciona um aviso claro no mapa
-                    warning_html = """
-                    <div style="position: fixed; bottom: 10px; left: 10px; z-index: 1000;
-                         background-color: #ffcccc; padding: 10px; border-radius: 5px; 
-                         border: 2px solid red; font-weight: bold; max-width: 300px;">
-                         ⚠️ AVISO: Esta rota é uma aproximação em linha reta 
-                         e NÃO representa o trajeto real em ruas!
-                    </div>
-                    """
-                    m.get_root().html.add_child(folium.Element(warning_html))
+                    m.get_root().html.add_child(folium.Element(_STRAIGHT_LINE_WARNING_HTML))
                     
                     st.warning("⚠️ ATENÇÃO: Exibindo trajeto simplificado que não representa o caminho real em ruas!")
                 
                 # Exibir mapa
-                folium_static(m)
+                _show_map(m, _map_key("route_map", start_coord, end_coord, intermediate_waypoints))
             else:
                 st.warning("Dados insuficientes para exibir a rota no mapa.")
         else:
@@ -551,21 +1000,27 @@ def display_route_map(route_data):
     except Exception as e:
         st.error(f"Erro ao exibir o mapa da rota: {str(e)}")
 
-def display_multiple_routes_on_map(created_routes, start_coord, end_coord):
+def _build_routes_map(created_routes, start_coord, end_coord, tolerance, fetched_routes):
     """
-    Display multiple routes on a single map with actual driving paths instead of straight lines.
-    Each route is shown with a different color.
+    Monta o mapa Folium de múltiplas rotas, sem nenhuma chamada st.*.
     
     Args:
-        created_routes: List of route data objects
-        start_coord: Starting coordinates
-        end_coord: Ending coordinates
+        created_routes: Lista de rotas
+        start_coord: Coordenadas de partida
+        end_coord: Coordenadas de chegada
+        tolerance: Tolerância do RDP em graus (None = derivada do zoom)
+        fetched_routes: Respostas da API de cada rota (ou None), na ordem de created_routes
+        
+    Returns:
+        tuple: (mapa Folium, números das rotas desenhadas em linha reta)
     """
     # Create a folium map centered on the route area
     center_lat = (start_coord['lat'] + end_coord['lat']) / 2
     center_lon = (start_coord['lon'] + end_coord['lon']) / 2
     
-    m = folium.Map(location=[center_lat, center_lon], zoom_start=12)
+    zoom_start = 12
+    m = folium.Map(location=[center_lat, center_lon], zoom_start=zoom_start)
+    simplify_eps = tolerance if tolerance is not None else _epsilon_for_zoom(zoom_start)
     
     # Add markers for the common start and end points
     folium.Marker(
@@ -582,243 +1037,330 @@ def display_multiple_routes_on_map(created_routes, start_coord, end_coord):
         tooltip="Ponto de Chegada (Destino)"
     ).add_to(m)
     
-    # Create a list of colors for routes
-    colors = ['blue', 'red', 'green', 'purple', 'orange', 'darkred', 
-              'darkblue', 'darkgreen', 'cadetblue', 'pink', 'lightblue',
-              'lightgreen', 'gray', 'black', 'lightred', 'beige']
-    
-    # Show loading message for routes
-    with st.spinner("Carregando rotas reais do serviço de mapeamento... Isso pode levar alguns segundos."):
-        # Add each route to the map
-        for i, route_info in enumerate(created_routes):
-            color = route_info.get('color', colors[i % len(colors)])
-            vehicle_info = f"{route_info['vehicle']['model']} ({route_info['vehicle']['license_plate']})"
-            passengers_count = len(route_info['passengers'])
-            vehicle_type = get_vehicle_type(route_info['vehicle']['model'])
-            
-            # Add waypoint markers for this route with matching color
-            for j, passenger in enumerate(route_info['passengers']):
-                popup_text = f"<b>Rota {i+1} - Parada {j+1}</b><br/>{passenger.get('name', 'Passageiro')}"
-                
-                # Convert line color to marker color
-                marker_color = color
-                if color in ['darkred', 'darkblue', 'darkgreen', 'cadetblue', 'lightred', 'lightblue', 'lightgreen']:
-                    marker_color = color.replace('dark', '').replace('light', '').replace('cadet', '')
-                
-                folium.Marker(
-                    location=[passenger['lat'], passenger['lon']],
-                    popup=folium.Popup(popup_text, max_width=300),
-                    icon=folium.Icon(color=marker_color, icon='user', prefix='fa'),
-                    tooltip=f"Rota {i+1}: {passenger.get('name', 'Passageiro')}"
-                ).add_to(m)
+    colors = _ROUTE_COLORS
+    
+    # Cor, descrição do veículo e nº de passageiros de cada rota, calculados uma
+    # única vez e usados tanto no desenho quanto na legenda. Uma tupla local, em
+    # vez de gravar em route_info, para não alterar as rotas de quem chamou
+    route_entries = tuple(
+        (
+            route_info.get('color', colors[i % len(colors)]),
+            f"{route_info['vehicle']['model']} ({route_info['vehicle']['license_plate']})",
+            len(route_info['passengers'])
+        )
+        for i, route_info in enumerate(created_routes)
+    )
+    
+    simplified_routes = []
+    # Trajetos reais de todas as rotas, desenhados depois em uma única camada GeoJSON
+    route_features = []
+    
+    # Add each route to the map
+    for i, (route_info, (color, vehicle_info, passengers_count)) in enumerate(zip(created_routes, route_entries)):
+        passenger_coords = _passenger_coords(route_info['passengers'])
+        
+        # Convert line color to marker color (once per route)
+        marker_color = color
+        if color in ['darkred', 'darkblue', 'darkgreen', 'cadetblue', 'lightred', 'lightblue', 'lightgreen']:
+            marker_color = color.replace('dark', '').replace('light', '').replace('cadet', '')
+        icon_kwargs = dict(color=marker_color, icon='user', prefix='fa')
+        
+        # Add waypoint markers for this route with matching color, as a single
+        # GeoJSON layer per route (popups and tooltips come pre-rendered)
+        stops = tuple((p['lat'], p['lon'], p.get('name', 'Passageiro')) for p in route_info['passengers'])
+        stops_group = folium.FeatureGroup(name=f"Paradas - Rota {i+1}")
+        if stops:
+            folium.GeoJson(
+                _stops_geojson(i + 1, stops),
+                marker=folium.Marker(icon=folium.Icon(**icon_kwargs)),
+                popup=folium.GeoJsonPopup(fields=['popup'], labels=False, localize=False, max_width=300),
+                tooltip=folium.GeoJsonTooltip(fields=['tooltip'], labels=False, localize=False)
+            ).add_to(stops_group)
+        stops_group.add_to(m)
+        
+        # IMPORTANT: First attempt to get real route from Geoapify API regardless 
+        # of what might be in route_data to ensure we show actual driving routes
+        route_added = False
+        
+        # Get route from Geoapify (already fetched above)
+        api_features = _line_features(fetched_routes[i])
+        if api_features:
+            feature = api_features[0]
+            props = feature.get('properties') or {}
             
-            # IMPORTANT: First attempt to get real route from Geoapify API regardless 
-            # of what might be in route_data to ensure we show actual driving routes
-            route_added = False
+            # Get route metrics if available
+            distance = props.get('distance', 0) / 1000  # Convert to km
+            duration = props.get('time', 0) / 60  # Convert to minutes
             
-            # Get passenger waypoints
-            waypoints = []
-            for passenger in route_info['passengers']:
-                waypoints.append({
-                    'lat': passenger['lat'],
-                    'lon': passenger['lon'],
-                    'name': passenger.get('name', 'Passageiro')
-                })
+            # Add the actual driving path with specified color
+            route_feature = _route_feature(
+                feature['geometry'], simplify_eps,
+                color=color,
+                weight=5,
+                opacity=0.8,
+                tooltip=f"Rota {i+1}: {vehicle_info} - {passengers_count} passageiros | Distância: {distance:.1f}km | Tempo: {duration:.0f}min"
+            )
+            if route_feature:
+                route_features.append(route_feature)
+                route_added = True
+        
+        # FALLBACK 1: Try existing route_data if API call failed
+        if not route_added and 'route_data' in route_info:
+            route_data = route_info['route_data']
             
-            # Get route from Geoapify
+            # Try to extract route geometry from different API response formats
             try:
-                api_route_data = get_route_geometry(
-                    start_coord, 
-                    end_coord, 
-                    waypoints,
-                    vehicle_type
+                # Check for 'features' with 'LineString' geometry
+                style = dict(
+                    color=color,
+                    weight=4,
+                    opacity=0.8,
+                    tooltip=f"Rota {i+1}: {vehicle_info} - {passengers_count} passageiros"
                 )
+                route_feature = None
+                tag = _classify(route_data)
+                if tag == 'features':
+                    for feature in route_data['features']:
+                        route_feature = _route_feature(feature.get('geometry'), simplify_eps, **style)
+                        if route_feature:
+                            break
                 
-                if api_route_data and 'features' in api_route_data and len(api_route_data['features']) > 0:
-                    feature = api_route_data['features'][0]
-                    
-                    if 'geometry' in feature:
-                        geom = feature['geometry']
-                        if geom['type'] == 'LineString':
-                            # Get coordinates (convert from [lon, lat] to [lat, lon] for Folium)
-                            line_coords = [(coord[1], coord[0]) for coord in geom['coordinates']]
-                            
-                            # Get route metrics if available
-                            distance = 0
-                            duration = 0
-                            if 'properties' in feature:
-                                props = feature['properties']
-                                if 'distance' in props:
-                                    distance = props['distance'] / 1000  # Convert to km
-                                if 'time' in props:
-                                    duration = props['time'] / 60  # Convert to minutes
-                            
-                            # Add the actual driving path with specified color
-                            folium.PolyLine(
-                                line_coords,
-                                color=color,
-                                weight=5,
-                                opacity=0.8,
-                                tooltip=f"Rota {i+1}: {vehicle_info} - {passengers_count} passageiros | Distância: {distance:.1f}km | Tempo: {duration:.0f}min"
-                            ).add_to(m)
-                            route_added = True
-                            
-                        elif geom['type'] == 'MultiLineString':
-                            # Process each segment of the MultiLineString
-                            for line_segment in geom['coordinates']:
-                                line_coords = [(coord[1], coord[0]) for coord in line_segment]
-                                folium.PolyLine(
-                                    line_coords,
-                                    color=color,
-                                    weight=5,
-                                    opacity=0.8
-                                ).add_to(m)
-                            route_added = True
-            
-            except Exception as e:
-                logging.error(f"Erro ao obter rota real da API para rota {i+1}: {e}")
-            
-            # FALLBACK 1: Try existing route_data if API call failed
-            if not route_added and 'route_data' in route_info:
-                route_data = route_info['route_data']
+                # Check for direct geometry
+                elif tag == 'geometry':
+                    route_feature = _route_feature(route_data['geometry'], simplify_eps, **style)
                 
-                # Try to extract route geometry from different API response formats
-                try:
-                    # Check for 'features' with 'LineString' geometry
-                    if 'features' in route_data:
-                        for feature in route_data['features']:
-                            if 'geometry' in feature and feature['geometry'].get('type') == 'LineString':
-                                line_coords = [(coord[1], coord[0]) for coord in feature['geometry']['coordinates']]
-                                folium.PolyLine(
-                                    line_coords,
-                                    color=color,
-                                    weight=4,
-                                    opacity=0.8,
-                                    tooltip=f"Rota {i+1}: {vehicle_info} - {passengers_count} passageiros"
-                                ).add_to(m)
-                                route_added = True
-                                break
-                    
-                    # Check for direct geometry
-                    elif 'geometry' in route_data:
-                        if route_data['geometry'].get('type') == 'LineString':
-                            line_coords = [(coord[1], coord[0]) for coord in route_data['geometry']['coordinates']]
-                            folium.PolyLine(
-                                line_coords,
-                                color=color,
-                                weight=4,
-                                opacity=0.8,
-                                tooltip=f"Rota {i+1}: {vehicle_info} - {passengers_count} passageiros"
-                            ).add_to(m)
-                            route_added = True
-                except Exception as e:
-                    logging.error(f"Erro ao processar geometria da rota {i+1} de route_data: {e}")
+                if route_feature:
+                    route_features.append(route_feature)
+                    route_added = True
+            except Exception as e:
+                logger.error("Erro ao processar geometria da rota %d de route_data: %s", i + 1, e)
+        
+        # FALLBACK 2: Only as last resort, use simplified straight lines if both API and route_data failed
+        if not route_added:
+            simplified_routes.append(i + 1)
+            # Start, passengers in order, end
+            simplified_coords = np.vstack([
+                [start_coord['lat'], start_coord['lon']],
+                passenger_coords,
+                [end_coord['lat'], end_coord['lon']]
+            ])
             
-            # FALLBACK 2: Only as last resort, use simplified straight lines if both API and route_data failed
-            if not route_added:
-                st.warning(f"⚠️ Não foi possível obter o trajeto real para a rota {i+1}. Exibindo versão simplificada.")
-                simplified_coords = []
-                simplified_coords.append([start_coord['lat'], start_coord['lon']])
-                
-                # Add passenger coordinates in order
-                for passenger in route_info['passengers']:
-                    simplified_coords.append([passenger['lat'], passenger['lon']])
-                
-                simplified_coords.append([end_coord['lat'], end_coord['lon']])
-                
-                folium.PolyLine(
-                    simplified_coords,
-                    color=color,
-                    weight=3,
-                    opacity=0.6,
-                    tooltip=f"Rota {i+1}: {vehicle_info} - {passengers_count} passageiros (SIMPLIFICADA)",
-                    dash_array="5, 10"  # Dashed line to indicate simplified route
-                ).add_to(m)
+            folium.PolyLine(
+                simplified_coords.tolist(),
+                color=color,
+                weight=3,
+                opacity=0.6,
+                tooltip=f"Rota {i+1}: {vehicle_info} - {passengers_count} passageiros (SIMPLIFICADA)",
+                dash_array="5, 10"  # Dashed line to indicate simplified route
+            ).add_to(m)
     
-    # Create a legend for the map
-    legend_html = """
-    <div style="position: fixed; bottom: 50px; left: 50px; z-index: 1000; background-color: white; padding: 10px; border: 2px solid grey; border-radius: 5px;">
-    <h4>Legenda - Rotas</h4>
-    """
-    
-    for i, route_info in enumerate(created_routes):
-        color = route_info.get('color', colors[i % len(colors)])
-        vehicle_info = f"{route_info['vehicle']['model']} ({route_info['vehicle']['license_plate']})"
-        passengers_count = len(route_info['passengers'])
-        legend_html += f"""
-        <div>
-            <span style="background-color:{color}; width:20px; height:10px; display:inline-block; margin-right:5px;"></span>
-            <span>Rota {i+1}: {vehicle_info} ({passengers_count} passageiros)</span>
-        </div>
-        """
+    if route_features:
+        folium.GeoJson(
+            {'type': 'FeatureCollection', 'features': route_features},
+            name="Rotas",
+            style_function=_route_style,
+            tooltip=folium.GeoJsonTooltip(fields=['tooltip'], labels=False)
+        ).add_to(m)
     
-    legend_html += "</div>"
-    m.get_root().html.add_child(folium.Element(legend_html))
+    # Create a legend for the map (cached by route colors, vehicles and counts)
+    m.get_root().html.add_child(folium.Element(_legend_html(route_entries)))
     
     # Add fullscreen button and measure tool
-    folium.plugins.Fullscreen().add_to(m)
-    folium.plugins.MeasureControl(position='topright', primary_length_unit='kilometers').add_to(m)
+    Fullscreen().add_to(m)
+    MeasureControl(position='topright', primary_length_unit='kilometers').add_to(m)
     
-    # Display the map
-    folium_static(m)
-
-def extract_route_coordinates(route_data):
-    """
-    Extract the route coordinates from API response in different formats
-    Returns a list of [lat, lon] pairs that describe the route geometry
-    """
-    # Try different formats based on the API response structure
-    
-    # Format 1: GeoJSON with LineString features
-    if 'features' in route_data:
-        for feature in route_data['features']:
-            if feature.get('geometry', {}).get('type') == 'LineString':
-                coordinates = feature['geometry'].get('coordinates', [])
-                # GeoJSON format is [lon, lat], but folium needs [lat, lon]
-                return [[coord[1], coord[0]] for coord in coordinates]
-    
-    # Format 2: Direct geometry object with coordinates
-    if 'geometry' in route_data and 'coordinates' in route_data['geometry']:
-        coordinates = route_data['geometry']['coordinates']
-        if isinstance(coordinates[0], list):
-            return [[coord[1], coord[0]] for coord in coordinates]
-    
-    # Format 3: Paths array with points
-    if 'paths' in route_data and len(route_data['paths']) > 0:
-        path = route_data['paths'][0]
-        if 'points' in path and 'coordinates' in path['points']:
-            coordinates = path['points']['coordinates']
-            return [[coord[1], coord[0]] for coord in coordinates]
-    
-    # Format 4: Direct points array
-    if 'points' in route_data and 'coordinates' in route_data['points']:
-        coordinates = route_data['points']['coordinates']
-        return [[coord[1], coord[0]] for coord in coordinates]
-    
-    # Format 5: Segments with geometry
-    if 'segments' in route_data:
-        coordinates = []
-        for segment in route_data['segments']:
-            if 'geometry' in segment:
-                points = decode_polyline(segment['geometry'])
-                if points:
-                    coordinates.extend(points)
-        if coordinates:
-            return coordinates
+    return m, simplified_routes
+
+@st.cache_data(show_spinner=False, max_entries=16)
+def _routes_map_html(map_key, _created_routes, _start_coord, _end_coord, _tolerance, _fetched_routes):
+    """
+    HTML renderizado do mapa de múltiplas rotas, memorizado pela map_key.
+    
+    A chave cobre as rotas, os pontos, a tolerância e quais rotas vieram da
+    API; reruns sem mudança nesses dados reaproveitam o HTML sem remontar o mapa.
+    """
+    m, simplified_routes = _build_routes_map(_created_routes, _start_coord, _end_coord, _tolerance, _fetched_routes)
+    return m.get_root().render(), simplified_routes
+
+def display_multiple_routes_on_map(created_routes, start_coord, end_coord, key="routes", tolerance=None):
+    """
+    Display multiple routes on a single map with actual driving paths instead of straight lines.
+    Each route is shown with a different color.
+    
+    Args:
+        created_routes: List of route data objects
+        start_coord: Starting coordinates
+        end_coord: Ending coordinates
+        key: Map key prefix (keeps maps of the same routes apart in the HTML cache)
+        tolerance: Douglas-Peucker tolerance in degrees for the route lines
+            (defaults to one derived from the initial zoom level)
+    """
+    if not os.environ.get("GEOAPIFY_API_KEY"):
+        st.warning("API key não configurada. Configure a variável de ambiente GEOAPIFY_API_KEY para obter rotas reais.")
+    
+    # Um único container de status em vez de uma mensagem por rota
+    with st.status(f"Carregando {len(created_routes)} rotas reais do serviço de mapeamento...", expanded=False) as status:
+        # Fetch every route geometry up front in a single batch request
+        route_jobs = [
+            {
+                'start_point': start_coord,
+                'end_point': end_coord,
+                'waypoints': route_info['passengers'],
+                'vehicle_type': get_vehicle_type(route_info['vehicle']['model'])
+            }
+            for route_info in created_routes
+        ]
+        fetched_routes = get_route_geometries_batch(route_jobs, quiet=True)
+        status.update(label="Desenhando rotas no mapa...")
+        
+        map_key = _map_key(
+            key, created_routes, start_coord, end_coord, tolerance,
+            [route is not None for route in fetched_routes]
+        )
+        html, simplified_routes = _routes_map_html(
+            map_key, created_routes, start_coord, end_coord, tolerance, fetched_routes
+        )
+        
+        status.update(label=f"{len(created_routes)} rotas carregadas", state="complete")
     
+    if simplified_routes:
+        st.warning(
+            f"⚠️ Não foi possível obter o trajeto real para as rotas {', '.join(map(str, simplified_routes))}. "
+            "Exibindo versão simplificada."
+        )
+    
+    # HTML estático em um iframe: com o mesmo HTML, o Streamlit não remonta o mapa
+    _embed_html(html, width=700, height=500)
+
+def _from_features(features):
+    """Formato GeoJSON: lista de features com LineString/MultiLineString."""
+    segments = _geojson_segments({'type': 'FeatureCollection', 'features': features})
+    return np.concatenate(segments).tolist() if segments else None
+
+def _from_geometry(geom):
+    """Objeto de geometria direto (GeoJSON tipado ou apenas com 'coordinates')."""
+    if not isinstance(geom, dict) or not geom.get('coordinates'):
+        return None
+    if 'type' in geom:
+        segments = _geojson_segments(geom)
+        return np.concatenate(segments).tolist() if segments else None
+    return _swap_lonlat(geom['coordinates']).tolist()
+
+def _from_paths(paths):
+    """Formato GraphHopper: paths[0].points.coordinates em [lon, lat]."""
+    if not isinstance(paths, list) or not paths or not isinstance(paths[0], dict):
+        return None
+    points = paths[0].get('points')
+    if isinstance(points, dict) and 'coordinates' in points:
+        return _swap_lonlat(points['coordinates']).tolist()
+    return None
+
+def _from_points(points):
+    """Objeto 'points' com 'coordinates' em [lon, lat]."""
+    if isinstance(points, dict) and 'coordinates' in points:
+        return _swap_lonlat(points['coordinates']).tolist()
     return None
 
-def decode_polyline(polyline_str):
+def _from_segments(segments):
+    """Segmentos com geometria em polyline codificada, concatenados em ordem."""
+    if not isinstance(segments, list):
+        return None
+    coordinates = []
+    for segment in segments:
+        if isinstance(segment, dict) and 'geometry' in segment:
+            coordinates.extend(decode_polyline(segment['geometry']))
+    return coordinates or None
+
+def _from_path_list(path):
+    """Lista de objetos {lat, lon} ou colunas {"lat": [...], "lon": [...]}."""
+    if isinstance(path, dict):
+        lats, lons = path.get('lat'), path.get('lon')
+        if not isinstance(lats, list) or not isinstance(lons, list) or len(lats) != len(lons):
+            return None
+        return list(zip(lats, lons)) or None
+    if not isinstance(path, list) or not all(isinstance(p, dict) and 'lat' in p and 'lon' in p for p in path):
+        return None
+    return [(p['lat'], p['lon']) for p in path] or None
+
+def _from_polyline(encoded):
+    """Polyline codificada (precisão padrão de 5 casas)."""
+    return decode_polyline(encoded) if encoded else None
+
+# Formatos de resposta suportados, na ordem de prioridade: chave de topo -> extrator
+_EXTRACTORS = {
+    'features': _from_features,
+    'geometry': _from_geometry,
+    'paths': _from_paths,
+    'points': _from_points,
+    'segments': _from_segments,
+    'path': _from_path_list,
+    'polyline': _from_polyline,
+}
+
+def _classify(route_data):
+    """
+    Identifica o formato de uma resposta de rota com uma única sondagem das chaves.
+    
+    Returns:
+        'type' para um GeoJSON tipado solto (ex.: uma LineString), a primeira
+        chave de _EXTRACTORS presente nos dados, ou None se o formato for desconhecido
+    """
+    if not isinstance(route_data, dict):
+        return None
+    if route_data.get('type') in _GEOJSON_ROUTE_TYPES and 'features' not in route_data and 'geometry' not in route_data:
+        return 'type'
+    for key in _EXTRACTORS:
+        if key in route_data:
+            return key
+    return None
+
+def extract_route_coordinates(route_data, tag=None):
+    """
+    Extrai coordenadas do trajeto de diferentes formatos de resposta da API.
+    
+    Args:
+        route_data: Dados da rota retornados pela API
+        tag: Formato já identificado por _classify (evita sondar as chaves de novo)
+        
+    Returns:
+        Lista de coordenadas [lat, lon] ou None se não for possível extrair
+    """
+    if tag is None:
+        tag = _classify(route_data)
+    if tag is None:
+        return None
+    
+    # GeoJSON tipado solto é a própria geometria; os demais formatos são
+    # despachados pela chave identificada
+    if tag == 'type':
+        extractor, value = _from_geometry, route_data
+    else:
+        extractor, value = _EXTRACTORS[tag], route_data[tag]
+    
+    # Os extratores validam a forma dos dados; só coordenadas malformadas
+    # (ValueError de _lonlat_array) chegam aqui
+    try:
+        coordinates = extractor(value)
+    except ValueError as e:
+        logger.warning("Coordenadas inválidas no formato '%s': %s", tag, e)
+        return None
+    return coordinates or None
+
+def decode_polyline(polyline_str, precision=5):
     """
     Decode a polyline string into a list of coordinates.
     This is used for formats where the route is encoded as a string.
+    
+    Args:
+        polyline_str: Encoded polyline
+        precision: Number of decimal places used by the encoder
+            (5 for Google/ORS polylines, 6 for polyline6/OSRM)
     """
     try:
-        # Try to use polyline module if available
-        import polyline
-        return polyline.decode(polyline_str)
-    except (ImportError, Exception):
-        # Fallback to empty list if module is unavailable or decoding fails
+        return polyline.decode(polyline_str, precision)
+    except (IndexError, ValueError, TypeError) as e:
+        # Truncated or malformed input: report it and fall back to an empty route
+        logger.warning("Polyline inválida ignorada: %s", e)
         return []
 
 class InteractiveRouteMap:
@@ -840,47 +1382,3 @@ class InteractiveRouteMap:
         """Exibe o mapa finalizado"""
         folium.LayerControl().add_to(self.map)
         folium_static(self.fig)
-
-# Adicionar função auxiliar para extrair coordenadas de rota de diferentes formatos de API
-def extract_route_coordinates(route_data):
-    """
-    Extrai coordenadas do trajeto de diferentes formatos de resposta da API.
-    
-    Args:
-        route_data: Dados da rota retornados pela API
-        
-    Returns:
-        Lista de coordenadas [lat, lon] ou None se não for possível extrair
-    """
-    try:
-        # Método 1: GeoJSON LineString/MultiLineString em features
-        if 'features' in route_data:
-            for feature in route_data['features']:
-                if 'geometry' in feature:
-                    geom = feature['geometry']
-                    if geom['type'] == 'LineString':
-                        # Converter de [lon, lat] para [lat, lon]
-                        return [(coord[1], coord[0]) for coord in geom['coordinates']]
-                    elif geom['type'] == 'MultiLineString':
-                        # Juntar todos os segmentos em uma única lista
-                        coords = []
-                        for segment in geom['coordinates']:
-                            coords.extend([(coord[1], coord[0]) for coord in segment])
-                        return coords
-        
-        # Método 2: 'path' com lista de objetos {lat, lon}
-        if 'path' in route_data and len(route_data['path']) > 0:
-            return [(p['lat'], p['lon']) for p in route_data['path']]
-        
-        # Método 3: Polyline codificado
-        if 'polyline' in route_data and route_data['polyline']:
-            try:
-                import polyline
-                return polyline.decode(route_data['polyline'])
-            except ImportError:
-                pass
-            
-        return None
-    except Exception as e:
-        logging.error(f"Erro ao extrair coordenadas da rota: {e}")
-        return None
\ No newline at end of file
@@ -1,9 +1,10 @@
 import requests
 import os
 import json
-from typing import List, Dict, Any, Tuple
+from typing import List, Dict, Any, Optional, Tuple
 import logging
 import math
+from math import asin, cos, sin, sqrt
 from datetime import datetime
 import numpy as np
 from sklearn.cluster import DBSCAN
@@ -11,10 +12,79 @@ from collections import defaultdict
 import random
 import streamlit as st
 import time
+import zlib
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from functools import lru_cache
+from itertools import islice
+from operator import itemgetter
+from types import MappingProxyType
+from .routing_cache import shared_routing_cache
+from .geoapify import MAX_CONCURRENT_REQUESTS, geoapify_request
 
 # Get API key from environment variable or config
 GEOAPIFY_API_KEY = os.environ.get("GEOAPIFY_API_KEY", "")
 
+GEOCODE_URL = "https://api.geoapify.com/v1/geocode/search"
+ROUTE_MATRIX_URL = "https://api.geoapify.com/v1/routematrix"
+
+# Raio médio da Terra e fatores de conversão usados no cálculo de Haversine
+EARTH_RADIUS_KM = 6371.0
+_DEG_TO_RAD = math.pi / 180.0
+_HALF_DEG_TO_RAD = math.pi / 360.0
+
+# Modos de viagem da Routing API por tipo de veículo
+VEHICLE_TO_MODE = MappingProxyType({
+    "car": "drive",
+    "bus": "drive",  # A API não tem modo 'bus'
+    "van": "drive",
+    "truck": "truck",
+    "motorcycle": "motorcycle",
+})
+
+# Perfis de veículo da Route Planner API por tipo de veículo
+VEHICLE_PROFILES = MappingProxyType({
+    "car": MappingProxyType({"type": "car"}),
+    "van": MappingProxyType({"type": "car", "max_speed": 90}),
+    "bus": MappingProxyType({"type": "car", "max_speed": 80}),
+    "truck": MappingProxyType({"type": "truck"}),
+    "motorcycle": MappingProxyType({"type": "motorcycle"}),
+})
+
+# Velocidade média estimada em km/h por tipo de veículo
+VEHICLE_SPEEDS_KMH = MappingProxyType({
+    "car": 40,
+    "van": 35,
+    "bus": 30,
+    "truck": 25,
+    "motorcycle": 45,
+})
+
+# Tempo gasto em cada parada, em minutos, por tipo de veículo
+STOP_TIMES_MINUTES = MappingProxyType({
+    "car": 1,
+    "van": 1.5,
+    "bus": 2.5,
+    "truck": 2,
+    "motorcycle": 0.5,
+})
+
+# Maior número de paradas para o qual a ordem ótima é calculada de forma exata
+# (Held-Karp: ~20 ms com 15 paradas); acima disso, vizinho mais próximo + 2-opt/Or-opt
+EXACT_TSP_MAX_WAYPOINTS = 15
+
+# Máximo de rodadas alternando 2-opt e Or-opt nas rotas sem solução exata
+LOCAL_SEARCH_MAX_ROUNDS = 10
+
+# Casas decimais (~0,1 m) usadas para reconhecer paradas no mesmo endereço
+WAYPOINT_DECIMALS = 6
+
+# Maior número de pontos distintos pedidos numa única matriz de tempos
+# (a Route Matrix API cobra origens x destinos)
+ROUTE_MATRIX_MAX_POINTS = 200
+
+# Intervalo mínimo, em segundos, entre atualizações da barra de progresso
+PROGRESS_UPDATE_INTERVAL = 0.1
+
 def optimize_route(
     start_point: Dict[str, float],
     end_point: Dict[str, float],
@@ -51,7 +121,7 @@ def optimize_route(
                 "arrival_time": None
             }
         ],
-        "path": []  # List of coordinate pairs for drawing the route
+        "path": {"lat": [], "lon": []}  # Route coordinates as lat/lon columns for drawing
     }
     
     return result
@@ -69,8 +139,6 @@ def geocode_address(address: str) -> Dict[str, float]:
     if not GEOAPIFY_API_KEY:
         logging.warning("GEOAPIFY_API_KEY not set")
         return {}
-
-    url = "https://api.geoapify.com/v1/geocode/search"
     
     params = {
         "text": address,
@@ -79,14 +147,14 @@ def geocode_address(address: str) -> Dict[str, float]:
     }
     
     try:
-        response = requests.get(url, params=params)
-        data = response.json()
+        response = geoapify_request("GET", GEOCODE_URL, params=params)
+        data = json.loads(response.content)
         
-        if data["results"] and len(data["results"]) > 0:
+        if data["results"]:
             result = data["results"][0]
             return {"lat": result["lat"], "lon": result["lon"]}
     except Exception as e:
-        logging.error(f"Error geocoding address: {e}")
+        logging.error("Error geocoding address: %s", e)
     
     return {}
 
@@ -110,6 +178,37 @@ def calculate_route_duration(
     return 0
 
 
+def dedup_waypoints(waypoints: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+    """
+    Agrupa waypoints com as mesmas coordenadas (arredondadas em
+    WAYPOINT_DECIMALS casas) em uma única parada, mantendo a ordem da
+    primeira ocorrência. Passageiros do mesmo endereço viram uma só parada
+    para a API, o que reduz o payload e o tamanho do problema de roteamento.
+    
+    Args:
+        waypoints: Lista de dicionários com lat, lon e person_id
+        
+    Returns:
+        Lista de paradas únicas; cada uma é uma cópia do primeiro waypoint do
+        endereço acrescida de 'person_ids' e 'persons' (os waypoints originais)
+    """
+    unique = {}
+    for wp in waypoints:
+        key = _coord_key(wp)
+        stop = unique.get(key)
+        if stop is None:
+            stop = unique[key] = {**wp, "person_ids": [], "persons": []}
+        stop["person_ids"].append(wp.get('person_id'))
+        stop["persons"].append(wp)
+    
+    if len(unique) < len(waypoints):
+        logging.info("%d waypoints agrupados em %d paradas únicas", len(waypoints), len(unique))
+    return list(unique.values())
+
+def _coord_key(point) -> Tuple[float, float]:
+    """Coordenadas arredondadas em WAYPOINT_DECIMALS casas, para identificar um endereço."""
+    return (round(point['lat'], WAYPOINT_DECIMALS), round(point['lon'], WAYPOINT_DECIMALS))
+
 def optimize_route(start_point, end_point, waypoints, max_duration_minutes=45, vehicle_type="car"):
     """
     Calcula uma rota otimizada utilizando a Geoapify Routing API.
@@ -128,18 +227,8 @@ def optimize_route(start_point, end_point, waypoints, max_duration_minutes=45, v
     if not API_KEY:
         raise Exception("A variável de ambiente GEOAPIFY_API_KEY não está definida.")
 
-    # Mapeia tipos de veículos para modos de viagem da API
-    vehicle_to_mode = {
-        "car": "drive",
-        "bus": "drive",  # Alterado para 'drive' pois a API não tem modo 'bus'
-        "van": "drive",
-        "truck": "truck",
-        "motorcycle": "motorcycle",
-        # Adicione mais mapeamentos conforme necessário
-    }
-    
     # Define o modo de viagem com base no tipo de veículo (use 'drive' como padrão)
-    travel_mode = vehicle_to_mode.get(vehicle_type.lower(), "drive")
+    travel_mode = VEHICLE_TO_MODE.get(vehicle_type.lower(), "drive")
     
     # Verifica se há waypoints - se não houver, faz uma rota direta
     if not waypoints:
@@ -148,8 +237,8 @@ def optimize_route(start_point, end_point, waypoints, max_duration_minutes=45, v
     # Constrói a string de waypoints: início, paradas intermediárias e fim.
     waypoint_coords = [f"{start_point['lat']},{start_point['lon']}"]
     
-    # Adiciona waypoints intermediários (se houver)
-    for wp in waypoints:
+    # Adiciona waypoints intermediários (se houver), uma vez por endereço
+    for wp in dedup_waypoints(waypoints):
         waypoint_coords.append(f"{wp['lat']},{wp['lon']}")
         
     waypoint_coords.append(f"{end_point['lat']},{end_point['lon']}")
@@ -164,18 +253,18 @@ def optimize_route(start_point, end_point, waypoints, max_duration_minutes=45, v
         "apiKey": API_KEY
     }
     
-    logging.info(f"Fazendo solicitação para a API de Routing com modo: {travel_mode}")
+    logging.info("Fazendo solicitação para a API de Routing com modo: %s", travel_mode)
     
     try:
-        response = requests.get(url, params=params)
+        response = geoapify_request("GET", url, params=params)
         response.raise_for_status()  # Lança exceção para status codes 4xx/5xx
         
         if response.status_code == 200:
-            result = response.json()
+            result = json.loads(response.content)
             
             # Adiciona informações extras para facilitar o debug
             if 'features' in result:
-                logging.info(f"Recebeu {len(result['features'])} features da API")
+                logging.info("Recebeu %d features da API", len(result['features']))
             else:
                 logging.warning("A resposta da API não contém a chave 'features'")
                 
@@ -235,9 +324,9 @@ def plan_route(agents, jobs=None, shipments=None, locations=None, mode="drive",
     if locations is not None:
         payload["locations"] = locations
 
-    response = requests.post(url, headers=headers, data=json.dumps(payload))
+    response = geoapify_request("POST", url, headers=headers, data=json.dumps(payload, separators=(',', ':')))
     if response.status_code == 200:
-        return response.json()
+        return json.loads(response.content)
     else:
         raise Exception(f"Erro na Route Planner API {response.status_code}: {response.text}")
 
@@ -264,10 +353,7 @@ def optimize_multiple_routes(
     if not passenger_groups:
         return []
     
-    results = []
-    
-    # Otimizar rota separada para cada grupo de passageiros
-    for i, group in enumerate(passenger_groups):
+    def optimize_group(i, group):
         vehicle_type = vehicle_types[i] if i < len(vehicle_types) else "car"
         
         try:
@@ -278,23 +364,27 @@ def optimize_multiple_routes(
                 max_duration_minutes,
                 vehicle_type
             )
-            results.append({
+            return {
                 "vehicle_index": i,
                 "vehicle_type": vehicle_type,
                 "passengers": len(group),
                 "route_data": route
-            })
+            }
         except Exception as e:
-            logging.error(f"Erro ao otimizar rota para veículo {i}: {e}")
-            results.append({
+            logging.error("Erro ao otimizar rota para veículo %s: %s", i, e)
+            return {
                 "vehicle_index": i,
                 "vehicle_type": vehicle_type,
                 "passengers": len(group),
                 "error": str(e),
                 "route_data": None
-            })
+            }
     
-    return results
+    # Cada grupo é uma requisição HTTP independente: dispara todas em paralelo,
+    # de modo que o tempo total acompanha a requisição mais lenta, não a soma.
+    # executor.map preserva a ordem dos grupos nos resultados
+    with ThreadPoolExecutor(max_workers=min(MAX_CONCURRENT_REQUESTS, len(passenger_groups))) as executor:
+        return list(executor.map(optimize_group, range(len(passenger_groups)), passenger_groups))
 
 def create_route_planner_payload(
     start_point: Dict[str, float],
@@ -316,17 +406,9 @@ def create_route_planner_payload(
     Returns:
         Dicionário com o payload formatado para a API
     """
-    # Mapeia tipos de veículos para configurações da API
-    vehicle_profiles = {
-        "car": {"type": "car"},
-        "van": {"type": "car", "max_speed": 90},
-        "bus": {"type": "car", "max_speed": 80},
-        "truck": {"type": "truck"},
-        "motorcycle": {"type": "motorcycle"}
-    }
-    
     # Usa car como perfil padrão se o tipo de veículo não for reconhecido
-    vehicle_profile = vehicle_profiles.get(vehicle_type.lower(), {"type": "car"})
+    # (cópia em dict: o payload é serializado em JSON e não deve compartilhar a constante)
+    vehicle_profile = dict(VEHICLE_PROFILES.get(vehicle_type.lower(), VEHICLE_PROFILES["car"]))
     
     # Criar agentes (veículos) - Agora sem especificar capacity
     agents = [{
@@ -359,6 +441,73 @@ def create_route_planner_payload(
     
     return payload
 
+# Job da Route Planner API já serializado, com as chaves na ordem de sort_keys
+_JOB_JSON = '{"duration":30,"id":"job_%d","location":[%r,%r]}'
+
+def route_planner_payload_json(
+    start_point: Dict[str, float],
+    end_point: Dict[str, float],
+    waypoints: List[Dict[str, Any]],
+    vehicle_type: str = "car",
+    max_duration_minutes: int = 45
+) -> str:
+    """
+    Serializa o payload de create_route_planner_payload em JSON canônico
+    (chaves ordenadas, sem espaços), como json.dumps(payload,
+    sort_keys=True, separators=(',', ':')), mas com as coordenadas das
+    paradas sempre escritas como float.
+    
+    Só o cabeçalho (agentes e opções) passa pelo json.dumps; os jobs, que
+    crescem com o número de paradas, são formatados direto de um template
+    em vez de montar e depois percorrer um dicionário por parada.
+    
+    Returns:
+        String JSON pronta para o corpo da requisição
+    """
+    header = json.dumps(
+        create_route_planner_payload(start_point, end_point, [], vehicle_type, max_duration_minutes),
+        sort_keys=True,
+        separators=(',', ':')
+    )
+    before, after = header.split('"jobs":[]', 1)
+    jobs = ",".join([
+        _JOB_JSON % (i, float(wp['lon']), float(wp['lat']))
+        for i, wp in enumerate(waypoints)
+    ])
+    return f'{before}"jobs":[{jobs}]{after}'
+
+def _geometry_path(geometry):
+    """
+    Trajeto de uma geometria LineString/MultiLineString ([lon, lat]) em colunas.
+    
+    Duas listas de floats em vez de um dicionário por vértice: rotas longas têm
+    milhares de pontos, e o resultado continua serializável em JSON.
+    
+    Returns:
+        {"lat": [...], "lon": [...]}, com as linhas de uma MultiLineString em sequência
+    """
+    if geometry.get('type') == 'MultiLineString':
+        lines = [np.asarray(line, dtype=np.float64).reshape(len(line), -1) for line in geometry['coordinates'] if line]
+        coords = np.concatenate(lines) if lines else np.empty((0, 2))
+    elif geometry.get('type') == 'LineString' and geometry.get('coordinates'):
+        coords = np.asarray(geometry['coordinates'], dtype=np.float64).reshape(len(geometry['coordinates']), -1)
+    else:
+        coords = np.empty((0, 2))
+    # Posições com altitude ([lon, lat, ele]) também funcionam: só as duas
+    # primeiras colunas são lidas
+    return {"lat": coords[:, 1].tolist(), "lon": coords[:, 0].tolist()}
+
+def _job_stop(stop_order, action, waypoint):
+    """Parada da rota para uma ação do tipo 'job' da Route Planner API."""
+    return {
+        "stop_order": stop_order,
+        "location_id": action['job_id'],
+        "coordinates": {"lat": waypoint['lat'], "lon": waypoint['lon']},
+        "address": waypoint.get('name', f"Parada {stop_order}"),
+        "persons": waypoint.get('persons', [waypoint]),
+        "arrival_time": action.get('start_time')
+    }
+
 def process_route_planner_response(response_data: Dict[str, Any], waypoints: List[Dict[str, Any]], start_point: Dict[str, float], end_point: Dict[str, float]) -> Dict[str, Any]:
     """
     Processa a resposta da Route Planner API e formata para uso na aplicação.
@@ -372,6 +521,9 @@ def process_route_planner_response(response_data: Dict[str, Any], waypoints: Lis
     Returns:
         Dicionário formatado para compatibilidade com a aplicação
     """
+    # Mapping job ids (as created by create_route_planner_payload) to original waypoints
+    waypoint_map = {f"job_{i}": wp for i, wp in enumerate(waypoints)}
+    
     # Check if the response is in FeatureCollection format
     if response_data.get('type') == 'FeatureCollection' and 'features' in response_data:
         # Extract agent information from features
@@ -388,19 +540,13 @@ def process_route_planner_response(response_data: Dict[str, Any], waypoints: Lis
                 "total_distance_km": agent_properties.get('distance', 0) / 1000,  # Convert meters to km
                 "total_duration_minutes": agent_properties.get('time', 0) / 60,  # Convert seconds to minutes
                 "stops": [],
-                "path": [],
+                "path": {"lat": [], "lon": []},
                 "features": [feature]  # Add the feature for map compatibility
             }
             
             # Process waypoints from the feature
             feature_waypoints = agent_properties.get('waypoints', [])
             
-            # Mapping job ids to original waypoints
-            waypoint_map = {}
-            for i, wp in enumerate(waypoints):
-                job_id = f"job_{i}"
-                waypoint_map[job_id] = wp
-            
             # Add start point
             result["stops"].append({
                 "stop_order": 0,
@@ -411,26 +557,14 @@ def process_route_planner_response(response_data: Dict[str, Any], waypoints: Lis
                 "arrival_time": feature_waypoints[0].get('start_time') if feature_waypoints else None
             })
             
-            # Process intermediate stops
-            for i, feature_wp in enumerate(feature_waypoints[1:-1], 1):  # Skip first (start) and last (end)
-                # Get actions at this waypoint
-                actions = feature_wp.get('actions', [])
-                
-                # Find job actions
-                job_actions = [action for action in actions if action.get('type') == 'job']
-                if job_actions:
-                    for action in job_actions:
-                        job_id = action.get('job_id')
-                        if job_id in waypoint_map:
-                            original_wp = waypoint_map[job_id]
-                            result["stops"].append({
-                                "stop_order": i,
-                                "location_id": job_id,
-                                "coordinates": {"lat": original_wp['lat'], "lon": original_wp['lon']},
-                                "address": original_wp.get('name', f"Parada {i}"),
-                                "persons": [original_wp],
-                                "arrival_time": action.get('start_time')
-                            })
+            # Process intermediate stops: one stop per job action with a known
+            # job id, skipping the first (start) and last (end) waypoints
+            result["stops"].extend(
+                _job_stop(i, action, waypoint_map[action.get('job_id')])
+                for i, feature_wp in enumerate(islice(feature_waypoints, 1, max(0, len(feature_waypoints) - 1)), 1)
+                for action in feature_wp.get('actions', [])
+                if action.get('type') == 'job' and action.get('job_id') in waypoint_map
+            )
             
             # Add end point
             result["stops"].append({
@@ -443,14 +577,7 @@ def process_route_planner_response(response_data: Dict[str, Any], waypoints: Lis
             
             # Process route geometry for drawing the path
             if 'geometry' in feature:
-                if feature['geometry']['type'] == 'MultiLineString':
-                    # Flatten the MultiLineString coordinates
-                    for line in feature['geometry']['coordinates']:
-                        for coord in line:
-                            result["path"].append({"lat": coord[1], "lon": coord[0]})
-                elif feature['geometry']['type'] == 'LineString':
-                    for coord in feature['geometry']['coordinates']:
-                        result["path"].append({"lat": coord[1], "lon": coord[0]})
+                result["path"] = _geometry_path(feature['geometry'])
             
             return result
     
@@ -468,7 +595,7 @@ def process_route_planner_response(response_data: Dict[str, Any], waypoints: Lis
         "total_distance_km": agent.get('distance', 0) / 1000,  # Converter metros para km
         "total_duration_minutes": agent.get('duration', 0) / 60,  # Converter segundos para minutos
         "stops": [],
-        "path": [],
+        "path": {"lat": [], "lon": []},
         "features": []
     }
     
@@ -496,9 +623,6 @@ def process_route_planner_response(response_data: Dict[str, Any], waypoints: Lis
     # Processar cada atividade na rota (paradas)
     stop_index = 1  # Começar em 1, pois 0 é o ponto de partida
     
-    # Mapear waypoints para uma estrutura que facilita a busca
-    waypoint_map = {f"pickup_{i}": wp for i, wp in enumerate(waypoints)}
-    
     # Processar cada atividade na rota (paradas)
     for activity in agent.get('activities', []):
         if activity.get('job_id') and activity.get('location'):
@@ -515,7 +639,7 @@ def process_route_planner_response(response_data: Dict[str, Any], waypoints: Lis
                     "location_id": job_id,
                     "coordinates": {"lat": location[1], "lon": location[0]},
                     "address": waypoint.get('name', f"Parada {stop_index}"),
-                    "persons": [waypoint],
+                    "persons": waypoint.get('persons', [waypoint]),
                     "arrival_time": activity.get('earliest_start'),
                     "person_id": waypoint.get('person_id')
                 })
@@ -553,13 +677,44 @@ def process_route_planner_response(response_data: Dict[str, Any], waypoints: Lis
             
             # Extrair path para desenho do mapa
             if route['geometry']['type'] == 'LineString':
-                # LineString: lista de [lon, lat]
-                coordinates = route['geometry']['coordinates']
-                for coord in coordinates:
-                    result["path"].append({"lat": coord[1], "lon": coord[0]})
+                result["path"] = _geometry_path(route['geometry'])
     
     return result
 
+class _RoutePlannerHTTPError(Exception):
+    """Resposta não-200 da Route Planner API; levantada para que o lru_cache não a memorize."""
+    
+    def __init__(self, response):
+        super().__init__(f"Route Planner API respondeu {response.status_code}")
+        self.response = response
+
+@lru_cache(maxsize=1024)
+def _route_planner_response(url: str, payload_json: str) -> bytes:
+    """
+    Envia um payload à Route Planner API, memorizando as respostas bem-sucedidas.
+    
+    O corpo JSON bruto é guardado (e não o dicionário) para que cada chamador
+    receba sua própria cópia ao decodificá-lo, e comprimido com zlib: a
+    geometria de rotas longas tem dezenas de milhares de coordenadas e o
+    texto delas comprime bem, o que limita a memória ocupada pelo cache.
+    
+    Returns:
+        Corpo da resposta 200, em JSON comprimido (use _decode_cached_body)
+    """
+    response = geoapify_request(
+        "POST",
+        url,
+        headers={"Content-Type": "application/json"},
+        data=payload_json
+    )
+    if response.status_code != 200:
+        raise _RoutePlannerHTTPError(response)
+    return zlib.compress(response.content, 1)
+
+def _decode_cached_body(body: bytes) -> Dict[str, Any]:
+    """Decodifica um corpo de resposta memorizado por _route_planner_response ou _routing_estimate_response."""
+    return json.loads(zlib.decompress(body))
+
 def plan_optimized_route(
     start_point: Dict[str, float], 
     end_point: Dict[str, float], 
@@ -588,60 +743,61 @@ def plan_optimized_route(
         raise Exception("A variável de ambiente GEOAPIFY_API_KEY não está definida.")
     
     url = f"https://api.geoapify.com/v1/routeplanner?apiKey={API_KEY}"
-    headers = {"Content-Type": "application/json"}
     
-    # Criar payload para a API
-    payload = create_route_planner_payload(
-        start_point,
-        end_point,
-        waypoints,
-        vehicle_type,
-        max_duration_minutes
-    )
+    # Passageiros no mesmo endereço viram um único job; a estimativa de tempo
+    # continua usando a lista original (uma parada por passageiro)
+    stops = dedup_waypoints(waypoints)
     
     try:
-        logging.info(f"Enviando solicitação para Route Planner API com {len(waypoints)} waypoints")
-        response = requests.post(url, headers=headers, data=json.dumps(payload))
+        logging.info("Enviando solicitação para Route Planner API com %d waypoints", len(stops))
+        # Payload canônico: viagens idênticas (mesma frota, mesmas paradas na
+        # mesma ordem) reaproveitam a resposta memorizada sem novo POST
+        payload_json = route_planner_payload_json(
+            start_point,
+            end_point,
+            stops,
+            vehicle_type,
+            max_duration_minutes
+        )
+        result_data = _decode_cached_body(_route_planner_response(url, payload_json))
         
-        if response.status_code == 200:
-            result_data = response.json()
+        # Check for both standard agent format and FeatureCollection format
+        if ('agents' in result_data and result_data['agents']) or \
+           (result_data.get('type') == 'FeatureCollection' and 'features' in result_data):
+            logging.info("Rota otimizada calculada com sucesso")
             
-            # Check for both standard agent format and FeatureCollection format
-            if ('agents' in result_data and result_data['agents']) or \
-               (result_data.get('type') == 'FeatureCollection' and 'features' in result_data):
-                logging.info("Rota otimizada calculada com sucesso")
-                
-                # Processar e formatar a resposta
-                result = process_route_planner_response(result_data, waypoints, start_point, end_point)
-                
-                # Adicionar campos para garantir que o tempo seja calculado corretamente
-                estimated_time = estimate_route_time(
-                    start_point,
-                    end_point,
-                    waypoints,
-                    vehicle_type,
-                    is_arrival
-                )
-                
-                # Adicionar o tempo estimado explicitamente ao resultado
-                result['estimated_time'] = estimated_time
-                result['is_arrival_route'] = is_arrival
-                
-                return result
-            else:
-                logging.error(f"Resposta inválida da API: {result_data}")
-                return {"error": "A API não retornou uma rota válida", "api_response": result_data}
-                
-        else:
-            error_msg = f"Erro na API ({response.status_code})"
-            try:
-                error_details = response.json()
-                error_msg += f": {json.dumps(error_details)}"
-            except:
-                error_msg += f": {response.text}"
+            # Processar e formatar a resposta
+            result = process_route_planner_response(result_data, stops, start_point, end_point)
             
-            logging.error(error_msg)
-            return {"error": error_msg}
+            # Adicionar campos para garantir que o tempo seja calculado corretamente
+            estimated_time = estimate_route_time(
+                start_point,
+                end_point,
+                waypoints,
+                vehicle_type,
+                is_arrival
+            )
+            
+            # Adicionar o tempo estimado explicitamente ao resultado
+            result['estimated_time'] = estimated_time
+            result['is_arrival_route'] = is_arrival
+            
+            return result
+        else:
+            logging.error("Resposta inválida da API: %s", result_data)
+            return {"error": "A API não retornou uma rota válida", "api_response": result_data}
+    
+    except _RoutePlannerHTTPError as e:
+        response = e.response
+        error_msg = f"Erro na API ({response.status_code})"
+        try:
+            error_details = response.json()
+            error_msg += f": {json.dumps(error_details)}"
+        except:
+            error_msg += f": {response.text}"
+        
+        logging.error(error_msg)
+        return {"error": error_msg}
             
     except Exception as e:
         error_msg = f"Falha na chamada à API de Route Planner: {str(e)}"
@@ -668,7 +824,7 @@ def extract_stops_sequence(route_data, waypoints):
                 "total_distance_km": agent_properties.get('distance', 0) / 1000,  # Convert meters to km
                 "total_duration_minutes": agent_properties.get('time', 0) / 60,  # Convert seconds to minutes
                 "stops": [],
-                "path": [],
+                "path": {"lat": [], "lon": []},
                 "features": [feature]  # Add the feature for map compatibility
             }
             
@@ -681,36 +837,217 @@ def extract_stops_sequence(route_data, waypoints):
                 job_id = f"job_{i}"
                 waypoint_map[job_id] = wp
 
-def haversine_distance(lat1: float, lon1: float, lat2: float, lon2: float) -> float:
+def haversine_distance(lat1: float, lon1: float, lat2: float, lon2: float, *,
+                       _sin=sin, _cos=cos, _asin=asin, _sqrt=sqrt) -> float:
     """
     Calcula a distância entre dois pontos na superfície terrestre usando a fórmula de Haversine.
     
     Args:
         lat1, lon1: Coordenadas do primeiro ponto
         lat2, lon2: Coordenadas do segundo ponto
+        _sin, _cos, _asin, _sqrt: Funções de math ligadas como locais (não informar)
         
     Returns:
         Distância em km
     """
-    # Raio da Terra em km
-    R = 6371.0
+    # Diferenças já convertidas para meio ângulo em radianos
+    sin_dlat = _sin((lat2 - lat1) * _HALF_DEG_TO_RAD)
+    sin_dlon = _sin((lon2 - lon1) * _HALF_DEG_TO_RAD)
+    
+    # Fórmula de Haversine (min protege o asin de erros de arredondamento)
+    a = sin_dlat * sin_dlat + _cos(lat1 * _DEG_TO_RAD) * _cos(lat2 * _DEG_TO_RAD) * sin_dlon * sin_dlon
+    return 2 * EARTH_RADIUS_KM * _asin(_sqrt(a if a < 1.0 else 1.0))
+
+def haversine_matrix(lats, lons) -> np.ndarray:
+    """
+    Calcula a matriz de distâncias de Haversine entre todos os pares de pontos.
+    
+    Vetorizada com NumPy: usar no lugar de chamadas repetidas a haversine_distance
+    quando as mesmas distâncias são consultadas muitas vezes (ordenação de paradas).
+    
+    Args:
+        lats, lons: Sequências com as latitudes e longitudes dos N pontos
+        
+    Returns:
+        Matriz (N, N) com as distâncias em km
+    """
+    lat = np.radians(np.asarray(lats, dtype=np.float64))
+    lon = np.radians(np.asarray(lons, dtype=np.float64))
+    
+    dlat = lat[:, None] - lat[None, :]
+    dlon = lon[:, None] - lon[None, :]
+    cos_lat = np.cos(lat)
+    
+    a = np.sin(dlat / 2) ** 2 + cos_lat[:, None] * cos_lat[None, :] * np.sin(dlon / 2) ** 2
+    # clip protege o arcsin de erros de arredondamento (a ligeiramente > 1)
+    return 2 * EARTH_RADIUS_KM * np.arcsin(np.sqrt(np.clip(a, 0.0, 1.0)))
+
+def _path_length_km(points) -> float:
+    """
+    Soma as distâncias de Haversine entre pontos consecutivos de um trajeto.
+    
+    Uma única passada com a fórmula inline (sem uma chamada a haversine_distance
+    por trecho) e o cosseno de cada latitude calculado uma só vez; para as poucas
+    dezenas de paradas de uma rota, isso é mais rápido que montar arrays NumPy.
+    
+    Args:
+        points: Sequência de dicionários com lat e lon, na ordem do trajeto
+        
+    Returns:
+        Distância total em km (0 para menos de dois pontos)
+    """
+    if len(points) < 2:
+        return 0.0
+    
+    # Funções e constantes como locais: o laço não consulta o escopo global
+    _sin, _cos, _asin, _sqrt = sin, cos, asin, sqrt
+    deg_to_rad, half_deg_to_rad = _DEG_TO_RAD, _HALF_DEG_TO_RAD
+    
+    total = 0.0
+    lat1, lon1 = points[0]['lat'], points[0]['lon']
+    cos1 = _cos(lat1 * deg_to_rad)
+    for point in islice(points, 1, None):
+        lat2, lon2 = point['lat'], point['lon']
+        cos2 = _cos(lat2 * deg_to_rad)
+        sin_dlat = _sin((lat2 - lat1) * half_deg_to_rad)
+        sin_dlon = _sin((lon2 - lon1) * half_deg_to_rad)
+        a = sin_dlat * sin_dlat + cos1 * cos2 * sin_dlon * sin_dlon
+        total += _asin(_sqrt(a if a < 1.0 else 1.0))
+        lat1, lon1, cos1 = lat2, lon2, cos2
+    return 2 * EARTH_RADIUS_KM * total
+
+def _route_distance_matrix(start_point, end_point, waypoints) -> np.ndarray:
+    """
+    Matriz de distâncias de uma rota: índice 0 é o início, 1..n são os
+    waypoints na ordem recebida e n+1 é o destino.
+    """
+    return haversine_matrix(*_route_coordinates(start_point, end_point, waypoints))
+
+def get_route_matrix(start_point, end_point, passengers, vehicle_type="car"):
+    """
+    Obtém numa única chamada à Route Matrix API da Geoapify os tempos reais
+    de viagem entre início, destino e todos os passageiros, para que a
+    ordenação de cada rota consulte uma tabela em vez de fazer novas chamadas.
+    
+    Args:
+        start_point: Ponto de partida
+        end_point: Ponto de chegada
+        passengers: Lista de passageiros com suas coordenadas
+        vehicle_type: Tipo de veículo (define o modo de viagem)
+        
+    Returns:
+        Tupla (matriz float32 de tempos em segundos, dict coordenadas -> linha),
+        com o início na linha 0 e o destino na linha 1; None se a API não
+        estiver disponível ou não retornar todos os pares
+    """
+    api_key = os.environ.get("GEOAPIFY_API_KEY", "")
+    if not api_key:
+        return None
+    
+    # Passageiros no mesmo endereço compartilham a linha da matriz
+    row_of = {}
+    points = [start_point, end_point]
+    for passenger in passengers:
+        key = _coord_key(passenger)
+        if key not in row_of:
+            row_of[key] = len(points)
+            points.append(passenger)
+    
+    if len(points) > ROUTE_MATRIX_MAX_POINTS:
+        logging.info("Matriz de tempos não solicitada: %d pontos (máximo %d)", len(points), ROUTE_MATRIX_MAX_POINTS)
+        return None
+    
+    locations = [{"location": [p['lon'], p['lat']]} for p in points]
+    payload = {
+        "mode": VEHICLE_TO_MODE.get(vehicle_type.lower(), "drive"),
+        "sources": locations,
+        "targets": locations
+    }
     
-    # Converter de graus para radianos
-    lat1_rad = math.radians(lat1)
-    lon1_rad = math.radians(lon1)
-    lat2_rad = math.radians(lat2)
-    lon2_rad = math.radians(lon2)
+    try:
+        response = geoapify_request("POST", f"{ROUTE_MATRIX_URL}?apiKey={api_key}", json=payload)
+        response.raise_for_status()
+        cells = [cell for row in response.json()['sources_to_targets'] for cell in row]
+    except (requests.exceptions.RequestException, ValueError, KeyError) as e:
+        logging.error("Erro ao obter matriz de tempos: %s", e)
+        return None
+    
+    times = np.full((len(points), len(points)), np.nan, dtype=np.float32)
+    for cell in cells:
+        if cell.get('time') is not None:
+            times[cell['source_index'], cell['target_index']] = cell['time']
     
-    # Diferenças nas coordenadas
-    dlat = lat2_rad - lat1_rad
-    dlon = lon2_rad - lon1_rad
+    # Pares sem rota deixariam buracos na ordenação: melhor usar as distâncias locais
+    if np.isnan(times).any():
+        logging.warning("Matriz de tempos incompleta, usando distâncias locais")
+        return None
     
-    # Fórmula de Haversine
-    a = math.sin(dlat/2)**2 + math.cos(lat1_rad) * math.cos(lat2_rad) * math.sin(dlon/2)**2
-    c = 2 * math.atan2(math.sqrt(a), math.sqrt(1-a))
-    distance = R * c
+    logging.info("Matriz de tempos obtida para %d pontos", len(points))
+    return times, row_of
+
+def _route_time_matrix(travel_times, waypoints) -> np.ndarray:
+    """
+    Recorta da matriz de get_route_matrix a matriz de uma rota, no mesmo
+    layout de _route_distance_matrix (0 = início, 1..n = waypoints, n+1 = destino).
+    """
+    times, row_of = travel_times
+    rows = [0, *(row_of[_coord_key(wp)] for wp in waypoints), 1]
+    return times[np.ix_(rows, rows)]
+
+# Perfis de tráfego por tipo de área: (hora inicial, hora final, fator) de cada
+# período e o fator padrão fora deles
+TRAFFIC_PROFILES = {
+    "urban": {
+        # Pico da manhã (7-10h): 50% mais tempo
+        "morning_peak": (7, 10, 1.5),
+        # Pico da tarde (16-20h): 60% mais tempo
+        "evening_peak": (16, 20, 1.6),
+        # Noite/madrugada (22-5h): 10% mais tempo
+        "night": (22, 5, 1.1),
+        # Padrão: 30% mais tempo
+        "default": 1.3
+    },
+    "suburban": {
+        "morning_peak": (7, 9, 1.4),
+        "evening_peak": (16, 19, 1.5),
+        "night": (22, 5, 1.05),
+        "default": 1.2
+    },
+    "rural": {
+        "morning_peak": (7, 9, 1.2),
+        "evening_peak": (16, 19, 1.3),
+        "night": (22, 5, 1.0),
+        "default": 1.1
+    }
+}
+
+def _hourly_factors(profile):
+    """
+    Fatores de tráfego das 24 horas de um perfil, sem cadeia de if/elif por hora.
+    
+    Cada período vira um intervalo [início, fim) aplicado com uma máscara sobre
+    as horas; os de maior prioridade (pico da manhã, pico da tarde, noite) são
+    aplicados por último. O período noturno cruza a meia-noite e é dividido em dois.
+    """
+    night_start, night_end, night_factor = profile["night"]
+    periods = (
+        profile["morning_peak"],
+        profile["evening_peak"],
+        (night_start, 24, night_factor),
+        (0, night_end, night_factor),
+    )
     
-    return distance
+    hours = np.arange(24)
+    factors = np.full(24, profile["default"], dtype=np.float64)
+    for start, end, factor in reversed(periods):
+        factors[(start <= hours) & (hours < end)] = factor
+    return tuple(factors.tolist())
+
+# Tabela pré-calculada: fator de tráfego para cada uma das 24 horas, por tipo de área
+_TRAFFIC_LUT = {
+    area_type: _hourly_factors(profile)
+    for area_type, profile in TRAFFIC_PROFILES.items()
+}
 
 def get_traffic_factor(hour: int = None, area_type: str = "urban") -> float:
     """
@@ -726,46 +1063,10 @@ def get_traffic_factor(hour: int = None, area_type: str = "urban") -> float:
     if hour is None:
         hour = datetime.now().hour
     
-    # Definir perfis de tráfego para diferentes tipos de área
-    traffic_profiles = {
-        "urban": {
-            # Pico da manhã (7-10h): 50% mais tempo
-            "morning_peak": (7, 10, 1.5),
-            # Pico da tarde (16-20h): 60% mais tempo
-            "evening_peak": (16, 20, 1.6),
-            # Noite/madrugada (22-5h): 10% mais tempo
-            "night": (22, 5, 1.1),
-            # Padrão: 30% mais tempo
-            "default": 1.3
-        },
-        "suburban": {
-            "morning_peak": (7, 9, 1.4),
-            "evening_peak": (16, 19, 1.5),
-            "night": (22, 5, 1.05),
-            "default": 1.2
-        },
-        "rural": {
-            "morning_peak": (7, 9, 1.2),
-            "evening_peak": (16, 19, 1.3),
-            "night": (22, 5, 1.0),
-            "default": 1.1
-        }
-    }
-    
     # Usar perfil "urban" como padrão se o tipo especificado não existir
-    profile = traffic_profiles.get(area_type, traffic_profiles["urban"])
-    
-    # Verificar em qual período do dia estamos
-    if profile["morning_peak"][0] <= hour < profile["morning_peak"][1]:
-        return profile["morning_peak"][2]
-    elif profile["evening_peak"][0] <= hour < profile["evening_peak"][1]:
-        return profile["evening_peak"][2]
-    elif profile["night"][0] <= hour or hour < profile["night"][1]:
-        return profile["night"][2]
-    else:
-        return profile["default"]
+    return _TRAFFIC_LUT.get(area_type, _TRAFFIC_LUT["urban"])[int(hour) % 24]
 
-def estimate_route_time(start_coord, end_coord, passengers, vehicle_type="car", is_arrival=True, area_type="urban"):
+def estimate_route_time(start_coord, end_coord, passengers, vehicle_type="car", is_arrival=True, area_type="urban", hour=None):
     """
     Estima o tempo de uma rota em minutos:
       - Se for ida: do ponto de partida até a empresa, passando por todos os passageiros.
@@ -778,6 +1079,7 @@ def estimate_route_time(start_coord, end_coord, passengers, vehicle_type="car",
         vehicle_type: Tipo do veículo (car, bus, etc.)
         is_arrival: Se é rota de ida para empresa (True) ou saída da empresa (False)
         area_type: Tipo de área para ajuste de tráfego ("urban", "suburban", "rural")
+        hour: Hora do dia para o fator de tráfego; se None usa a hora atual
         
     Returns:
         Tempo estimado em minutos.
@@ -785,67 +1087,45 @@ def estimate_route_time(start_coord, end_coord, passengers, vehicle_type="car",
     if not passengers:
         return 0
         
-    # Velocidade média estimada em km/h baseada no tipo de veículo
-    vehicle_speeds = {
-        "car": 40,
-        "van": 35,
-        "bus": 30,
-        "truck": 25,
-        "motorcycle": 45
-    }
-    avg_speed_kmh = vehicle_speeds.get(vehicle_type.lower(), 35)
-    
-    # Tempo gasto em cada parada em minutos (valores refinados por tipo de veículo)
-    stop_times = {
-        "car": 1,
-        "van": 1.5,
-        "bus": 2.5,
-        "truck": 2,
-        "motorcycle": 0.5
-    }
-    stop_time_minutes = stop_times.get(vehicle_type.lower(), 1)
-    
-    # Obter fator de tráfego dinâmico baseado na hora atual e tipo de área
-    traffic_factor = get_traffic_factor(area_type=area_type)
+    # Obter fator de tráfego dinâmico baseado na hora e tipo de área
+    traffic_factor = get_traffic_factor(hour, area_type)
     
-    # Calcular distância total do trajeto completo
-    total_distance = 0
-    prev_point = start_coord
-    
-    # Distância entre pontos consecutivos do trajeto
-    for passenger in passengers:
-        dist = haversine_distance(
-            prev_point['lat'], prev_point['lon'],
-            passenger['lat'], passenger['lon']
-        )
-        total_distance += dist
-        prev_point = passenger
-    
-    # Incluir a distância até o destino final
-    if is_arrival:  # Se for rota de ida, adicionar distância até a empresa
-        dist_to_end = haversine_distance(
-            prev_point['lat'], prev_point['lon'],
-            end_coord['lat'], end_coord['lon']
-        )
-        total_distance += dist_to_end
+    # Calcular distância total do trajeto completo em uma única passada:
+    # partida, passageiros em ordem e, se for rota de ida, a empresa.
     # Se for rota de volta, não adicionar distância de retorno após o último passageiro
+    path = [start_coord, *passengers, end_coord] if is_arrival else [start_coord, *passengers]
+    total_distance = _path_length_km(path)
+    
+    return _route_minutes(total_distance, len(passengers), vehicle_type, traffic_factor)
+
+def _route_minutes(distance_km, num_stops, vehicle_type, traffic_factor):
+    """
+    Tempo estimado (minutos, arredondado) para percorrer distance_km com
+    num_stops paradas, pelas mesmas regras de estimate_route_time.
+    """
+    vehicle_type = vehicle_type.lower()
+    avg_speed_kmh = VEHICLE_SPEEDS_KMH.get(vehicle_type, 35)
+    stop_time_minutes = STOP_TIMES_MINUTES.get(vehicle_type, 1)
     
     # Calcular tempo total
-    travel_time_minutes = (total_distance / avg_speed_kmh) * 60 * traffic_factor
-    stop_time_total = len(passengers) * stop_time_minutes
+    travel_time_minutes = (distance_km / avg_speed_kmh) * 60 * traffic_factor
+    stop_time_total = num_stops * stop_time_minutes
     total_time_minutes = travel_time_minutes + stop_time_total
     
     # Retornar tempo total arredondado
     return round(total_time_minutes, 1)
 
-def cluster_passengers_by_distance(passengers, epsilon=0.01, min_samples=1):
+def cluster_passengers_by_distance(passengers, epsilon=0.01, min_samples=1, coords=None):
     """
     Agrupa passageiros geograficamente próximos usando DBSCAN.
     
     Args:
         passengers: Lista de dicionários com lat e lon
-        epsilon: Distância máxima entre pontos para serem considerados no mesmo cluster
+        epsilon: Distância máxima, em graus de arco (~111 km por grau), entre pontos
+            para serem considerados no mesmo cluster
         min_samples: Número mínimo de pontos para formar um cluster
+        coords: Array (N, 2) com lat/lon dos passageiros, em graus, se já
+            calculado pelo chamador (ver _coords_array)
         
     Returns:
         Lista de clusters, onde cada cluster é uma lista de passageiros
@@ -853,30 +1133,44 @@ def cluster_passengers_by_distance(passengers, epsilon=0.01, min_samples=1):
     if not passengers:
         return []
         
-    # Converter dados para formato esperado pelo DBSCAN
-    points = np.array([[p['lat'], p['lon']] for p in passengers])
+    # Converter dados para formato esperado pelo DBSCAN (lat/lon em radianos)
+    points = np.radians(_coords_array(passengers) if coords is None else coords)
     
-    # Aplicar DBSCAN
+    # Aplicar DBSCAN com distância de grande círculo: a BallTree responde às
+    # buscas por vizinhança em O(log N) em vez de comparar todos os pares,
+    # distribuídas entre os núcleos disponíveis
     try:
-        db = DBSCAN(eps=epsilon, min_samples=min_samples, metric='euclidean').fit(points)
-        labels = db.labels_
-        
-        # Organizar pontos por cluster
-        clusters = defaultdict(list)
-        for i, label in enumerate(labels):
-            if label != -1:  # -1 são pontos classificados como ruído
-                clusters[label].append(passengers[i])
-            else:
-                # Tratar pontos isolados como clusters de um único passageiro
-                clusters[f"noise_{i}"] = [passengers[i]]
-                
-        return list(clusters.values())
+        db = DBSCAN(
+            eps=math.radians(epsilon),
+            min_samples=min_samples,
+            metric='haversine',
+            algorithm='ball_tree',
+            n_jobs=-1
+        ).fit(points)
+        labels = db.labels_.copy()
+        
+        # Tratar pontos isolados (rótulo -1, ruído) como clusters de um único passageiro
+        noise = labels == -1
+        labels[noise] = labels.max() + 1 + np.arange(np.count_nonzero(noise))
+        
+        # Renumerar os clusters pela ordem da primeira ocorrência e agrupar os
+        # índices com uma ordenação estável, sem um append por passageiro
+        _, first_seen, inverse, counts = np.unique(
+            labels, return_index=True, return_inverse=True, return_counts=True
+        )
+        cluster_order = np.argsort(first_seen, kind='stable')
+        rank = np.empty_like(cluster_order)
+        rank[cluster_order] = np.arange(len(cluster_order))
+        members = np.argsort(rank[inverse], kind='stable')
+        groups = np.split(members, np.cumsum(counts[cluster_order])[:-1])
+        
+        return [[passengers[i] for i in group.tolist()] for group in groups]
     except Exception as e:
-        logging.error(f"Erro ao realizar clustering DBSCAN: {e}")
+        logging.error("Erro ao realizar clustering DBSCAN: %s", e)
         # Retornar lista com cada passageiro como seu próprio cluster
         return [[p] for p in passengers]
 
-def optimize_route_order_tsp(start_point, end_point, waypoints):
+def optimize_route_order_tsp(start_point, end_point, waypoints, travel_times=None):
     """
     Otimiza a ordem dos waypoints usando uma heurística de solução do TSP.
     Utiliza a técnica de "construção + melhoria local" para encontrar uma rota eficiente.
@@ -885,6 +1179,8 @@ def optimize_route_order_tsp(start_point, end_point, waypoints):
         start_point: Ponto de partida
         end_point: Ponto de chegada
         waypoints: Lista de pontos intermediários a serem ordenados
+        travel_times: Matriz de tempos de get_route_matrix; se None, ordena
+            pela distância em linha reta
         
     Returns:
         Lista ordenada de waypoints
@@ -895,40 +1191,60 @@ def optimize_route_order_tsp(start_point, end_point, waypoints):
     # Se houver apenas um waypoint, não há nada para ordenar
     if len(waypoints) <= 1:
         return waypoints
+    
+    # Custo de cada trecho: tempo real de viagem, se houver matriz da API
+    # (não simétrica), ou distância em linha reta
+    if travel_times is not None:
+        full_matrix = _route_time_matrix(travel_times, waypoints)
+    else:
+        full_matrix = _route_distance_matrix(start_point, end_point, waypoints)
         
-    # Para rotas pequenas (até 5 pontos), podemos usar força bruta para garantir a melhor solução
-    if len(waypoints) <= 5:
-        return optimize_route_brute_force(start_point, end_point, waypoints)
+    # Para rotas pequenas, podemos garantir a melhor solução: força bruta para
+    # poucos pontos e programação dinâmica (Held-Karp) até EXACT_TSP_MAX_WAYPOINTS
+    # (a estratégia escolhida vai para o log, para diagnosticar rotas ruins)
+    if len(waypoints) <= 3:
+        logging.debug("TSP com %d paradas: força bruta", len(waypoints))
+        return optimize_route_brute_force(start_point, end_point, waypoints, full_matrix)
+    if len(waypoints) <= EXACT_TSP_MAX_WAYPOINTS:
+        logging.debug("TSP com %d paradas: Held-Karp", len(waypoints))
+        return optimize_route_held_karp(start_point, end_point, waypoints, full_matrix)
     
     # Para rotas maiores, usamos uma heurística mais eficiente
-    
-    # 1. Construção inicial: Algoritmo do vizinho mais próximo (NN)
-    current = start_point
-    unvisited = waypoints.copy()
-    route = []
-    
-    while unvisited:
-        # Encontrar o ponto mais próximo
-        closest_idx = 0
-        min_dist = float('inf')
-        
-        for i, point in enumerate(unvisited):
-            dist = haversine_distance(current['lat'], current['lon'], point['lat'], point['lon'])
-            if dist < min_dist:
-                min_dist = dist
-                closest_idx = i
+    logging.debug("TSP com %d paradas: vizinho mais próximo + 2-opt/Or-opt", len(waypoints))
+    
+    # 1. Construção inicial: Algoritmo do vizinho mais próximo (NN),
+    # consultando distâncias pré-calculadas de uma vez só
+    # (colunas de pontos já visitados, e a do início, marcadas como infinitas)
+    dist_matrix = full_matrix[:, :len(waypoints) + 1].copy()
+    dist_matrix[:, 0] = np.inf
+    current = 0
+    visit_order = []
+    
+    for _ in range(len(waypoints)):
+        # Encontrar o ponto mais próximo (o primeiro, em caso de empate)
+        current = int(dist_matrix[current].argmin())
+        dist_matrix[:, current] = np.inf
         
         # Adicionar o ponto mais próximo à rota
-        next_point = unvisited.pop(closest_idx)
-        route.append(next_point)
-        current = next_point
-    
-    # 2. Melhoramento: 2-opt para otimização local
-    route = two_opt_optimization(route, start_point, end_point)
-    
-    return route
+        visit_order.append(current)
+    
+    # 2. Melhoramento: 2-opt e Or-opt alternados sobre a ordem construída,
+    # reaproveitando as distâncias já calculadas, até nenhum dos dois achar
+    # melhora. Ambos invertem trechos da rota e supõem custos simétricos:
+    # com tempos reais, usa-se a média dos dois sentidos de cada trecho
+    if travel_times is not None:
+        full_matrix = (full_matrix + full_matrix.T) / 2
+    dist = full_matrix.tolist()
+    order = [0, *visit_order, len(waypoints) + 1]
+    for _ in range(LOCAL_SEARCH_MAX_ROUNDS):
+        _two_opt_order(dist, order)
+        before = order[:]
+        if _or_opt_order(dist, order) == before:
+            break
+    
+    return [waypoints[k - 1] for k in order[1:-1]]
 
-def optimize_route_brute_force(start_point, end_point, waypoints):
+def optimize_route_brute_force(start_point, end_point, waypoints, dist_matrix=None):
     """
     Encontra a ordem ótima dos waypoints testando todas as permutações possíveis.
     Adequado apenas para conjuntos pequenos (até 8-10 pontos, dependendo da capacidade computacional).
@@ -937,6 +1253,7 @@ def optimize_route_brute_force(start_point, end_point, waypoints):
         start_point: Ponto de partida
         end_point: Ponto de chegada
         waypoints: Lista de waypoints a serem ordenados
+        dist_matrix: Matriz de custos já calculada (layout de _route_distance_matrix)
         
     Returns:
         Lista ordenada de waypoints com menor distância total
@@ -946,53 +1263,93 @@ def optimize_route_brute_force(start_point, end_point, waypoints):
     if len(waypoints) <= 1:
         return waypoints
         
-    # Gerar todas as permutações possíveis dos waypoints
-    permutations = list(itertools.permutations(range(len(waypoints))))
+    # Distâncias entre todos os pontos, calculadas uma vez para todas as permutações
+    # (índices: 0 = início, 1..n = waypoints, n+1 = destino)
+    if dist_matrix is None:
+        dist_matrix = _route_distance_matrix(start_point, end_point, waypoints)
+    n = len(waypoints)
+    
+    # Todas as permutações como um array (n!, n+2) de índices da matriz, já com
+    # início e destino nas pontas; a distância de cada uma sai de uma única
+    # indexação avançada somada ao longo da linha
+    perms = np.array(list(itertools.permutations(range(1, n + 1))), dtype=np.intp)
+    full = np.empty((len(perms), n + 2), dtype=np.intp)
+    full[:, 0] = 0
+    full[:, 1:-1] = perms
+    full[:, -1] = n + 1
+    totals = dist_matrix[full[:, :-1], full[:, 1:]].sum(axis=1)
+    
+    # argmin devolve a primeira permutação de menor distância, na mesma ordem
+    # de itertools.permutations
+    best_order = perms[int(totals.argmin())]
+    return [waypoints[i - 1] for i in best_order]
+
+def optimize_route_held_karp(start_point, end_point, waypoints, dist_matrix=None):
+    """
+    Encontra a ordem ótima dos waypoints por programação dinâmica (Held-Karp).
     
-    best_distance = float('inf')
-    best_order = None
+    Em vez de testar as n! permutações, guarda para cada subconjunto de paradas
+    já visitadas (codificado como máscara de bits) e cada última parada o menor
+    custo até ali, em O(n² · 2ⁿ). As máscaras com o mesmo número de paradas são
+    resolvidas juntas, em operações vetorizadas do NumPy: ~20 ms com 15 pontos.
     
-    # Calcular distância total para cada permutação
-    for perm in permutations:
-        # Converter índices para pontos reais
-        ordered_points = [waypoints[i] for i in perm]
-        
-        # Calcular distância total
-        total_dist = 0
-        
-        # Distância do ponto inicial para o primeiro waypoint
-        if ordered_points:
-            total_dist += haversine_distance(
-                start_point['lat'], start_point['lon'],
-                ordered_points[0]['lat'], ordered_points[0]['lon']
-            )
-        
-        # Distância entre waypoints
-        for i in range(len(ordered_points) - 1):
-            total_dist += haversine_distance(
-                ordered_points[i]['lat'], ordered_points[i]['lon'],
-                ordered_points[i+1]['lat'], ordered_points[i+1]['lon']
-            )
-        
-        # Distância do último waypoint para o ponto final
-        if ordered_points:
-            total_dist += haversine_distance(
-                ordered_points[-1]['lat'], ordered_points[-1]['lon'],
-                end_point['lat'], end_point['lon']
-            )
+    Args:
+        start_point: Ponto de partida
+        end_point: Ponto de chegada
+        waypoints: Lista de waypoints a serem ordenados
+        dist_matrix: Matriz de custos já calculada, simétrica ou não
+            (layout de _route_distance_matrix)
         
-        # Atualizar a melhor rota se esta for melhor
-        if total_dist < best_distance:
-            best_distance = total_dist
-            best_order = perm
-    
-    # Converter a melhor ordem em uma lista de waypoints
-    if best_order is not None:
-        return [waypoints[i] for i in best_order]
-    else:
+    Returns:
+        Lista ordenada de waypoints com menor distância total
+    """
+    n = len(waypoints)
+    if n <= 1:
         return waypoints
+    
+    # Índices da matriz: 0 = início, 1..n = waypoints, n+1 = destino. A tabela
+    # do DP fica em float32 (2 MiB com 15 paradas, cabe no cache L2)
+    dist = dist_matrix if dist_matrix is not None else _route_distance_matrix(start_point, end_point, waypoints)
+    dist = dist.astype(np.float32, copy=False)
+    between = dist[1:n + 1, 1:n + 1]
+    bits = 1 << np.arange(n)
+    masks = np.arange(1 << n)
+    full_mask = (1 << n) - 1
+    
+    # cost[mask, i]: menor distância saindo do início, visitando as paradas do
+    # mask e terminando na parada i (infinito se i não está no mask);
+    # parent guarda a parada anterior a i nesse caminho
+    cost = np.full((1 << n, n), np.inf, dtype=np.float32)
+    parent = np.full((1 << n, n), -1, dtype=np.int8)
+    cost[bits, np.arange(n)] = dist[0, 1:n + 1]
+    
+    popcount = np.zeros(1 << n, dtype=np.int8)
+    for bit in bits:
+        popcount += (masks & bit) > 0
+    
+    # Camada a camada (k paradas visitadas): para cada última parada j, o custo
+    # vem do melhor caminho sobre o mesmo conjunto sem j, mais o trecho até j
+    for k in range(2, n + 1):
+        layer = masks[popcount == k]
+        for j in range(n):
+            with_j = layer[(layer & bits[j]) > 0]
+            candidates = cost[with_j ^ bits[j]] + between[:, j]
+            best = candidates.argmin(axis=1)
+            cost[with_j, j] = candidates[np.arange(len(with_j)), best]
+            parent[with_j, j] = best
+    
+    # Fechar no destino e reconstruir a ordem de trás para frente
+    last = int((cost[full_mask] + dist[1:n + 1, n + 1]).argmin())
+    order = []
+    mask = full_mask
+    while last != -1:
+        order.append(last)
+        last, mask = int(parent[mask, last]), mask & ~(1 << last)
+    order.reverse()
+    
+    return [waypoints[i] for i in order]
 
-def two_opt_optimization(route, start_point, end_point, max_iterations=100):
+def two_opt_optimization(route, start_point, end_point, max_iterations=100, dist_matrix=None):
     """
     Aplica a heurística de otimização 2-opt para melhorar a rota.
     
@@ -1001,177 +1358,196 @@ def two_opt_optimization(route, start_point, end_point, max_iterations=100):
         start_point: Ponto de partida da rota
         end_point: Ponto de chegada da rota
         max_iterations: Número máximo de iterações
+        dist_matrix: Matriz de distâncias já calculada, na ordem partida, route,
+            chegada (como _route_distance_matrix); se None, é calculada aqui
         
     Returns:
         Rota melhorada
     """
     if len(route) <= 2:
         return route
+    
+    # Distâncias calculadas uma única vez (0 = partida, 1..n = rota, n+1 = chegada);
+    # a rota é uma ordem de índices sobre essa matriz, alterada só no lugar
+    if dist_matrix is None:
+        dist_matrix = _route_distance_matrix(start_point, end_point, route)
+    order = _two_opt_order(dist_matrix.tolist(), list(range(len(route) + 2)), max_iterations)
+    
+    return [route[k - 1] for k in order[1:-1]]
+
+def _two_opt_order(dist, order, max_iterations=100):
+    """
+    Núcleo do 2-opt: melhora no lugar, e devolve, uma ordem de índices sobre
+    a matriz dist (lista de listas), mantendo fixos o primeiro e o último.
+    """
+    n = len(order) - 2
+    if n <= 2:
+        return order
+    
+    # Don't-look bits: look[i] fica falso quando nenhuma troca a partir da
+    # posição i melhorou a rota, e só volta a ser testada quando uma troca
+    # altera as arestas vizinhas. Quando as passadas parciais param de
+    # melhorar, uma passada completa confirma o ótimo local do 2-opt
+    look = [True] * (n - 2)
+    improved = True
+    iteration = 0
+    
+    while improved and iteration < max_iterations:
+        full_pass = all(look)
+        improved = False
         
-    best_route = route.copy()
+        # Testar trocas de segmentos: inverter route[i+1..j] troca só as arestas
+        # nas pontas do segmento, então o ganho sai de quatro distâncias, sem
+        # recalcular a rota inteira
+        for i in range(n - 2):
+            if not look[i]:
+                continue
+            
+            # A aresta de entrada do segmento (a -> b) só muda quando há troca:
+            # suas linhas da matriz ficam fora do laço interno
+            a, b = order[i + 1], order[i + 2]
+            row_a, row_b = dist[a], dist[b]
+            d_ab = row_a[b]
+            found = False
+            for j in range(i + 2, n):
+                c, d = order[j + 1], order[j + 2]
+                delta = row_a[c] + row_b[d] - d_ab - dist[c][d]
+                
+                # Se melhorou, inverter o segmento na rota e reativar as
+                # posições cujas arestas mudaram
+                if delta < -1e-9:
+                    order[i + 2:j + 2] = order[i + 2:j + 2][::-1]
+                    b = order[i + 2]
+                    row_b = dist[b]
+                    d_ab = row_a[b]
+                    for k in (i + 1, j, j + 1):
+                        if k < n - 2:
+                            look[k] = True
+                    found = True
+            
+            if found:
+                improved = True
+            else:
+                look[i] = False
+        
+        if not improved and not full_pass:
+            look = [True] * (n - 2)
+            improved = True
+        
+        iteration += 1
+    
+    return order
+
+def _or_opt_order(dist, order, max_iterations=100, max_segment=3):
+    """
+    Or-opt: move trechos de até max_segment paradas consecutivas para a
+    melhor outra posição da rota, na mesma direção ou invertidos, um tipo de
+    troca que o 2-opt sozinho não alcança. Melhora no lugar, e devolve, a
+    ordem de índices sobre a matriz dist (simétrica), mantendo fixos o
+    primeiro e o último.
+    """
+    n = len(order) - 2
     improved = True
     iteration = 0
     
     while improved and iteration < max_iterations:
         improved = False
-        best_distance = calculate_route_distance(start_point, end_point, best_route)
-        
-        # Testar trocas de segmentos
-        for i in range(len(route) - 2):
-            for j in range(i + 2, len(route)):
-                # Criar nova rota com segmento invertido
-                new_route = best_route.copy()
-                new_route[i+1:j+1] = reversed(new_route[i+1:j+1])
+        
+        for length in range(1, min(max_segment, n - 1) + 1):
+            i = 1
+            while i + length <= n:
+                # Retirar o trecho order[i:i+length] liga prev direto a nxt
+                prev, first = order[i - 1], order[i]
+                last, nxt = order[i + length - 1], order[i + length]
+                removal_gain = dist[prev][first] + dist[last][nxt] - dist[prev][nxt]
                 
-                # Calcular nova distância
-                new_distance = calculate_route_distance(start_point, end_point, new_route)
+                # Melhor aresta (a -> b) fora do trecho para reinseri-lo; com a
+                # matriz simétrica, dist[a][first] é row_first[a]
+                row_first, row_last = dist[first], dist[last]
+                best_delta, best_j, best_reversed = -1e-9, None, False
+                for j, (a, b) in enumerate(zip(order, islice(order, 1, None))):
+                    if i - 1 <= j < i + length:
+                        continue
+                    d_ab = dist[a][b] + removal_gain
+                    delta = row_first[a] + row_last[b] - d_ab
+                    if delta < best_delta:
+                        best_delta, best_j, best_reversed = delta, j, False
+                    if length > 1:
+                        delta = row_last[a] + row_first[b] - d_ab
+                        if delta < best_delta:
+                            best_delta, best_j, best_reversed = delta, j, True
                 
-                # Se melhorou, atualizar a rota
-                if new_distance < best_distance:
-                    best_distance = new_distance
-                    best_route = new_route
+                if best_j is not None:
+                    segment = order[i:i + length]
+                    if best_reversed:
+                        segment.reverse()
+                    del order[i:i + length]
+                    position = best_j + 1 if best_j < i else best_j + 1 - length
+                    order[position:position] = segment
                     improved = True
+                i += 1
         
         iteration += 1
     
-    return best_route
+    return order
 
-def calculate_route_distance(start_point, end_point, waypoints):
+def haversine_vector(lat1, lon1, lat2, lon2) -> np.ndarray:
     """
-    Calcula a distância total de uma rota.
+    Versão vetorizada de haversine_distance: calcula, elemento a elemento,
+    as distâncias entre os pares de pontos de arrays de coordenadas.
     
     Args:
-        start_point: Ponto de partida
-        end_point: Ponto de chegada
-        waypoints: Lista ordenada de waypoints
+        lat1, lon1: Arrays com as coordenadas dos pontos de origem
+        lat2, lon2: Arrays com as coordenadas dos pontos de destino
         
     Returns:
-        Distância total em km
+        Array com as distâncias em km
     """
-    total_distance = 0
-    
-    # Adicionar distância do ponto inicial ao primeiro waypoint
-    if waypoints:
-        total_distance += haversine_distance(
-            start_point['lat'], start_point['lon'],
-            waypoints[0]['lat'], waypoints[0]['lon']
-        )
-    
-    # Adicionar distâncias entre waypoints
-    for i in range(len(waypoints) - 1):
-        total_distance += haversine_distance(
-            waypoints[i]['lat'], waypoints[i]['lon'],
-            waypoints[i+1]['lat'], waypoints[i+1]['lon']
-        )
-    
-    # Adicionar distância do último waypoint ao ponto final
-    if waypoints:
-        total_distance += haversine_distance(
-            waypoints[-1]['lat'], waypoints[-1]['lon'],
-            end_point['lat'], end_point['lon']
-        )
+    lat1 = np.radians(lat1)
+    lat2 = np.radians(lat2)
+    sin_dlat = np.sin((lat2 - lat1) / 2)
+    sin_dlon = np.sin(np.radians(np.subtract(lon2, lon1)) / 2)
     
-    return total_distance
+    a = sin_dlat * sin_dlat + np.cos(lat1) * np.cos(lat2) * sin_dlon * sin_dlon
+    return 2 * EARTH_RADIUS_KM * np.arcsin(np.sqrt(np.minimum(a, 1.0)))
 
-def plan_routes_by_time_constraint(start_coord, end_coord, passengers, max_duration_minutes, vehicle_types=None, is_arrival=True, area_type="urban"):
+def _coords_array(points) -> np.ndarray:
     """
-    Planeja múltiplas rotas otimizadas respeitando o limite de tempo por rota, utilizando
-    clustering geográfico e otimização de rota.
+    Coordenadas de uma sequência de pontos (dicionários com lat e lon) como
+    um array (N, 2) de float64, lido direto para o buffer com np.fromiter.
+    """
+    return np.fromiter(
+        (c for point in points for c in (point['lat'], point['lon'])),
+        dtype=np.float64,
+        count=2 * len(points)
+    ).reshape(-1, 2)
+
+def _route_coordinates(start_point, end_point, waypoints) -> Tuple[np.ndarray, np.ndarray]:
+    """Arrays de latitudes e longitudes do trajeto partida -> waypoints -> chegada."""
+    coords = _coords_array((start_point, *waypoints, end_point))
+    return coords[:, 0], coords[:, 1]
+
+def calculate_route_distance(start_point, end_point, waypoints):
+    """
+    Calcula a distância total de uma rota.
     
     Args:
-        start_coord: Coordenadas do ponto de partida
-        end_coord: Coordenadas do ponto de chegada
-        passengers: Lista de passageiros com suas coordenadas
-        max_duration_minutes: Tempo máximo permitido por rota (em minutos)
-        vehicle_types: Lista de tipos de veículos disponíveis
-        is_arrival: Se é rota de chegada (True) ou saída (False)
-        area_type: Tipo de área para ajuste de tráfego
+        start_point: Ponto de partida
+        end_point: Ponto de chegada
+        waypoints: Lista ordenada de waypoints
         
     Returns:
-        Lista de rotas, cada uma contendo uma lista de passageiros atendidos
+        Distância total em km
     """
-    st.info(f"Planejando rotas com limite de {max_duration_minutes} minutos por rota...")
-    
-    if not passengers:
-        return []
-    
-    if not vehicle_types:
-        vehicle_types = ["car"]
-    
-    # Etapa 1: Agrupar passageiros por proximidade geográfica
-    # Calculamos um valor de epsilon apropriado para a região geográfica
-    # Usamos uma fração da distância total da área para determinar o raio dos clusters
-    
-    # Determinar tamanho da área
-    lats = [p['lat'] for p in passengers]
-    lons = [p['lon'] for p in passengers]
-    lat_range = max(lats) - min(lats)
-    lon_range = max(lons) - min(lons)
-    
-    # Epsilon dinâmico baseado na distribuição geográfica dos pontos
-    # Se muitos pontos, clusters menores; se poucos, clusters maiores
-    epsilon = max(0.005, min(0.02, (lat_range + lon_range) / 50))
-    
-    # Ajustar min_samples baseado no número de passageiros
-    min_samples = max(1, len(passengers) // 25)
-    
-    logging.info(f"Aplicando clustering com epsilon={epsilon}, min_samples={min_samples}")
-    initial_clusters = cluster_passengers_by_distance(passengers, epsilon, min_samples)
-    
-    # Etapa 2: Para cada cluster, otimizar a ordem dos pontos e verificar limite de tempo
-    final_routes = []
-    vehicle_type_index = 0
-    
-    for cluster in initial_clusters:
-        # Se o cluster for muito grande, podemos precisar dividi-lo
-        optimized_route = optimize_route_order_tsp(start_coord, end_coord, cluster)
-        
-        # Verificação iterativa: o cluster cabe em uma única rota?
-        estimated_time = estimate_route_time(
-            start_coord, 
-            end_coord, 
-            optimized_route, 
-            vehicle_types[vehicle_type_index % len(vehicle_types)],
-            is_arrival,
-            area_type
-        )
-        
-        # Se o tempo estiver dentro do limite, adicione como uma única rota
-        if estimated_time <= max_duration_minutes:
-            final_routes.append({
-                'passengers': optimized_route,
-                'estimated_time': estimated_time,
-                'vehicle_type': vehicle_types[vehicle_type_index % len(vehicle_types)]
-            })
-            vehicle_type_index += 1
-        else:
-            # Dividir em subrotas que respeitam o limite de tempo
-            subroutes = divide_route_by_time_limit(
-                start_coord,
-                end_coord,
-                optimized_route,
-                max_duration_minutes,
-                vehicle_types[vehicle_type_index % len(vehicle_types)],
-                is_arrival,
-                area_type
-            )
-            
-            # Adicionar cada subrota à lista final
-            for subroute in subroutes:
-                final_routes.append({
-                    'passengers': subroute['passengers'],
-                    'estimated_time': subroute['estimated_time'],
-                    'vehicle_type': vehicle_types[vehicle_type_index % len(vehicle_types)]
-                })
-                vehicle_type_index += 1
-    
-    # Ordenar rotas por tempo estimado (do maior para o menor)
-    final_routes.sort(key=lambda x: x['estimated_time'], reverse=True)
+    # Sem waypoints a rota não tem trechos a somar
+    if not waypoints:
+        return 0
     
-    logging.info(f"Planejamento concluído: {len(final_routes)} rotas geradas para {len(passengers)} passageiros")
-    return final_routes
+    # Todos os trechos (partida, waypoints em ordem, chegada) em uma única chamada vetorizada
+    lats, lons = _route_coordinates(start_point, end_point, waypoints)
+    return float(haversine_vector(lats[:-1], lons[:-1], lats[1:], lons[1:]).sum())
 
-def divide_route_by_time_limit(start_coord, end_coord, passengers, max_duration_minutes, vehicle_type="car", is_arrival=True, area_type="urban"):
+def divide_route_by_time_limit(start_coord, end_coord, passengers, max_duration_minutes, vehicle_type="car", is_arrival=True, area_type="urban", hour=None):
     """
     Divide uma lista de passageiros em múltiplas rotas, todas respeitando
     o limite de tempo.
@@ -1184,6 +1560,7 @@ def divide_route_by_time_limit(start_coord, end_coord, passengers, max_duration_
         vehicle_type: Tipo de veículo
         is_arrival: Se é rota de chegada (True) ou saída (False) 
         area_type: Tipo de área para ajuste de tráfego
+        hour: Hora do dia para o fator de tráfego; se None usa a hora atual
         
     Returns:
         Lista de subrotas, cada uma com seus passageiros e tempo estimado
@@ -1191,75 +1568,56 @@ def divide_route_by_time_limit(start_coord, end_coord, passengers, max_duration_
     if not passengers:
         return []
     
-    # Inicialização
+    # Fator de tráfego fixado uma vez: todas as estimativas desta divisão usam
+    # o mesmo, em vez de consultar o relógio a cada tentativa
+    traffic_factor = get_traffic_factor(hour, area_type)
+    
+    def leg_km(a, b):
+        return haversine_distance(a['lat'], a['lon'], b['lat'], b['lon'])
+    
+    def route_minutes(route_km, last, num_stops):
+        # Rota de ida termina na empresa; a de volta, no último passageiro
+        if is_arrival:
+            route_km += leg_km(last, end_coord)
+        return _route_minutes(route_km, num_stops, vehicle_type, traffic_factor)
+    
+    # Inicialização: a rota atual guarda a distância acumulada da partida até
+    # o último passageiro, então testar o próximo custa um trecho, não a rota toda
     subroutes = []
     current_route = []
-    remaining = passengers.copy()
+    current_km = current_time = 0.0
     
-    # Processo iterativo de construção das rotas
-    while remaining:
+    for passenger in passengers:
         # Testar se podemos adicionar o próximo passageiro
-        test_route = current_route + [remaining[0]]
+        last, base_km = (current_route[-1], current_km) if current_route else (start_coord, 0.0)
+        test_km = base_km + leg_km(last, passenger)
+        test_time = route_minutes(test_km, passenger, len(current_route) + 1)
         
-        # Calcular tempo estimado
-        test_time = estimate_route_time(
-            start_coord, 
-            end_coord, 
-            test_route, 
-            vehicle_type,
-            is_arrival,
-            area_type
-        )
+        # Não cabe: finalizar a rota atual e começar outra com este passageiro
+        if current_route and test_time > max_duration_minutes:
+            subroutes.append({
+                'passengers': current_route,
+                'estimated_time': current_time
+            })
+            current_route = []
+            test_km = leg_km(start_coord, passenger)
+            test_time = route_minutes(test_km, passenger, 1)
         
-        if test_time <= max_duration_minutes and current_route:
-            # Podemos adicionar o passageiro à rota atual
-            current_route.append(remaining.pop(0))
-        else:
-            # Se a rota atual não está vazia, finalizá-la
-            if current_route:
-                current_time = estimate_route_time(
-                    start_coord, 
-                    end_coord, 
-                    current_route, 
-                    vehicle_type,
-                    is_arrival,
-                    area_type
-                )
-                subroutes.append({
-                    'passengers': current_route,
-                    'estimated_time': current_time
-                })
-                
-                # Iniciar nova rota
-                current_route = []
-            
-            # Se não pudermos adicionar o passageiro mesmo em uma rota vazia,
-            # criar uma rota apenas para ele
-            if not current_route and remaining:
-                solo_time = estimate_route_time(
-                    start_coord, 
-                    end_coord, 
-                    [remaining[0]], 
-                    vehicle_type,
-                    is_arrival,
-                    area_type
-                )
-                subroutes.append({
-                    'passengers': [remaining.pop(0)],
-                    'estimated_time': solo_time
-                })
-                logging.warning(f"Passageiro com tempo estimado de {solo_time:.1f} min adicionado em rota individual.")
+        current_route.append(passenger)
+        current_km = test_km
+        current_time = test_time
+        
+        # Se não cabe nem sozinho, o passageiro fica em uma rota individual
+        if len(current_route) == 1 and current_time > max_duration_minutes:
+            subroutes.append({
+                'passengers': current_route,
+                'estimated_time': current_time
+            })
+            logging.warning("Passageiro com tempo estimado de %.1f min adicionado em rota individual.", current_time)
+            current_route = []
     
     # Adicionar a última rota se não estiver vazia
     if current_route:
-        current_time = estimate_route_time(
-            start_coord, 
-            end_coord, 
-            current_route, 
-            vehicle_type,
-            is_arrival,
-            area_type
-        )
         subroutes.append({
             'passengers': current_route,
             'estimated_time': current_time
@@ -1267,6 +1625,30 @@ def divide_route_by_time_limit(start_coord, end_coord, passengers, max_duration_
     
     return subroutes
 
+@lru_cache(maxsize=1024)
+def _routing_estimate_response(waypoints_str: str, travel_mode: str, api_key: str) -> bytes:
+    """
+    Consulta a Routing API da Geoapify para uma sequência de pontos, com
+    memorização: a mesma sequência e modo não gera uma nova requisição.
+    
+    Erros são propagados como exceções (e por isso não ficam em cache); o
+    corpo é guardado comprimido, como em _route_planner_response.
+    
+    Returns:
+        Corpo da resposta, em JSON comprimido (use _decode_cached_body)
+    """
+    params = {
+        "waypoints": waypoints_str,
+        "mode": travel_mode,
+        "traffic": "approximated",
+        "details": "route_details",
+        "units": "metric",
+        "apiKey": api_key
+    }
+    response = geoapify_request("GET", "https://api.geoapify.com/v1/routing", params=params)
+    response.raise_for_status()
+    return zlib.compress(response.content, 1)
+
 def get_real_route_estimate(
     start_point: Dict[str, float],
     end_point: Dict[str, float],
@@ -1316,67 +1698,45 @@ def get_real_route_estimate(
     if len(route_points) < 2:
         return None
         
-    # Mapeia tipos de veículos para modos de viagem da API
-    vehicle_to_mode = {
-        "car": "drive",
-        "bus": "drive",
-        "van": "drive", 
-        "truck": "truck",
-        "motorcycle": "motorcycle"
-    }
-    travel_mode = vehicle_to_mode.get(vehicle_type.lower(), "drive")
+    travel_mode = VEHICLE_TO_MODE.get(vehicle_type.lower(), "drive")
     
     # Construir a string de waypoints
     waypoint_coords = [f"{p['lat']},{p['lon']}" for p in route_points]
     waypoints_str = "|".join(waypoint_coords)
     
-    url = "https://api.geoapify.com/v1/routing"
-    params = {
-        "waypoints": waypoints_str,
-        "mode": travel_mode,
-        "traffic": "approximated",
-        "details": "route_details",
-        "units": "metric",
-        "apiKey": API_KEY
-    }
-    
     try:
-        response = requests.get(url, params=params)
-        response.raise_for_status()
+        # Tentativas repetidas com a mesma sequência de pontos (ajustes em
+        # optimize_route_with_api_feedback) reaproveitam a resposta memorizada
+        data = _decode_cached_body(_routing_estimate_response(waypoints_str, travel_mode, API_KEY))
+        
+        if 'features' in data and len(data['features']) > 0:
+            feature = data['features'][0]
+            if 'properties' in feature:
+                properties = feature['properties']
+                
+                # Extrair dados da rota
+                distance_meters = properties.get('distance', 0)
+                time_seconds = properties.get('time', 0)
+                
+                return {
+                    'time_minutes': round(time_seconds / 60, 1),
+                    'distance_km': round(distance_meters / 1000, 2),
+                    'success': True,
+                    'raw_response': data
+                }
+        
+        logging.warning("Resposta da API não contém os dados esperados")
+        return {
+            'success': False,
+            'message': "Dados da rota não encontrados na resposta"
+        }
         
-        if response.status_code == 200:
-            data = response.json()
-            
-            if 'features' in data and len(data['features']) > 0:
-                feature = data['features'][0]
-                if 'properties' in feature:
-                    properties = feature['properties']
-                    
-                    # Extrair dados da rota
-                    distance_meters = properties.get('distance', 0)
-                    time_seconds = properties.get('time', 0)
-                    
-                    return {
-                        'time_minutes': round(time_seconds / 60, 1),
-                        'distance_km': round(distance_meters / 1000, 2),
-                        'success': True,
-                        'raw_response': data
-                    }
-            
-            logging.warning("Resposta da API não contém os dados esperados")
-            return {
-                'success': False,
-                'message': "Dados da rota não encontrados na resposta"
-            }
-            
     except requests.exceptions.RequestException as e:
-        logging.error(f"Erro ao chamar a API de routing: {str(e)}")
+        logging.error("Erro ao chamar a API de routing: %s", e)
         return {
             'success': False,
             'message': f"Erro de requisição: {str(e)}"
         }
-    
-    return None
 
 def optimize_route_with_api_feedback(
     start_point: Dict[str, float],
@@ -1385,7 +1745,8 @@ def optimize_route_with_api_feedback(
     max_duration_minutes: int = 45,
     vehicle_type: str = "car",
     is_arrival: bool = True,
-    max_retries: int = 3
+    max_retries: int = 3,
+    travel_times=None
 ) -> Dict[str, Any]:
     """
     Otimiza uma rota com feedback da API, ajustando a ordem ou removendo pontos se necessário.
@@ -1398,6 +1759,7 @@ def optimize_route_with_api_feedback(
         vehicle_type: Tipo de veículo 
         is_arrival: Se True, considera rota de ida para empresa
         max_retries: Número máximo de tentativas para ajustar a rota
+        travel_times: Matriz de tempos de get_route_matrix, usada na ordenação
         
     Returns:
         Rota otimizada com detalhes e status
@@ -1408,26 +1770,60 @@ def optimize_route_with_api_feedback(
             'message': "Sem waypoints para otimizar"
         }
     
-    # Primeiro, otimizar a ordem dos waypoints (TSP)
+    # Primeiro, otimizar a ordem dos waypoints (TSP) e obter estimativa da API
     logging.info("Otimizando ordem dos waypoints usando TSP")
-    ordered_waypoints = optimize_route_order_tsp(start_point, end_point, waypoints)
-    
-    # Tentar obter estimativa da API com os waypoints ordenados
-    api_estimate = get_real_route_estimate(
-        start_point,
-        end_point,
-        ordered_waypoints,
-        vehicle_type,
-        is_arrival
-    )
+    attempts = [_api_route_attempt(start_point, end_point, waypoints, vehicle_type, is_arrival, travel_times)]
+    ordered_waypoints, api_estimate = attempts[0]
     
-    # Se a API retornou dados válidos, verificar limite de tempo
-    if api_estimate and api_estimate.get('success', False):
+    # Excedeu o limite de tempo: em vez de uma tentativa por vez (uma ida e
+    # volta à API por retry), testar em paralelo rotas com k, 2k, 3k... paradas
+    # a menos, removendo as últimas (a rota já está ordenada)
+    if api_estimate and api_estimate.get('success', False) and max_retries > 0 and len(ordered_waypoints) > 1:
+        time_minutes = api_estimate.get('time_minutes', 0)
+        if time_minutes > max_duration_minutes:
+            # Se excesso for muito grande, remover mais pontos de uma vez
+            excess_percentage = (time_minutes / max_duration_minutes) - 1
+            points_to_remove = max(1, int(len(ordered_waypoints) * excess_percentage * 0.5))
+            sizes = sorted({
+                max(1, len(ordered_waypoints) - points_to_remove * m)
+                for m in range(1, max_retries + 1)
+            }, reverse=True)
+            
+            logging.info("Tentando remover %s parada(s) por tentativa para ficar dentro do limite", points_to_remove)
+            with ThreadPoolExecutor(max_workers=len(sizes)) as executor:
+                attempts.extend(executor.map(
+                    lambda size: _api_route_attempt(
+                        start_point, end_point, ordered_waypoints[:size], vehicle_type, is_arrival, travel_times
+                    ),
+                    sizes
+                ))
+    
+    # Primeira tentativa (da maior para a menor rota) que cabe no limite
+    for ordered_waypoints, api_estimate in attempts:
+        if not (api_estimate and api_estimate.get('success', False)):
+            # Fallback: API falhou, usar estimativa local
+            logging.warning("Falha ao obter estimativa da API, usando cálculo local")
+            local_time = estimate_route_time(
+                start_point,
+                end_point,
+                ordered_waypoints,
+                vehicle_type,
+                is_arrival
+            )
+            
+            return {
+                'waypoints': ordered_waypoints,
+                'estimated_time': local_time,
+                'success': True,
+                'message': f"Rota otimizada com estimativa local: {local_time} min",
+                'api_failure': True
+            }
+        
         time_minutes = api_estimate.get('time_minutes', 0)
         
         # Se estiver dentro do limite, retornar esta rota
         if time_minutes <= max_duration_minutes:
-            logging.info(f"Rota otimizada pela API: {time_minutes} min, dentro do limite de {max_duration_minutes} min")
+            logging.info("Rota otimizada pela API: %s min, dentro do limite de %s min", time_minutes, max_duration_minutes)
             return {
                 'waypoints': ordered_waypoints,
                 'api_estimate': api_estimate,
@@ -1435,61 +1831,29 @@ def optimize_route_with_api_feedback(
                 'message': f"Rota otimizada com sucesso: {time_minutes} min",
                 'estimated_time': time_minutes  # Garantir que o tempo estimado esteja disponível
             }
-        else:
-            # Excedeu o limite de tempo, tentar ajustar a rota
-            logging.warning(f"Rota excede o limite: {time_minutes} min > {max_duration_minutes} min")
-            
-            # Implementar estratégia de ajuste: remover waypoints até caber no limite
-            if max_retries > 0:
-                # Calcular quantos pontos podemos tentar remover
-                excess_percentage = (time_minutes / max_duration_minutes) - 1
-                # Se excesso for muito grande, remover mais pontos de uma vez
-                points_to_remove = max(1, int(len(ordered_waypoints) * excess_percentage * 0.5))
-                points_to_remove = min(points_to_remove, len(ordered_waypoints) - 1)  # Não remover todos
-                
-                logging.info(f"Tentando remover {points_to_remove} parada(s) para ficar dentro do limite")
-                
-                # Priorizar remoção de pontos que aumentam mais o trajeto
-                # Para simplificar, vamos remover os últimos pontos (assumindo que já estão ordenados)
-                adjusted_waypoints = ordered_waypoints[:-points_to_remove] if points_to_remove < len(ordered_waypoints) else ordered_waypoints[:1]
-                
-                # Tentar novamente com os waypoints ajustados e um retry a menos
-                return optimize_route_with_api_feedback(
-                    start_point,
-                    end_point,
-                    adjusted_waypoints,
-                    max_duration_minutes,
-                    vehicle_type,
-                    is_arrival,
-                    max_retries - 1
-                )
-            else:
-                # Sem mais tentativas, retornar falha ou os melhores resultados possíveis
-                return {
-                    'waypoints': ordered_waypoints,
-                    'api_estimate': api_estimate,
-                    'success': False,
-                    'message': f"Não foi possível ajustar a rota para o limite de {max_duration_minutes} min (atual: {time_minutes} min)",
-                    'estimated_time': time_minutes  # Mesmo excedendo, incluímos o tempo para feedback
-                }
-    else:
-        # Fallback: API falhou, usar estimativa local
-        logging.warning("Falha ao obter estimativa da API, usando cálculo local")
-        local_time = estimate_route_time(
-            start_point,
-            end_point,
-            ordered_waypoints,
-            vehicle_type,
-            is_arrival
-        )
         
-        return {
-            'waypoints': ordered_waypoints,
-            'estimated_time': local_time,
-            'success': True,
-            'message': f"Rota otimizada com estimativa local: {local_time} min",
-            'api_failure': True
-        }
+        logging.warning("Rota excede o limite: %s min > %s min", time_minutes, max_duration_minutes)
+    
+    # Sem mais tentativas, retornar falha com a menor rota testada
+    return {
+        'waypoints': ordered_waypoints,
+        'api_estimate': api_estimate,
+        'success': False,
+        'message': f"Não foi possível ajustar a rota para o limite de {max_duration_minutes} min (atual: {time_minutes} min)",
+        'estimated_time': time_minutes  # Mesmo excedendo, incluímos o tempo para feedback
+    }
+
+def _api_route_attempt(start_point, end_point, waypoints, vehicle_type, is_arrival, travel_times=None):
+    """Ordena os waypoints (TSP) e obtém a estimativa da API para a rota resultante."""
+    ordered_waypoints = optimize_route_order_tsp(start_point, end_point, waypoints, travel_times)
+    api_estimate = get_real_route_estimate(
+        start_point,
+        end_point,
+        ordered_waypoints,
+        vehicle_type,
+        is_arrival
+    )
+    return ordered_waypoints, api_estimate
 
 def plan_routes_by_time_constraint(start_coord, end_coord, passengers, max_duration_minutes, vehicle_types=None, is_arrival=True, area_type="urban", use_api=True):
     """
@@ -1514,18 +1878,13 @@ def plan_routes_by_time_constraint(start_coord, end_coord, passengers, max_durat
     if not passengers:
         return []
     
-    if not vehicle_types:
-        vehicle_types = ["car"]
-    
     # Etapa 1: Agrupar passageiros por proximidade geográfica
     # Calculamos um valor de epsilon apropriado para a região geográfica
     # Usamos uma fração da distância total da área para determinar o raio dos clusters
     
-    # Determinar tamanho da área
-    lats = [p['lat'] for p in passengers]
-    lons = [p['lon'] for p in passengers]
-    lat_range = max(lats) - min(lats)
-    lon_range = max(lons) - min(lons)
+    # Determinar tamanho da área (coordenadas lidas uma vez, reaproveitadas no clustering)
+    coords = _coords_array(passengers)
+    lat_range, lon_range = np.ptp(coords, axis=0).tolist()
     
     # Epsilon dinâmico baseado na distribuição geográfica dos pontos
     # Se muitos pontos, clusters menores; se poucos, clusters maiores
@@ -1534,26 +1893,151 @@ def plan_routes_by_time_constraint(start_coord, end_coord, passengers, max_durat
     # Ajustar min_samples baseado no número de passageiros
     min_samples = max(1, len(passengers) // 25)
     
-    logging.info(f"Aplicando clustering com epsilon={epsilon}, min_samples={min_samples}")
-    initial_clusters = cluster_passengers_by_distance(passengers, epsilon, min_samples)
+    logging.info("Aplicando clustering com epsilon=%s, min_samples=%s", epsilon, min_samples)
+    initial_clusters = cluster_passengers_by_distance(passengers, epsilon, min_samples, coords)
     
-    # Etapa 2: Para cada cluster, otimizar a ordem dos pontos e verificar limite de tempo
-    final_routes = []
-    vehicle_type_index = 0
-    
-    # Status para o usuário
+    # Etapa 2: otimizar cada cluster, recebendo as rotas à medida que ficam
+    # prontas, com o status para o usuário
     total_clusters = len(initial_clusters)
+    routes_by_cluster = [[] for _ in initial_clusters]
     progress_bar = st.progress(0)
     status_text = st.empty()
     
-    for i, cluster in enumerate(initial_clusters):
-        progress_percentage = (i / total_clusters)
-        progress_bar.progress(progress_percentage)
-        status_text.text(f"Otimizando rota {i+1}/{total_clusters} com {len(cluster)} passageiros...")
+    # A interface só é atualizada aqui, na thread do Streamlit. Com muitos
+    # clusters, cada atualização é uma mensagem ao navegador: no máximo uma
+    # a cada PROGRESS_UPDATE_INTERVAL segundos
+    last_update = 0.0
+    cluster_routes = iter_cluster_routes(
+        start_coord, end_coord, initial_clusters, max_duration_minutes,
+        vehicle_types, is_arrival, area_type, use_api
+    )
+    for done, (i, routes) in enumerate(cluster_routes, 1):
+        routes_by_cluster[i] = routes
+        now = time.monotonic()
+        if now - last_update >= PROGRESS_UPDATE_INTERVAL:
+            progress_bar.progress(done / total_clusters)
+            status_text.text(f"Rota {done}/{total_clusters} otimizada com {len(initial_clusters[i])} passageiros...")
+            last_update = now
+    
+    # Rotas na ordem dos clusters (e não na de conclusão), para que o
+    # resultado não dependa de qual chamada à API terminou primeiro
+    final_routes = [route for routes in routes_by_cluster for route in routes]
+    
+    progress_bar.progress(1.0)  # Completar a barra de progresso
+    status_text.text(f"Planejamento concluído: {len(final_routes)} rotas geradas para {len(passengers)} passageiros")
+    
+    # Ordenar rotas por tempo estimado (do maior para o menor), no lugar e
+    # estável: empates mantêm a ordem dos clusters
+    final_routes.sort(key=itemgetter('estimated_time'), reverse=True)
+    
+    logging.info("Planejamento concluído: %d rotas geradas para %d passageiros", len(final_routes), len(passengers))
+    return final_routes
+
+def _plan_from_routes(routes, cluster):
+    """
+    Reduz as rotas de um cluster ao que o cache guarda: a ordem das paradas
+    como índices no cluster, sem os dados dos passageiros
+    
+    Returns:
+        Lista de rotas com 'stops' no lugar de 'passengers', ou None se alguma
+        parada não for um dos passageiros do cluster
+    """
+    index_of = {id(passenger): j for j, passenger in enumerate(cluster)}
+    plan = []
+    for route in routes:
+        stops = [index_of.get(id(passenger)) for passenger in route['passengers']]
+        if None in stops:
+            return None
+        plan.append({
+            'stops': stops,
+            'estimated_time': route['estimated_time'],
+            'vehicle_type': route['vehicle_type'],
+            'api_optimized': route['api_optimized']
+        })
+    return plan
+
+def _routes_from_plan(plan, cluster):
+    """
+    Reconstrói as rotas de um cluster a partir do plano guardado no cache,
+    com os passageiros atuais do cluster (a chave cobre só as coordenadas)
+    """
+    return [{
+        'passengers': [cluster[j] for j in entry['stops']],
+        'estimated_time': entry['estimated_time'],
+        'vehicle_type': entry['vehicle_type'],
+        'api_optimized': entry['api_optimized']
+    } for entry in plan]
+
+def iter_cluster_routes(start_coord, end_coord, clusters, max_duration_minutes, vehicle_types=None, is_arrival=True, area_type="urban", use_api=True):
+    """
+    Otimiza os clusters de passageiros em paralelo e gera as rotas de cada um
+    assim que ficam prontas, sem esperar pelos demais: quem consome pode
+    exibir a primeira rota enquanto as outras ainda aguardam a API.
+    
+    Não usa nenhuma chamada st.*; o progresso fica a cargo de quem consome.
+    
+    Args:
+        start_coord: Coordenadas do ponto de partida
+        end_coord: Coordenadas do ponto de chegada
+        clusters: Lista de clusters (listas de passageiros)
+        max_duration_minutes: Tempo máximo permitido por rota (em minutos)
+        vehicle_types: Lista de tipos de veículos, atribuídos aos clusters de forma cíclica
+        is_arrival: Se é rota de chegada (True) ou saída (False)
+        area_type: Tipo de área para ajuste de tráfego
+        use_api: Se True, usa a API para estimativas reais quando possível
         
-        # Atualizar tipo de veículo de forma cíclica
-        vehicle_type = vehicle_types[vehicle_type_index % len(vehicle_types)]
-        vehicle_type_index += 1
+    Yields:
+        Tuplas (índice do cluster, rotas do cluster), na ordem de conclusão
+    """
+    if not clusters:
+        return
+    
+    if not vehicle_types:
+        vehicle_types = ["car"]
+    
+    # Hora do fator de tráfego fixada no início do planejamento: todos os
+    # clusters usam o mesmo fator, mesmo que a hora vire durante a execução
+    hour = datetime.now().hour
+    
+    # Clusters já planejados com os mesmos parâmetros saem do cache antes de
+    # qualquer chamada à API (nem a matriz de tempos os inclui). O cache guarda
+    # só a ordem das paradas e a divisão em rotas; os passageiros vêm sempre
+    # do cluster atual, mesmo que outra pessoa ocupe as mesmas coordenadas
+    plan_cache = shared_routing_cache()
+    cache_keys = [
+        "plan:" + plan_cache.create_key(
+            start_coord,
+            end_coord,
+            cluster,
+            mode=f"{vehicle_types[i % len(vehicle_types)]}|{max_duration_minutes}|{is_arrival}|{area_type}|{hour}|{use_api}"
+        )
+        for i, cluster in enumerate(clusters)
+    ]
+    pending = []
+    for i, cache_key in enumerate(cache_keys):
+        cached = plan_cache.get(cache_key)
+        if cached is not None:
+            yield i, _routes_from_plan(cached, clusters[i])
+        else:
+            pending.append(i)
+    
+    if not pending:
+        return
+    
+    # Tempos reais entre todos os pontos numa única chamada à API, no modo do
+    # primeiro tipo de veículo; os clusters desse modo ordenam suas paradas
+    # consultando a matriz em vez de usar a distância em linha reta
+    travel_times = get_route_matrix(start_coord, end_coord, [p for i in pending for p in clusters[i]], vehicle_types[0]) if use_api else None
+    matrix_mode = VEHICLE_TO_MODE.get(vehicle_types[0].lower(), "drive")
+    
+    # Etapa 2: Para cada cluster, otimizar a ordem dos pontos e verificar limite de tempo
+    def plan_cluster(i, cluster):
+        # Tipo de veículo atribuído de forma cíclica, pela posição do cluster
+        vehicle_type = vehicle_types[i % len(vehicle_types)]
+        cluster_times = travel_times if VEHICLE_TO_MODE.get(vehicle_type.lower(), "drive") == matrix_mode else None
+        routes = []
+        # Só vão para o cache resultados que não dependeram de uma falha da API
+        cacheable = True
         
         if use_api and len(cluster) > 1:
             # Usar otimização com feedback da API
@@ -1564,12 +2048,14 @@ def plan_routes_by_time_constraint(start_coord, end_coord, passengers, max_durat
                     cluster,
                     max_duration_minutes,
                     vehicle_type,
-                    is_arrival
+                    is_arrival,
+                    travel_times=cluster_times
                 )
                 
                 if api_result['success']:
                     # API otimização bem-sucedida
                     optimized_waypoints = api_result['waypoints']
+                    cacheable = not api_result.get('api_failure', False)
                     
                     # Obter tempo estimado (da API ou local)
                     estimated_time = (
@@ -1578,7 +2064,7 @@ def plan_routes_by_time_constraint(start_coord, end_coord, passengers, max_durat
                         else api_result.get('estimated_time', 0)
                     )
                     
-                    final_routes.append({
+                    routes.append({
                         'passengers': optimized_waypoints,
                         'estimated_time': estimated_time,
                         'vehicle_type': vehicle_type,
@@ -1586,10 +2072,10 @@ def plan_routes_by_time_constraint(start_coord, end_coord, passengers, max_durat
                     })
                     
                     # Exibir detalhes do resultado
-                    logging.info(f"Cluster {i+1}: Rota otimizada com API, {len(optimized_waypoints)} passageiros, {estimated_time:.1f} min")
+                    logging.info("Cluster %d: Rota otimizada com API, %d passageiros, %.1f min", i + 1, len(optimized_waypoints), estimated_time)
                 else:
                     # API falhou em otimizar dentro do limite
-                    logging.warning(f"Cluster {i+1}: Falha na otimização com API. Mensagem: {api_result['message']}")
+                    logging.warning("Cluster %d: Falha na otimização com API. Mensagem: %s", i + 1, api_result['message'])
                     
                     # Usar método de divisão de rota para garantir que fique dentro do limite
                     subroutes = divide_route_by_time_limit(
@@ -1599,61 +2085,65 @@ def plan_routes_by_time_constraint(start_coord, end_coord, passengers, max_durat
                         max_duration_minutes,
                         vehicle_type,
                         is_arrival,
-                        area_type
+                        area_type,
+                        hour
                     )
                     
-                    # Adicionar subrotas à lista final
+                    # Adicionar subrotas à lista final, completando os próprios
+                    # dicionários em vez de copiá-los
                     for subroute in subroutes:
-                        final_routes.append({
-                            'passengers': subroute['passengers'],
-                            'estimated_time': subroute['estimated_time'],
-                            'vehicle_type': vehicle_type,
-                            'api_optimized': False
-                        })
+                        subroute['vehicle_type'] = vehicle_type
+                        subroute['api_optimized'] = False
+                    routes.extend(subroutes)
                         
-                    logging.info(f"Cluster {i+1} dividido em {len(subroutes)} sub-rotas")
+                    logging.info("Cluster %d dividido em %d sub-rotas", i + 1, len(subroutes))
             
             except Exception as e:
-                logging.error(f"Erro ao otimizar rota usando API: {str(e)}")
+                logging.error("Erro ao otimizar rota usando API: %s", e)
+                cacheable = False
                 # Fallback para o método tradicional em caso de exceção
-                fallback_result = fallback_route_optimization(
+                routes.extend(fallback_route_optimization(
                     start_coord,
                     end_coord,
                     cluster,
                     max_duration_minutes,
                     vehicle_type,
                     is_arrival,
-                    area_type
-                )
-                final_routes.extend(fallback_result)
+                    area_type,
+                    hour,
+                    cluster_times
+                ))
         
         else:
             # Usar método tradicional (sem API)
-            fallback_result = fallback_route_optimization(
+            routes.extend(fallback_route_optimization(
                 start_coord,
                 end_coord,
                 cluster,
                 max_duration_minutes,
                 vehicle_type,
                 is_arrival,
-                area_type
-            )
-            final_routes.extend(fallback_result)
+                area_type,
+                hour,
+                cluster_times
+            ))
         
-        # Evitar muitas requisições API seguidas
-        if use_api and i < total_clusters - 1:
-            time.sleep(0.5)  # Pequena pausa entre chamadas API
-    
-    progress_bar.progress(1.0)  # Completar a barra de progresso
-    status_text.text(f"Planejamento concluído: {len(final_routes)} rotas geradas para {len(passengers)} passageiros")
-    
-    # Ordenar rotas por tempo estimado (do maior para o menor)
-    final_routes.sort(key=lambda x: x['estimated_time'], reverse=True)
-    
-    logging.info(f"Planejamento concluído: {len(final_routes)} rotas geradas para {len(passengers)} passageiros")
-    return final_routes
+        if cacheable:
+            plan = _plan_from_routes(routes, cluster)
+            if plan is not None:
+                plan_cache.set(cache_keys[i], plan)
+        
+        return routes
+    
+    # Clusters otimizados em paralelo: cada um espera por chamadas HTTP à
+    # Geoapify, e o limite de requisições simultâneas fica a cargo de
+    # geoapify_request
+    with ThreadPoolExecutor(max_workers=min(MAX_CONCURRENT_REQUESTS, len(pending))) as executor:
+        futures = {executor.submit(plan_cluster, i, clusters[i]): i for i in pending}
+        for future in as_completed(futures):
+            yield futures[future], future.result()
 
-def fallback_route_optimization(start_coord, end_coord, waypoints, max_duration_minutes, vehicle_type, is_arrival, area_type):
+def fallback_route_optimization(start_coord, end_coord, waypoints, max_duration_minutes, vehicle_type, is_arrival, area_type, hour=None, travel_times=None):
     """
     Método de fallback para otimização de rota quando API falha ou não é utilizada.
     Usa TSP e verificação de limite de tempo.
@@ -1662,7 +2152,7 @@ def fallback_route_optimization(start_coord, end_coord, waypoints, max_duration_
         Lista de rotas otimizadas
     """
     # Se o cluster for muito grande, podemos precisar dividi-lo
-    optimized_route = optimize_route_order_tsp(start_coord, end_coord, waypoints)
+    optimized_route = optimize_route_order_tsp(start_coord, end_coord, waypoints, travel_times)
     
     # Verificação iterativa: o cluster cabe em uma única rota?
     estimated_time = estimate_route_time(
@@ -1671,7 +2161,8 @@ def fallback_route_optimization(start_coord, end_coord, waypoints, max_duration_
         optimized_route, 
         vehicle_type,
         is_arrival,
-        area_type
+        area_type,
+        hour
     )
     
     # Se o tempo estiver dentro do limite, adicione como uma única rota
@@ -1691,13 +2182,13 @@ def fallback_route_optimization(start_coord, end_coord, waypoints, max_duration_
             max_duration_minutes,
             vehicle_type,
             is_arrival,
-            area_type
+            area_type,
+            hour
         )
         
-        # Formatar resultado para compatibilidade
-        return [{
-            'passengers': subroute['passengers'],
-            'estimated_time': subroute['estimated_time'],
-            'vehicle_type': vehicle_type,
-            'api_optimized': False
-        } for subroute in subroutes]
\ No newline at end of file
+        # Formatar resultado para compatibilidade, nos próprios dicionários
+        # das subrotas (novos a cada divisão, sem outras referências)
+        for subroute in subroutes:
+            subroute['vehicle_type'] = vehicle_type
+            subroute['api_optimized'] = False
+        return subroutes
\ No newline at end of file
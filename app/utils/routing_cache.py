@@ -4,23 +4,36 @@ Utilitário para cache de solicitações de rotas para reduzir chamadas à API
 import os
 import json
 import time
+import sqlite3
 import logging
-from datetime import datetime
+import threading
+import zlib
+from collections import OrderedDict
 from pathlib import Path
 import hashlib
+import numpy as np
+
+# Versão do esquema do banco do cache, guardada em PRAGMA user_version
+_CACHE_SCHEMA_VERSION = 1
 
 class RoutingCache:
     """
     Cache para armazenar resultados de roteamento e reduzir chamadas à API
+    
+    As entradas ficam num único arquivo SQLite (modo WAL), com um LRU em
+    memória na frente: acertos repetidos no mesmo processo não tocam o disco.
+    Cada resposta é guardada uma única vez, endereçada pelo hash do conteúdo,
+    e chaves com respostas idênticas apontam para o mesmo blob.
     """
     
-    def __init__(self, cache_dir=None, max_age_hours=24):
+    def __init__(self, cache_dir=None, max_age_hours=24, memory_entries=4096):
         """
         Inicializa o cache de rotas
         
         Args:
-            cache_dir: Diretório para armazenar os arquivos de cache
+            cache_dir: Diretório para armazenar o banco do cache
             max_age_hours: Tempo máximo em horas para considerar um cache válido
+            memory_entries: Número máximo de entradas mantidas em memória
         """
         if cache_dir is None:
             # Usar diretório padrão na pasta do app
@@ -32,8 +45,65 @@ class RoutingCache:
         self.cache_dir.mkdir(parents=True, exist_ok=True)
         
         self.max_age_seconds = max_age_hours * 3600
+        self.memory_entries = memory_entries
+        
+        # Entradas recentes em memória: cache_key -> (timestamp, JSON serializado).
+        # Cada acerto desserializa de novo: quem recebe os dados pode alterá-los
+        # sem mudar o que o cache devolve depois
+        self._memory = OrderedDict()
+        
+        # Uma conexão compartilhada entre as threads do Streamlit, serializada pelo lock
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(
+            self.cache_dir / 'routes.sqlite',
+            isolation_level=None,
+            check_same_thread=False
+        )
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        # blobs: respostas comprimidas, pelo hash do JSON; entries: chave -> blob.
+        # Criado só quando user_version está atrás, como em database.py (a tabela
+        # cache, de antes da deduplicação, é descartada nessa mesma migração)
+        if self._conn.execute("PRAGMA user_version").fetchone()[0] < _CACHE_SCHEMA_VERSION:
+            self._conn.execute("BEGIN")
+            self._conn.execute("DROP TABLE IF EXISTS cache")
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS blobs (hash BLOB PRIMARY KEY, data BLOB NOT NULL)"
+            )
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS entries ("
+                "key TEXT PRIMARY KEY, ts REAL NOT NULL, blob_hash BLOB NOT NULL REFERENCES blobs(hash))"
+            )
+            self._conn.execute("CREATE INDEX IF NOT EXISTS entries_ts_idx ON entries(ts)")
+            self._conn.execute(f"PRAGMA user_version = {_CACHE_SCHEMA_VERSION}")
+            self._conn.execute("COMMIT")
         
-        logging.info(f"Cache de rotas inicializado em: {self.cache_dir}")
+        self.purge_expired()
+        
+        logging.info("Cache de rotas inicializado em: %s", self.cache_dir)
+    
+    def purge_expired(self):
+        """
+        Remove do banco as entradas mais antigas que max_age_hours e os blobs
+        que deixaram de ser referenciados, seja pela expiração, seja por uma
+        entrada substituída por set()
+            
+        Returns:
+            Número de entradas removidas
+        """
+        with self._lock:
+            cursor = self._conn.execute("DELETE FROM entries WHERE ts < ?", (time.time() - self.max_age_seconds,))
+            self._conn.execute("DELETE FROM blobs WHERE hash NOT IN (SELECT blob_hash FROM entries)")
+        if cursor.rowcount:
+            logging.info("%d entradas expiradas removidas do cache de rotas", cursor.rowcount)
+        return cursor.rowcount
+    
+    def _remember(self, cache_key, ts, raw):
+        """Guarda a entrada no LRU em memória, descartando a menos usada se cheio (com o lock adquirido)."""
+        self._memory[cache_key] = (ts, raw)
+        self._memory.move_to_end(cache_key)
+        if len(self._memory) > self.memory_entries:
+            self._memory.popitem(last=False)
     
     def get(self, cache_key):
         """
@@ -45,28 +115,36 @@ class RoutingCache:
         Returns:
             Dados da rota ou None se não encontrados ou expirados
         """
-        cache_file = self.cache_dir / f"{cache_key}.json"
-        
-        if not cache_file.exists():
-            return None
-        
         try:
+            with self._lock:
+                entry = self._memory.get(cache_key)
+                if entry is not None:
+                    self._memory.move_to_end(cache_key)
+                else:
+                    row = self._conn.execute(
+                        "SELECT e.ts, b.data FROM entries e JOIN blobs b ON b.hash = e.blob_hash WHERE e.key = ?",
+                        (cache_key,)
+                    ).fetchone()
+                    if row is None:
+                        return None
+                    entry = (row[0], zlib.decompress(row[1]))
+                    self._remember(cache_key, *entry)
+            
+            ts, raw = entry
+            
             # Verificar idade do cache
-            file_age = time.time() - os.path.getmtime(cache_file)
+            entry_age = time.time() - ts
             
-            # Se o arquivo é muito antigo, ignorar
-            if file_age > self.max_age_seconds:
-                logging.info(f"Cache expirado para {cache_key} (idade: {file_age / 3600:.1f}h)")
+            # Se a entrada é muito antiga, ignorar
+            if entry_age > self.max_age_seconds:
+                logging.info("Cache expirado para %s (idade: %.1fh)", cache_key, entry_age / 3600)
                 return None
             
-            # Ler e retornar dados do cache
-            with cache_file.open('r') as f:
-                data = json.load(f)
-                logging.info(f"Cache encontrado para {cache_key} (idade: {file_age / 60:.1f}min)")
-                return data
-                
+            logging.info("Cache encontrado para %s (idade: %.1fmin)", cache_key, entry_age / 60)
+            return json.loads(raw)
+        
         except Exception as e:
-            logging.error(f"Erro ao ler cache {cache_key}: {e}")
+            logging.error("Erro ao ler cache %s: %s", cache_key, e)
             return None
     
     def set(self, cache_key, data):
@@ -80,15 +158,35 @@ class RoutingCache:
         Returns:
             True se conseguiu armazenar, False em caso de erro
         """
-        cache_file = self.cache_dir / f"{cache_key}.json"
-        
         try:
-            with cache_file.open('w') as f:
-                json.dump(data, f)
-            logging.info(f"Cache salvo para {cache_key}")
+            # JSON compacto, endereçado pelo próprio hash: uma resposta idêntica
+            # à de outra chave só ganha uma nova entrada, sem outro blob
+            raw = json.dumps(data, separators=(',', ':')).encode('utf-8')
+            blob_hash = hashlib.blake2b(raw, digest_size=16).digest()
+            ts = time.time()
+            with self._lock:
+                self._conn.execute("BEGIN")
+                try:
+                    if self._conn.execute("SELECT 1 FROM blobs WHERE hash = ?", (blob_hash,)).fetchone() is None:
+                        # Comprimido com zlib: as coordenadas das rotas dominam o
+                        # tamanho da resposta, e o texto delas encolhe várias vezes
+                        self._conn.execute(
+                            "INSERT INTO blobs (hash, data) VALUES (?, ?)",
+                            (blob_hash, zlib.compress(raw, 1))
+                        )
+                    self._conn.execute(
+                        "INSERT OR REPLACE INTO entries (key, ts, blob_hash) VALUES (?, ?, ?)",
+                        (cache_key, ts, blob_hash)
+                    )
+                    self._conn.execute("COMMIT")
+                except Exception:
+                    self._conn.execute("ROLLBACK")
+                    raise
+                self._remember(cache_key, ts, raw)
+            logging.info("Cache salvo para %s", cache_key)
             return True
         except Exception as e:
-            logging.error(f"Erro ao salvar cache {cache_key}: {e}")
+            logging.error("Erro ao salvar cache %s: %s", cache_key, e)
             return False
     
     def create_key(self, start_point, end_point, waypoints, mode="drive"):
@@ -104,27 +202,52 @@ class RoutingCache:
         Returns:
             String única para esta solicitação
         """
-        # Simplificar os pontos para a chave de cache (reduzir precisão para 5 casas decimais)
-        def simplify_point(point):
+        # Pontos sem coordenadas entram na chave como (0, 0)
+        def point_coords(point):
             if isinstance(point, dict) and 'lat' in point and 'lon' in point:
-                return f"{round(point['lat'], 5)},{round(point['lon'], 5)}"
-            return "0,0"
-        
-        start_str = simplify_point(start_point)
-        end_str = simplify_point(end_point)
-        
-        # Reduzir waypoints para no máximo 10 para a chave (evitar chaves muito longas)
-        if len(waypoints) > 10:
-            # Selecionar pontos em intervalos regulares
-            step = len(waypoints) // 10
-            sampled_waypoints = [waypoints[i] for i in range(0, len(waypoints), step)][:10]
-        else:
-            sampled_waypoints = waypoints
+                return point['lat'], point['lon']
+            return 0.0, 0.0
         
-        waypoints_str = "|".join(simplify_point(wp) for wp in sampled_waypoints)
+        # Início, todos os waypoints e destino num único array, arredondado de
+        # uma vez para 5 casas decimais (somar 0.0 troca -0.0 por 0.0); a chave
+        # cobre a rota inteira, sem amostrar waypoints
+        points = [start_point, *waypoints, end_point]
+        try:
+            coords = np.fromiter(
+                (c for point in points for c in (point['lat'], point['lon'])),
+                dtype=np.float64,
+                count=2 * len(points)
+            )
+        except (KeyError, TypeError):
+            coords = np.fromiter(
+                (c for point in points for c in point_coords(point)),
+                dtype=np.float64,
+                count=2 * len(points)
+            )
+        np.round(coords, 5, out=coords)
+        coords += 0.0
         
-        # Criar hash como chave de cache
-        key_str = f"{start_str}_{waypoints_str}_{end_str}_{mode}"
-        hash_key = hashlib.md5(key_str.encode()).hexdigest()
+        # Criar hash como chave de cache (não criptográfico: 64 bits bastam para distinguir rotas)
+        digest = hashlib.blake2b(coords.tobytes(), digest_size=8)
+        digest.update(mode.encode())
         
-        return hash_key
+        return digest.hexdigest()
+
+# Instância única do processo, compartilhada pelo planejamento e pelos mapas
+_shared_cache = None
+_shared_cache_lock = threading.Lock()
+
+def shared_routing_cache():
+    """
+    Retorna o cache de rotas do processo, criado no primeiro uso
+    
+    Importar os módulos não abre o banco: a conexão, o diretório e a limpeza
+    das entradas expiradas só acontecem quando o cache é usado. Quem o usa
+    prefixa as próprias chaves ("plan:", "route:") para não colidirem.
+    """
+    global _shared_cache
+    if _shared_cache is None:
+        with _shared_cache_lock:
+            if _shared_cache is None:
+                _shared_cache = RoutingCache(max_age_hours=24)
+    return _shared_cache
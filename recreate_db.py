@@ -1,5 +1,6 @@
 import os
 import sqlite3
+from pathlib import Path
 from app.utils.database import setup_database
 
 def main():
@@ -12,15 +13,16 @@ def main():
     os.makedirs(db_dir, exist_ok=True)
     db_path = os.path.join(db_dir, "geocoding.db")
     
-    # Delete the existing database if it exists
-    if os.path.exists(db_path):
-        try:
-            print(f"Deleting existing database at {db_path}")
-            os.remove(db_path)
-            print("Existing database deleted successfully")
-        except Exception as e:
-            print(f"Error deleting database: {e}")
-            return
+    # Delete the existing database, if any, with its journal/WAL sidecars so
+    # SQLite never replays a stale journal into the new file
+    print(f"Deleting existing database at {db_path}")
+    try:
+        for suffix in ("", "-journal", "-wal", "-shm"):
+            Path(db_path + suffix).unlink(missing_ok=True)
+        print("Existing database deleted successfully")
+    except OSError as e:
+        print(f"Error deleting database: {e}")
+        return
     
     # Create a new database with the correct schema
     print("Creating new database with updated schema...")